@@ -14,7 +14,7 @@ def _reload():
     import importlib
 
     import ais_disabling
-    from ais_disabling import config, utils, model_utils, figure_utils, threshold_models
+    from ais_disabling import config, utils, model_utils, figure_utils, threshold_models, data_cache, query_cache, executor, planner, reception_measured, reception_sweep, gap_events, gap_stitcher, gap_features, position_index
 
     importlib.reload(ais_disabling)
     importlib.reload(utils)
@@ -22,3 +22,13 @@ def _reload():
     importlib.reload(model_utils)
     importlib.reload(figure_utils)
     importlib.reload(threshold_models)
+    importlib.reload(data_cache)
+    importlib.reload(query_cache)
+    importlib.reload(executor)
+    importlib.reload(planner)
+    importlib.reload(reception_measured)
+    importlib.reload(reception_sweep)
+    importlib.reload(gap_events)
+    importlib.reload(gap_stitcher)
+    importlib.reload(gap_features)
+    importlib.reload(position_index)
@@ -34,6 +34,10 @@ end_date = date(2019,12, 31)
 # Min gap hours in raw gaps table
 min_gap_hours = 6
 
+# Max number of BigQuery jobs to run at once and retries for transient errors
+max_parallel_jobs = 16
+max_job_retries = 3
+
 ###############################################
 # Dates to run
 ###############################################
@@ -96,9 +100,15 @@ ais_positions_hourly = f'ais_positions_byseg_hourly_{output_version}'
 loitering_positions_hourly_table = f'loitering_positions_hourly_{output_version}'
 gap_positions_hourly_table = f"gap_positions_hourly_{output_version}"
 
+# Reception quality grid resolution, in cells per degree
+# (1 for one degree, 2 for half a degree, 4 for a quarter degree)
+inverse_delta_degrees = 1
+reception_resolution = {1: 'one_degree', 2: 'half_degree', 4: 'quarter_degree'}.get(
+    inverse_delta_degrees, f'1_{inverse_delta_degrees}_degree')
+
 # Reception quality tables
-sat_reception_measured = f'sat_reception_measured_one_degree_{output_version}'
-sat_reception_smoothed = f'sat_reception_smoothed_one_degree_{output_version}'
+sat_reception_measured = f'sat_reception_measured_{reception_resolution}_{output_version}'
+sat_reception_smoothed = f'sat_reception_smoothed_{reception_resolution}_{output_version}'
 
 # Time lost to gaps tables
 raster_gaps_table = f'raster_gaps_{output_version}'
@@ -116,10 +126,10 @@ gap_positions_hourly = f'gap_positions_hourly_{output_version}'
 # Min/Max coordinates
 min_lon, min_lat, max_lon, max_lat  = -180, -90, 180, 90
 
-# Number of lat/lon bins
-inverse_delta_degrees = 1
-n_lat = (max_lat - min_lat) * inverse_delta_degrees
-n_lon = (max_lon - min_lon) * inverse_delta_degrees
+# Number of lat/lon bins at the reception grid resolution
+n_lat = int((max_lat - min_lat) * inverse_delta_degrees)
+n_lon = int((max_lon - min_lon) * inverse_delta_degrees)
 
-lons = np.arange(min_lon, max_lon+1)
-lats = np.arange(min_lat, max_lat+1)
+# Lower left corner of each bin, plus the upper edge
+lons = min_lon + np.arange(n_lon + 1) / inverse_delta_degrees
+lats = min_lat + np.arange(n_lat + 1) / inverse_delta_degrees
@@ -0,0 +1,209 @@
+# data_cache.py
+
+"""
+Local Parquet cache of the BigQuery tables that the analysis scripts read
+over and over. Each table is downloaded once per `config.output_version`
+into yearly Parquet files and queried locally with DuckDB, so rebuilding
+figures does not re-download the same data every session.
+
+BigQuery queries against cached tables can be passed to `read_gbq` in
+place of `pd.read_gbq`, e.g.
+
+    >>> from ais_disabling import data_cache
+    >>> df = data_cache.read_gbq(f'''
+    ...     SELECT gap_hours
+    ...     FROM `{config.destination_dataset}.{config.gap_events_features_table}`
+    ...     {config.gap_filters}''')
+"""
+
+import os
+import re
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import duckdb
+
+from . import config
+
+# Set AIS_DISABLING_CACHE to keep the cache somewhere other than the home folder
+CACHE_BASE_FOLDER = os.environ.get(
+    "AIS_DISABLING_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "ais_disabling")
+)
+
+PROJECT_ID = "world-fishing-827"
+
+# Cached tables. Each entry maps the local table name to the BigQuery
+# table and the column used to split the cache into yearly files
+# (None to keep the table in a single file).
+CACHED_TABLES = {
+    "gaps": (config.gap_events_features_table, "gap_start"),
+    "gaps_labeled": (config.gap_events_labeled_table, None),
+    "reception": (config.sat_reception_smoothed, "year"),
+    "reception_measured": (config.sat_reception_measured, None),
+    "fishing": (config.fishing_table, "month"),
+}
+
+# Matches backticked table references such as `dataset.table`
+# or `project.dataset.table`.
+TABLE_REFERENCE = re.compile(r"`(?:[\w-]+\.)?([\w-]+)\.([\w-]+)`")
+
+
+def get_cache_folder(output_version=config.output_version):
+    cache_folder = os.path.join(CACHE_BASE_FOLDER, output_version)
+    if not os.path.exists(cache_folder):
+        os.makedirs(cache_folder)
+    return cache_folder
+
+
+def _table_folder(name, output_version):
+    return os.path.join(get_cache_folder(output_version), name)
+
+
+def is_cached(name, output_version=config.output_version):
+    """Return True if the table has been fully downloaded."""
+    return os.path.exists(os.path.join(_table_folder(name, output_version), "_SUCCESS"))
+
+
+def _write_parquet(df, filename):
+    # Write to a temporary file first so an interrupted
+    # download never leaves a partial file in the cache.
+    tmp_filename = f"{filename}.tmp"
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp_filename)
+    os.replace(tmp_filename, filename)
+
+
+def cache_table(name, output_version=config.output_version, refresh=False):
+    """Download a table from BigQuery into the local cache.
+
+    Tables with a partition column are downloaded and stored one year at
+    a time, which keeps memory use down and lets DuckDB skip whole files
+    using the Parquet statistics.
+
+    Parameters
+    ----------
+    name : str
+        Local table name, one of the keys of `CACHED_TABLES`.
+    output_version : str
+        Version of the output tables to cache.
+    refresh : bool
+        Download the table again even if it is already cached.
+
+    Returns
+    -------
+    The folder holding the Parquet files for the table.
+    """
+    table, partition_column = CACHED_TABLES[name]
+    table = table.replace(config.output_version, output_version)
+    table_folder = _table_folder(name, output_version)
+
+    if is_cached(name, output_version) and not refresh:
+        return table_folder
+
+    if not os.path.exists(table_folder):
+        os.makedirs(table_folder)
+    for f in os.listdir(table_folder):
+        os.remove(os.path.join(table_folder, f))
+
+    source = f"`{config.destination_dataset}.{table}`"
+    print(f"Caching {config.destination_dataset}.{table} in {table_folder}")
+
+    if partition_column is None:
+        df = pd.read_gbq(f"SELECT * FROM {source}", project_id=PROJECT_ID, dialect="standard")
+        _write_parquet(df, os.path.join(table_folder, f"{name}.parquet"))
+    else:
+        if partition_column == "year":
+            year_expr = partition_column
+        else:
+            year_expr = f"EXTRACT(YEAR FROM {partition_column})"
+
+        years = pd.read_gbq(f"SELECT DISTINCT {year_expr} AS year FROM {source}",
+                            project_id=PROJECT_ID, dialect="standard")
+        for year in sorted(years.year.dropna().astype(int)):
+            df = pd.read_gbq(f"SELECT * FROM {source} WHERE {year_expr} = {year}",
+                             project_id=PROJECT_ID, dialect="standard")
+            _write_parquet(df, os.path.join(table_folder, f"{name}_{year}.parquet"))
+
+    open(os.path.join(table_folder, "_SUCCESS"), "w").close()
+    return table_folder
+
+
+def connect(names=None, output_version=config.output_version):
+    """Open a DuckDB connection with a view for each cached table.
+
+    Tables that have not been cached yet are downloaded first.
+
+    Parameters
+    ----------
+    names : list of str, default=None
+        Local table names to make available. All of `CACHED_TABLES` if None.
+    output_version : str
+        Version of the output tables to use.
+
+    Returns
+    -------
+    A DuckDB connection where each table can be queried by its local name.
+    """
+    if names is None:
+        names = list(CACHED_TABLES)
+
+    con = duckdb.connect()
+    for name in names:
+        table_folder = cache_table(name, output_version)
+        parquet_files = os.path.join(table_folder, "*.parquet").replace("'", "''")
+        con.execute(f"CREATE VIEW {name} AS SELECT * FROM read_parquet('{parquet_files}')")
+    return con
+
+
+def query(q, output_version=config.output_version):
+    """Run a query against the local cache and return a DataFrame.
+
+    The query refers to the tables by their local names, e.g.
+    `SELECT * FROM gaps WHERE gap_hours >= 12`.
+    """
+    names = [name for name in CACHED_TABLES if re.search(rf"\b{name}\b", q)]
+    con = connect(names, output_version)
+    try:
+        return con.execute(q).df()
+    finally:
+        con.close()
+
+
+def _local_table_names(output_version):
+    return {
+        table.replace(config.output_version, output_version): name
+        for name, (table, _) in CACHED_TABLES.items()
+    }
+
+
+def translate_query(q, output_version=config.output_version):
+    """Translate a BigQuery query to run against the local cache.
+
+    Backticked references to cached tables are replaced by their local
+    names and double quoted strings, which BigQuery treats as string
+    literals, are converted to single quotes.
+
+    Returns
+    -------
+    The translated query, or None if it does not read only from cached tables.
+    """
+    local_names = _local_table_names(output_version)
+
+    references = [m.group(2) for m in TABLE_REFERENCE.finditer(q)]
+    if not references or any(table not in local_names for table in references):
+        return None
+
+    q = TABLE_REFERENCE.sub(lambda m: local_names[m.group(2)], q)
+    return re.sub(r'"([^"]*)"', lambda m: "'" + m.group(1).replace("'", "''") + "'", q)
+
+
+def read_gbq(q, output_version=config.output_version, **kwargs):
+    """Drop-in replacement for `pd.read_gbq` that reads cached tables locally.
+
+    Queries that only read from tables in `CACHED_TABLES` are run against
+    the local cache. Anything else is sent to BigQuery with `pd.read_gbq`.
+    """
+    local_q = translate_query(q, output_version)
+    if local_q is None:
+        kwargs.setdefault("project_id", PROJECT_ID)
+        return pd.read_gbq(q, **kwargs)
+    return query(local_q, output_version)
@@ -0,0 +1,137 @@
+# executor.py
+
+"""
+In-process executor for the `jinja2 <template> -D ... | bq query ...`
+commands built by the `make_*` functions in `utils`. Templates are
+rendered in process and the queries run through `bq query` on a thread
+pool with a bounded number of concurrent jobs. Transient BigQuery errors
+are retried with exponential backoff, and every job reports its exit
+status, number of attempts and latency.
+"""
+
+import re
+import time
+import shlex
+import subprocess
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+
+from jinja2 import Template
+
+# bq errors that are worth retrying
+TRANSIENT_ERRORS = re.compile(
+    r"rateLimitExceeded|backendError|internalError|"
+    r"Retrying may solve the problem|Service Unavailable|Bad Gateway|"
+    r"Connection (?:reset|aborted|refused)|timed out",
+    re.IGNORECASE,
+)
+
+
+@dataclass
+class Job:
+    """A query job. Either `sql` is sent to `bq query` with `bq_args`,
+    or, for commands that are not a jinja2 | bq pipeline, `command`
+    is run in a shell."""
+
+    name: str
+    sql: str = None
+    bq_args: list = field(default_factory=list)
+    command: str = None
+
+
+@dataclass
+class JobResult:
+    name: str
+    returncode: int
+    attempts: int
+    seconds: float
+    stderr: str = ""
+
+    @property
+    def ok(self):
+        return self.returncode == 0
+
+
+def render_template(template_path, **params):
+    """Render a Jinja2 query template with the given parameters."""
+    with open(template_path) as f:
+        return Template(f.read()).render(**params)
+
+
+def job_from_command(cmd):
+    """Convert a `jinja2 <template> -D key=value ... | bq query ...`
+    command into a Job, rendering the template in process.
+
+    Commands in any other form are kept as shell commands.
+    """
+    # Drop shell line continuations before splitting into words
+    words = shlex.split(cmd.replace("\\\n", ""))
+    if "|" not in words:
+        return Job(name=cmd, command=cmd)
+
+    pipe = words.index("|")
+    render_words, bq_words = words[:pipe], words[pipe + 1:]
+    if render_words[:1] != ["jinja2"] or bq_words[:2] != ["bq", "query"]:
+        return Job(name=cmd, command=cmd)
+
+    template_path = render_words[1]
+    params = {}
+    rest = render_words[2:]
+    for flag, value in zip(rest[::2], rest[1::2]):
+        if flag != "-D":
+            return Job(name=cmd, command=cmd)
+        key, _, value = value.partition("=")
+        params[key] = value
+
+    bq_args = bq_words[2:]
+    destination = [a.split("=", 1)[1] for a in bq_args if a.startswith("--destination_table=")]
+    name = destination[0] if destination else template_path
+    return Job(name=name, sql=render_template(template_path, **params), bq_args=bq_args)
+
+
+def run_job(job, max_retries=3, backoff_seconds=5):
+    """Run a job, retrying transient failures with exponential backoff."""
+    start_time = time.time()
+    attempts = 0
+    while True:
+        attempts += 1
+        if job.sql is not None:
+            result = subprocess.run(["bq", "query", *job.bq_args], input=job.sql,
+                                    capture_output=True, text=True)
+        else:
+            result = subprocess.run(job.command, shell=True, capture_output=True, text=True)
+
+        transient = result.returncode != 0 and TRANSIENT_ERRORS.search(result.stderr + result.stdout)
+        if not transient or attempts > max_retries:
+            break
+        time.sleep(backoff_seconds * 2 ** (attempts - 1))
+
+    return JobResult(name=job.name,
+                     returncode=result.returncode,
+                     attempts=attempts,
+                     seconds=time.time() - start_time,
+                     stderr=result.stderr)
+
+
+def run_jobs(jobs, max_workers=16, max_retries=3, backoff_seconds=5):
+    """Run jobs with at most `max_workers` running at once.
+
+    Returns
+    -------
+    results : list of JobResult
+        One result per job, in the order the jobs were given.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(
+            lambda job: run_job(job, max_retries, backoff_seconds), jobs
+        ))
+
+    failed = [r for r in results if not r.ok]
+    seconds = sorted(r.seconds for r in results)
+    if seconds:
+        print(f"Ran {len(results)} jobs: {len(results) - len(failed)} succeeded, "
+              f"{len(failed)} failed, median {seconds[len(seconds) // 2]:.1f}s, "
+              f"max {seconds[-1]:.1f}s")
+    for r in failed:
+        print(f"FAILED {r.name} after {r.attempts} attempts:\n{r.stderr}")
+    return results
@@ -7,6 +7,8 @@ import seaborn as sns
 import numpy as np
 import pandas as pd
 
+from . import data_cache
+
 # Default styling
 import pyseas.maps as psm
 psm.use(psm.styles.chart_style)
@@ -69,7 +71,7 @@ def get_gridded_gaps(gaps_table, lowest_rec):
     GROUP BY lat_bin, lon_bin
     """
 
-    return pd.read_gbq(q, project_id="world-fishing-827", dialect="standard")
+    return data_cache.read_gbq(q, project_id="world-fishing-827", dialect="standard")
 
 def model_response_curves(model_12hb, model_18hb, model_24hb, model_rec_only, model_rec_12hb=None, model_rec_18hb=None, model_rec_24hb=None, images_folder=None):
     fig = plt.figure(figsize=(8, 6), dpi=300)
@@ -430,7 +432,7 @@ def gap_geartype_distributions(gaps_train_table, gaps_all_table, lowest_rec, ima
     )
     """
 
-    df_gaps_by_class = pd.read_gbq(q, project_id="world-fishing-827", dialect="standard")
+    df_gaps_by_class = data_cache.read_gbq(q, project_id="world-fishing-827", dialect="standard")
 
     ## Add proportions
     total_gaps_train = df_gaps_by_class[
@@ -599,7 +601,7 @@ def stats_for_paper(gaps_table, lowest_rec, model_column, ping_thresh):
         AND positions_per_day_off > {lowest_rec} 
     '''
     
-    df_labeled_gap_stats = pd.read_gbq(q, project_id="world-fishing-827", dialect="standard")
+    df_labeled_gap_stats = data_cache.read_gbq(q, project_id="world-fishing-827", dialect="standard")
     print("\nLABELED GAPS STATS\n---------------------")
     print(f"NUM GAPS: {df_labeled_gap_stats.iloc[0].num_gaps}")
     print(f"DISTINCT MMSI: {df_labeled_gap_stats.iloc[0].num_distinct_mmsi}")
@@ -0,0 +1,349 @@
+# gap_events.py
+
+"""
+Local implementation of `data_production/gaps/ais_off_on_events.sql.j2`.
+
+Positions from `research_messages` are stored as local Parquet partitions,
+one folder per day, and streamed a day at a time. Off and on events for
+every day are found in a single pass: only the two previous days are kept
+in memory, so the LEAD for a day's last positions is resolved by the next
+day and the LAG for its first positions by the previous day, instead of
+re-reading two or three days of messages for each day and event type.
+
+    >>> from ais_disabling import gap_events
+    >>> gap_events.cache_messages('2018-12-31', '2020-01-01')
+    >>> good_seg_ids = gap_events.get_good_seg_ids()
+    >>> off_events, on_events = gap_events.make_off_on_events(
+    ...     '2019-01-01', '2020-01-01', good_seg_ids=good_seg_ids)
+
+Events have the same columns as the BigQuery off and on events tables.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from . import config
+from . import data_cache
+from .position_index import PositionIndex
+
+PROJECT_ID = "world-fishing-827"
+
+# Columns of `research_messages` used by the query, with `regions`
+# flattened into `eez` and `rfmo`
+MESSAGE_COLUMNS = [
+    "ssvid",
+    "seg_id",
+    "msgid",
+    "timestamp",
+    "lat",
+    "lon",
+    "course",
+    "speed_knots",
+    "type",
+    "receiver_type",
+    "eez",
+    "rfmo",
+    "distance_from_shore_m",
+    "distance_from_port_m",
+]
+
+# Lookbacks of the `positions_X_hours_before` features of off events
+POSITIONS_BEFORE_HOURS = [6, 12, 18, 24]
+
+CLASS_A_TYPES = ["AIS.1", "AIS.2", "AIS.3"]
+CLASS_B_TYPES = ["AIS.18", "AIS.19"]
+
+
+def get_messages_folder(output_version=config.output_version):
+    return os.path.join(data_cache.get_cache_folder(output_version), "research_messages")
+
+
+def get_events_folder(event, output_version=config.output_version):
+    return os.path.join(data_cache.get_cache_folder(output_version), f"ais_{event}_events")
+
+
+def _partition_folder(folder, day):
+    return os.path.join(folder, f"date={day:%Y-%m-%d}")
+
+
+def cache_messages(start_date, end_date,
+                   output_version=config.output_version,
+                   pipeline_table=f"{config.pipeline_dataset}.{config.pipeline_table}",
+                   refresh=False):
+    """Download daily partitions of `research_messages` into the local
+    cache, one `date=YYYY-MM-DD` folder per day.
+
+    Off events for a day need the next day and on events the previous day,
+    so cache one extra day on either side of the days to run.
+
+    Parameters
+    ----------
+    start_date, end_date : str or date
+        Days to download, end date not inclusive.
+    output_version : str
+    pipeline_table : str
+        Table of messages, as `dataset.table`.
+    refresh : bool
+        Download days that are already cached again.
+    """
+    messages_folder = get_messages_folder(output_version)
+    columns = ", ".join(MESSAGE_COLUMNS[:-4])
+
+    for day in pd.date_range(start_date, end_date, inclusive="left"):
+        folder = _partition_folder(messages_folder, day)
+        filename = os.path.join(folder, "messages.parquet")
+        if os.path.exists(filename) and not refresh:
+            continue
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        print(f"Caching {pipeline_table} for {day.date()}")
+        df = pd.read_gbq(f"""SELECT {columns},
+                             regions.eez AS eez,
+                             ARRAY_TO_STRING(regions.rfmo, ", ") AS rfmo,
+                             distance_from_shore_m,
+                             distance_from_port_m
+                             FROM `{pipeline_table}`
+                             WHERE DATE(_partitiontime) = "{day.date()}"
+                          """, project_id=PROJECT_ID, dialect="standard")
+        data_cache._write_parquet(df, filename)
+
+
+def get_good_seg_ids(segs_table=f"{config.pipeline_dataset}.{config.segs_table}"):
+    """Segments used for off and on events."""
+    q = f"""
+    SELECT
+    seg_id
+    FROM `{segs_table}`
+    WHERE good_seg
+    """
+    return pd.read_gbq(q, project_id=PROJECT_ID, dialect="standard").seg_id.values
+
+
+def _empty_messages():
+    df = pd.DataFrame({c: pd.Series(dtype=object) for c in MESSAGE_COLUMNS})
+    df["timestamp"] = pd.Series(dtype="datetime64[ns, UTC]")
+    return df
+
+
+def _read_day(messages_folder, day, good_seg_ids):
+    folder = _partition_folder(messages_folder, day)
+    if not os.path.exists(folder):
+        return _empty_messages()
+
+    df = pq.read_table(folder, columns=MESSAGE_COLUMNS).to_pandas()
+    df["timestamp"] = pd.to_datetime(df.timestamp, utc=True)
+    return df[df.seg_id.isin(good_seg_ids)]
+
+
+def _window(*days):
+    """Concatenate days of messages, sorted by vessel and time.
+
+    Messages at the same time are ordered by msgid so the
+    results don't depend on the order they were read in.
+    """
+    days = [df for df in days if len(df)] or [_empty_messages()]
+    df = pd.concat(days, ignore_index=True)
+    return df.sort_values(["ssvid", "timestamp", "msgid"], kind="mergesort", ignore_index=True)
+
+
+def _on_day(timestamps, day):
+    return (timestamps.dt.floor("D") == day.tz_localize("UTC")).values
+
+
+def _ais_class(message_type):
+    return np.select([np.isin(message_type, CLASS_A_TYPES),
+                      np.isin(message_type, CLASS_B_TYPES)],
+                     ["A", "B"], default=None)
+
+
+def _gap_exceeds(start, end, min_gap_hours):
+    """TIMESTAMP_DIFF(end, start, MINUTE) / 60 > min_gap_hours"""
+    minutes = (end - start).dt.total_seconds() // 60
+    return (minutes / 60 > min_gap_hours).values
+
+
+def _event_fields(df, event, other_msgid, other_timestamp):
+    other = "next" if event == "off" else "prev"
+    return pd.DataFrame({
+        "ssvid": df.ssvid.values,
+        f"{event}_seg_id": df.seg_id.values,
+        f"{event}_msgid": df.msgid.values,
+        f"{event}_timestamp": df.timestamp.array,
+        f"{other}_msgid": other_msgid,
+        f"{other}_timestamp": other_timestamp,
+        f"{event}_lat": df.lat.values,
+        f"{event}_lon": df.lon.values,
+        f"{event}_course": df.course.values,
+        f"{event}_speed_knots": df.speed_knots.values,
+        f"{event}_class": _ais_class(df.type.values),
+        f"{event}_receiver_type": df.receiver_type.values,
+        f"{event}_distance_from_shore_m": df.distance_from_shore_m.values,
+        f"{event}_distance_from_port_m": df.distance_from_port_m.values,
+        f"{event}_eez_id": df.eez.values,
+        f"{event}_rfmo": df.rfmo.values,
+    })
+
+
+def _off_events(day, window, lookback, min_gap_hours):
+    """Off events on `day`, from messages of `day` and the next day in
+    `window` and of the previous day and `day` in `lookback`."""
+    same_vessel = window.ssvid.shift(-1).values == window.ssvid.values
+    next_msgid = window.msgid.shift(-1).where(same_vessel)
+    next_timestamp = window.timestamp.shift(-1).where(same_vessel)
+
+    is_event = _on_day(window.timestamp, day) & (
+        ~same_vessel | _gap_exceeds(window.timestamp, next_timestamp, min_gap_hours))
+
+    events = _event_fields(window[is_event], "off",
+                           next_msgid.values[is_event], next_timestamp[is_event].array)
+
+    # Positions before the gap, over good segments of the day and the day before
+    index = PositionIndex.from_messages(lookback[lookback.ssvid.isin(events.ssvid.unique())])
+    return pd.concat([events, index.positions_before(events.ssvid.values, events.off_timestamp,
+                                                     POSITIONS_BEFORE_HOURS)], axis=1)
+
+
+def _on_events(day, window, min_gap_hours):
+    """On events on `day`, from messages of the previous day and `day` in `window`."""
+    same_vessel = window.ssvid.shift(1).values == window.ssvid.values
+    prev_msgid = window.msgid.shift(1).where(same_vessel)
+    prev_timestamp = window.timestamp.shift(1).where(same_vessel)
+
+    is_event = _on_day(window.timestamp, day) & (
+        ~same_vessel | _gap_exceeds(prev_timestamp, window.timestamp, min_gap_hours))
+
+    return _event_fields(window[is_event], "on",
+                         prev_msgid.values[is_event], prev_timestamp[is_event].array)
+
+
+def iter_off_on_events(start_date, end_date,
+                       messages_folder=None,
+                       good_seg_ids=None,
+                       min_gap_hours=config.min_gap_hours):
+    """Stream off and on events, one day at a time.
+
+    Each day of messages is read once. The messages of the previous two
+    days are carried over as state: the previous day to find the next
+    position after the last positions of that day, and the day before it
+    for the positions before the gap of that day's off events.
+
+    Parameters
+    ----------
+    start_date, end_date : str or date
+        Days to find events for, end date not inclusive. Messages are read
+        from the day before `start_date` up to and including `end_date`.
+    messages_folder : str, default=None
+        Folder of messages, with one `date=YYYY-MM-DD` folder per day.
+        Defaults to the folder filled by `cache_messages`.
+    good_seg_ids : array, default=None
+        Segments to use. Defaults to `get_good_seg_ids()`, as in the query.
+    min_gap_hours : float
+        Minimum length of a closed event to be included.
+
+    Yields
+    ------
+    day : Timestamp
+    off_events : DataFrame
+    on_events : DataFrame
+    """
+    start_date, end_date = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    if messages_folder is None:
+        messages_folder = get_messages_folder()
+    if good_seg_ids is None:
+        good_seg_ids = get_good_seg_ids()
+
+    before_yesterday = yesterday = _empty_messages()
+    on_events = None
+    for day in pd.date_range(start_date - pd.Timedelta(days=1), end_date):
+        today = _read_day(messages_folder, day, good_seg_ids)
+        window = _window(yesterday, today)
+
+        # Yesterday's off events are complete now that today is read
+        event_day = day - pd.Timedelta(days=1)
+        if event_day >= start_date:
+            off_events = _off_events(event_day, window,
+                                     _window(before_yesterday, yesterday), min_gap_hours)
+            yield event_day, off_events, on_events
+
+        if start_date <= day < end_date:
+            on_events = _on_events(day, window, min_gap_hours)
+
+        before_yesterday, yesterday = yesterday, today
+
+
+def build_position_index(start_date, end_date,
+                         messages_folder=None,
+                         good_seg_ids=None,
+                         ssvids=None):
+    """Index the message times of the days from `start_date` up to
+    `end_date`, not inclusive, to count positions before gaps with
+    `PositionIndex.positions_before`.
+
+    Parameters
+    ----------
+    start_date, end_date : str or date
+        Days to index. Include the longest lookback before the first gap.
+    messages_folder : str, default=None
+        Defaults to the folder filled by `cache_messages`.
+    good_seg_ids : array, default=None
+        Segments to use. Defaults to `get_good_seg_ids()`, as in the query.
+    ssvids : array, default=None
+        Vessels to index, e.g. the vessels with gaps. All vessels if None.
+
+    Returns
+    -------
+    PositionIndex
+    """
+    if messages_folder is None:
+        messages_folder = get_messages_folder()
+    if good_seg_ids is None:
+        good_seg_ids = get_good_seg_ids()
+
+    days = []
+    for day in pd.date_range(start_date, end_date, inclusive="left"):
+        folder = _partition_folder(messages_folder, day)
+        if not os.path.exists(folder):
+            continue
+        df = pq.read_table(folder, columns=["ssvid", "seg_id", "timestamp", "receiver_type"]).to_pandas()
+        df = df[df.seg_id.isin(good_seg_ids)]
+        if ssvids is not None:
+            df = df[df.ssvid.isin(ssvids)]
+        days.append(df)
+
+    messages = pd.concat(days, ignore_index=True) if days else _empty_messages()
+    return PositionIndex.from_messages(messages)
+
+
+def make_off_on_events(start_date, end_date,
+                       messages_folder=None,
+                       good_seg_ids=None,
+                       min_gap_hours=config.min_gap_hours,
+                       output_version=None):
+    """Off and on events for the days from `start_date` up to `end_date`,
+    not inclusive. See `iter_off_on_events` for the parameters.
+
+    If `output_version` is given, each day of events is also written to
+    `ais_off_events/date=YYYY-MM-DD/events.parquet` and
+    `ais_on_events/date=YYYY-MM-DD/events.parquet` in the local cache.
+
+    Returns
+    -------
+    off_events, on_events : DataFrame
+    """
+    all_off_events, all_on_events = [], []
+    for day, off_events, on_events in iter_off_on_events(start_date, end_date, messages_folder,
+                                                         good_seg_ids, min_gap_hours):
+        if output_version is not None:
+            for event, events in [("off", off_events), ("on", on_events)]:
+                folder = _partition_folder(get_events_folder(event, output_version), day)
+                if not os.path.exists(folder):
+                    os.makedirs(folder)
+                data_cache._write_parquet(events, os.path.join(folder, "events.parquet"))
+        all_off_events.append(off_events)
+        all_on_events.append(on_events)
+
+    return (pd.concat(all_off_events, ignore_index=True),
+            pd.concat(all_on_events, ignore_index=True))
@@ -0,0 +1,238 @@
+# gap_features.py
+
+"""
+Local implementation of `data_production/gaps/ais_gap_events_features.sql.j2`
+and of the gap features of `ais_gap_events.sql.j2`.
+
+Gap duration, distance and implied speed are computed over whole columns,
+and satellite reception at the start and end of each gap is read straight
+from an array of smoothed reception indexed by month, class and grid cell
+instead of two joins, so the model features can be regenerated for a new
+version of the reception in seconds:
+
+    >>> from ais_disabling import gap_features, gap_stitcher
+    >>> reception = gap_features.get_smoothed_reception()
+    >>> vessel_info = gap_features.get_vessel_info()
+    >>> features = gap_features.make_gap_features(
+    ...     gap_stitcher.read_gap_events(), reception, vessel_info,
+    ...     config.start_date, config.end_date)
+"""
+
+import numpy as np
+import pandas as pd
+
+from . import config
+from . import data_cache
+
+# BigQuery's ST_DISTANCE uses a sphere with this radius
+EARTH_RADIUS_M = 6371008.8
+
+# Reception classes, in the order of the class axis of the reception array
+RECEPTION_CLASSES = ["A", "B"]
+
+# Vessel classes kept by name, all others are 'other'
+VESSEL_CLASSES = ["trawlers", "drifting_longlines", "squid_jigger", "tuna_purse_seines"]
+
+# Columns of the gap events features table
+FEATURE_COLUMNS = [
+    "ssvid", "gap_id", "off_class", "on_class", "off_receiver_type", "on_receiver_type",
+    "vessel_class", "vessel_length_m", "vessel_tonnage_gt", "flag", "rfmo", "year",
+    "off_lat", "off_lon", "on_lat", "on_lon",
+    "off_distance_from_shore_m", "on_distance_from_shore_m",
+    "gap_start", "gap_end", "gap_hours", "gap_distance_m", "gap_implied_speed_knots",
+    "positions_per_day_on", "positions_per_day_off",
+    "positions_6_hours_before", "positions_6_hours_before_sat",
+    "positions_12_hours_before", "positions_12_hours_before_sat",
+    "positions_18_hours_before", "positions_18_hours_before_sat",
+    "positions_24_hours_before", "positions_24_hours_before_sat",
+]
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Great circle distance in meters, as ST_DISTANCE between two points."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(x, dtype=float)) for x in (lat1, lon1, lat2, lon2))
+    a = (np.sin((lat2 - lat1) / 2)**2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2)
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+
+def gap_hours(gap_start, gap_end):
+    """TIMESTAMP_DIFF(gap_end, gap_start, MINUTE) / 60"""
+    return ((pd.Series(gap_end) - pd.Series(gap_start)).dt.total_seconds() // 60).values / 60
+
+
+def implied_speed_knots(distance_m, hours):
+    return np.asarray(distance_m, dtype=float) / 1852 / np.asarray(hours, dtype=float)
+
+
+def get_smoothed_reception(table=config.sat_reception_smoothed):
+    """Smoothed reception, read through the local data cache."""
+    return data_cache.read_gbq(f"""
+    SELECT year, month, lat_bin, lon_bin, class, positions_per_day
+    FROM `{config.destination_dataset}.{table}`
+    """, dialect="standard")
+
+
+def get_vessel_info(vi_version=config.vi_version):
+    """Fishing vessels by year with their vessel information, as in the
+    `all_vessel_info` subquery."""
+    q = f"""
+    WITH vessel_info AS (
+    SELECT
+      ssvid,
+      year,
+      best.best_flag as flag,
+      IF(best.registry_net_disagreement = 'squid_jigger,pole_and_line',
+         'squid_jigger', best.best_vessel_class) as vessel_class,
+      best.best_length_m as vessel_length_m,
+      best.best_tonnage_gt as vessel_tonnage_gt
+    FROM `gfw_research.vi_ssvid_byyear_{vi_version}`
+    )
+    SELECT *
+    FROM `gfw_research.fishing_vessels_ssvid_{vi_version}`
+    LEFT JOIN vessel_info
+    USING(ssvid, year)
+    """
+    vessel_info = data_cache.read_gbq(q, dialect="standard")
+    vessel_info["vessel_class"] = vessel_info.vessel_class.where(
+        vessel_info.vessel_class.isin(VESSEL_CLASSES), "other")
+    return vessel_info
+
+
+def reception_array(reception, inverse_delta_degrees=config.inverse_delta_degrees):
+    """Smoothed reception as an array indexed by month, class, lat and lon cell.
+
+    Parameters
+    ----------
+    reception : DataFrame
+        Smoothed reception with `year`, `month`, `lat_bin`, `lon_bin`,
+        `class` and `positions_per_day`.
+    inverse_delta_degrees : int
+        Resolution of the grid, in cells per degree.
+
+    Returns
+    -------
+    months : array
+        Sorted months in the reception, as `year * 12 + month - 1`.
+    grid : array
+        Reception of shape (len(months), 2, n_lat, n_lon), NaN where there is
+        no reception. Negative reception is set to 0, as in `sat_reception`.
+    """
+    n_lat = int((config.max_lat - config.min_lat) * inverse_delta_degrees)
+    n_lon = int((config.max_lon - config.min_lon) * inverse_delta_degrees)
+
+    months, month_index = np.unique(reception.year.values * 12 + reception.month.values - 1,
+                                    return_inverse=True)
+    cls = pd.Index(RECEPTION_CLASSES).get_indexer(reception["class"])
+    rows = np.round((reception.lat_bin.values - config.min_lat) * inverse_delta_degrees).astype(int)
+    cols = np.round((reception.lon_bin.values - config.min_lon) * inverse_delta_degrees).astype(int)
+    keep = (cls >= 0) & (rows >= 0) & (rows < n_lat) & (cols >= 0) & (cols < n_lon)
+
+    grid = np.full((len(months), len(RECEPTION_CLASSES), n_lat, n_lon), np.nan)
+    grid[month_index[keep], cls[keep], rows[keep], cols[keep]] = np.maximum(
+        reception.positions_per_day.values[keep].astype(float), 0)
+    return months, grid
+
+
+def lookup_reception(months, grid, year, month, cls, lat, lon,
+                     inverse_delta_degrees=config.inverse_delta_degrees):
+    """Reception in the grid cell of each point, for its month and class.
+
+    Points with no reception, as where the join in the query finds no
+    row, are NaN.
+    """
+    key = np.asarray(year) * 12 + np.asarray(month) - 1
+    month_index = np.minimum(np.searchsorted(months, key), len(months) - 1)
+    cls = pd.Index(RECEPTION_CLASSES).get_indexer(pd.Series(cls))
+
+    lat, lon = np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)
+    valid = np.isfinite(lat) & np.isfinite(lon) & (cls >= 0) & (len(months) > 0)
+    valid[valid] = months[month_index[valid]] == key[valid]
+    rows = np.floor(np.where(valid, lat, 0) * inverse_delta_degrees).astype(int) \
+        - int(config.min_lat * inverse_delta_degrees)
+    cols = np.floor(np.where(valid, lon, 0) * inverse_delta_degrees).astype(int) \
+        - int(config.min_lon * inverse_delta_degrees)
+    _, _, n_lat, n_lon = grid.shape
+    valid &= (rows >= 0) & (rows < n_lat) & (cols >= 0) & (cols < n_lon)
+
+    positions_per_day = np.full(len(valid), np.nan)
+    positions_per_day[valid] = grid[month_index[valid], cls[valid], rows[valid], cols[valid]]
+    return positions_per_day
+
+
+def make_gap_features(gaps, reception, vessel_info, start_date, end_date,
+                      inverse_delta_degrees=config.inverse_delta_degrees):
+    """Gap events features, as in `ais_gap_events_features.sql.j2`.
+
+    Parameters
+    ----------
+    gaps : DataFrame
+        Gap events, e.g. from `gap_stitcher.read_gap_events`.
+    reception : DataFrame or tuple
+        Smoothed reception, e.g. from `get_smoothed_reception`, or the
+        `(months, grid)` returned by `reception_array` to reuse it across calls.
+    vessel_info : DataFrame
+        Fishing vessels by `ssvid` and `year`, e.g. from `get_vessel_info`.
+    start_date, end_date : str or date
+        First and last day of `gap_start`, inclusive. Gaps must also end
+        by `end_date`.
+    inverse_delta_degrees : int
+        Resolution of the reception grid, in cells per degree.
+
+    Returns
+    -------
+    DataFrame with `FEATURE_COLUMNS`
+    """
+    if isinstance(reception, pd.DataFrame):
+        reception = reception_array(reception, inverse_delta_degrees)
+    months, grid = reception
+
+    start_date, end_date = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    gap_start_day = gaps.gap_start.dt.floor("D").dt.tz_localize(None)
+    gap_end_day = gaps.gap_end.dt.floor("D").dt.tz_localize(None)
+    gaps = gaps[(gap_start_day >= start_date) & (gap_start_day <= end_date)
+                & (gap_end_day <= end_date)
+                & gaps.gap_start_class.notna()
+                & (gaps.is_closed == True)]
+
+    features = pd.DataFrame({
+        "ssvid": gaps.ssvid.values,
+        "gap_id": gaps.gap_id.values,
+        "off_class": gaps.gap_start_class.values,
+        "on_class": gaps.gap_end_class.values,
+        "off_receiver_type": gaps.gap_start_receiver_type.values,
+        "on_receiver_type": gaps.gap_end_receiver_type.values,
+        "rfmo": gaps.gap_start_rfmo.values,
+        "year": gaps.gap_start.dt.year.values,
+        "month": gaps.gap_start.dt.month.values,
+        "off_lat": gaps.gap_start_lat.values,
+        "off_lon": gaps.gap_start_lon.values,
+        "on_lat": gaps.gap_end_lat.values,
+        "on_lon": gaps.gap_end_lon.values,
+        "off_distance_from_shore_m": gaps.gap_start_distance_from_shore_m.values,
+        "on_distance_from_shore_m": gaps.gap_end_distance_from_shore_m.values,
+        "gap_start": gaps.gap_start.array,
+        "gap_end": gaps.gap_end.array,
+    })
+    for column in [c for c in FEATURE_COLUMNS if c.startswith("positions_") and "per_day" not in c]:
+        features[column] = gaps[column].fillna(0).values
+
+    # Only fishing vessels
+    features = features.merge(vessel_info[["ssvid", "year", "vessel_class", "vessel_length_m",
+                                           "vessel_tonnage_gt", "flag"]],
+                              on=["ssvid", "year"])
+
+    features["gap_hours"] = gap_hours(features.gap_start, features.gap_end)
+    features["gap_distance_m"] = haversine_m(features.off_lat, features.off_lon,
+                                             features.on_lat, features.on_lon)
+    features["gap_implied_speed_knots"] = implied_speed_knots(features.gap_distance_m,
+                                                              features.gap_hours)
+
+    for event in ["off", "on"]:
+        features[f"positions_per_day_{event}"] = lookup_reception(
+            months, grid, features.year.values, features.month.values,
+            features[f"{event}_class"].values,
+            features[f"{event}_lat"].values, features[f"{event}_lon"].values,
+            inverse_delta_degrees)
+
+    return features[FEATURE_COLUMNS]
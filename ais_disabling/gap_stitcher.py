@@ -0,0 +1,414 @@
+# gap_stitcher.py
+
+"""
+Incremental version of `data_production/gaps/ais_gap_events.sql.j2`.
+
+The query stitches every off and on event up to the run date into gaps and
+overwrites the whole gap events table on every run. Here the off events
+that are still open are kept as state between runs, so each day only the
+new on events are paired, with the open off events and the day's new off
+events. Closed gaps are stored in local Parquet partitions by the date of
+`gap_start` and only the partitions that gained gaps are rewritten. Gaps
+that are still open are kept in a separate file that is replaced every day.
+
+    >>> from ais_disabling import gap_events, gap_stitcher
+    >>> events = gap_events.iter_off_on_events('2019-01-01', '2020-01-01',
+    ...                                        good_seg_ids=good_seg_ids)
+    >>> gap_stitcher.stitch_gaps(events)
+    >>> gaps = gap_stitcher.read_gap_events()
+
+History can also be backfilled at once with `backfill_gap_events`, after
+which daily stitching continues from the open gaps it leaves:
+
+    >>> off_events, on_events = gap_events.make_off_on_events('2017-01-01', '2020-01-01')
+    >>> gap_stitcher.backfill_gap_events(off_events, on_events, '2019-12-31')
+
+`read_gap_events` returns the same rows as the query run for the last
+stitched day, with the same `gap_id` and `is_closed`. Pairing, in
+`pair_gap_events`, sorts the events once per vessel and time and finds
+the off event closed by each on event with a binary search, instead of
+joining every off event to every later on event. It assumes that
+the off and on events come from the same messages, so every on event
+closes at most one open gap and every gap is closed once.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+
+from . import config
+from . import data_cache
+from .position_index import micros
+from .gap_features import haversine_m, gap_hours, implied_speed_knots
+
+# Columns of the gap events table
+GAP_COLUMNS = [
+    "ssvid", "gap_id", "gap_start", "gap_end", "gap_hours",
+    "gap_distance_m", "gap_implied_speed_knots",
+    "gap_start_seg_id", "gap_start_msgid", "gap_start_lat", "gap_start_lon",
+    "gap_start_course", "gap_start_speed_knots", "gap_start_class",
+    "gap_start_receiver_type", "gap_start_distance_from_shore_m",
+    "gap_start_distance_from_port_m", "gap_start_eez", "gap_start_rfmo",
+    "gap_end_seg_id", "gap_end_msgid", "gap_end_lat", "gap_end_lon",
+    "gap_end_course", "gap_end_speed_knots", "gap_end_class",
+    "gap_end_receiver_type", "gap_end_distance_from_shore_m",
+    "gap_end_distance_from_port_m", "gap_end_eez", "gap_end_rfmo",
+    "positions_6_hours_before", "positions_12_hours_before",
+    "positions_18_hours_before", "positions_24_hours_before",
+    "positions_6_hours_before_sat", "positions_12_hours_before_sat",
+    "positions_18_hours_before_sat", "positions_24_hours_before_sat",
+    "is_closed",
+]
+
+STATE_FILE = "state.json"
+OPEN_OFF_EVENTS_FILE = "open_off_events.parquet"
+OPEN_GAPS_FILE = "open_gaps.parquet"
+
+
+def get_gaps_folder(output_version=config.output_version):
+    return os.path.join(data_cache.get_cache_folder(output_version), "ais_gap_events")
+
+
+def _partition_file(gaps_folder, day):
+    return os.path.join(gaps_folder, f"date={day:%Y-%m-%d}", "gaps.parquet")
+
+
+def _format_timestamp(timestamps):
+    """Timestamps as formatted by `%t` in BigQuery, e.g.
+    `2019-01-01 07:52:43.6692+00`, without trailing zeros in the fraction."""
+    seconds = timestamps.dt.strftime("%Y-%m-%d %H:%M:%S")
+    fraction = [f".{us:06d}".rstrip("0") if us else "" for us in timestamps.dt.microsecond]
+    return [f"{s}{f}+00" for s, f in zip(seconds, fraction)]
+
+
+def gap_ids(ssvid, off_timestamp, off_lat, off_lon):
+    """TO_HEX(MD5(FORMAT("%s|%t|%f|%f", ssvid, off_timestamp,
+    IFNULL(off_lat, 0.0), IFNULL(off_lon, 0.0))))"""
+    off_lat = np.nan_to_num(np.asarray(off_lat, dtype=float), nan=0.0)
+    off_lon = np.nan_to_num(np.asarray(off_lon, dtype=float), nan=0.0)
+    return [
+        hashlib.md5(f"{s}|{t}|{lat:f}|{lon:f}".encode("utf-8")).hexdigest()
+        for s, t, lat, lon in zip(ssvid, _format_timestamp(pd.Series(off_timestamp)), off_lat, off_lon)
+    ]
+
+
+def _gap_rows(gaps, day):
+    """Gap rows, as in the `gaps_features` CTE and the final SELECT, from
+    paired off and on events. Open gaps have no on event and are measured
+    up to the end of `day`."""
+    is_closed = gaps.on_timestamp.notna().values
+    end_of_day = pd.Timestamp(day).tz_localize("UTC") + pd.Timedelta(seconds=86399)
+    gap_end = gaps.on_timestamp.where(is_closed, end_of_day)
+    hours = gap_hours(gaps.off_timestamp, gap_end)
+
+    keep = (gaps.off_distance_from_shore_m > 0).values & (
+        ~is_closed | (gaps.on_distance_from_shore_m > 0).values)
+    gaps, hours, is_closed = gaps[keep], hours[keep], is_closed[keep]
+
+    gap_distance_m = haversine_m(gaps.off_lat, gaps.off_lon, gaps.on_lat, gaps.on_lon)
+    rows = pd.DataFrame({
+        "ssvid": gaps.ssvid.values,
+        "gap_id": gap_ids(gaps.ssvid.values, gaps.off_timestamp, gaps.off_lat, gaps.off_lon),
+        "gap_start": gaps.off_timestamp.array,
+        "gap_end": gaps.on_timestamp.array,
+        "gap_hours": hours,
+        "gap_distance_m": gap_distance_m,
+        "gap_implied_speed_knots": implied_speed_knots(gap_distance_m, hours),
+    })
+    for prefix, event in [("gap_start", "off"), ("gap_end", "on")]:
+        for field in ["seg_id", "msgid", "lat", "lon", "course", "speed_knots", "class",
+                      "receiver_type", "distance_from_shore_m", "distance_from_port_m"]:
+            rows[f"{prefix}_{field}"] = gaps[f"{event}_{field}"].values
+        rows[f"{prefix}_eez"] = gaps[f"{event}_eez_id"].values
+        rows[f"{prefix}_rfmo"] = gaps[f"{event}_rfmo"].values
+    for column in [c for c in GAP_COLUMNS if c.startswith("positions_")]:
+        rows[column] = gaps[column].values
+    rows["is_closed"] = is_closed
+    return rows[GAP_COLUMNS]
+
+
+def _expand(left, right):
+    """Concatenate the ranges [left, right)."""
+    counts = right - left
+    starts = np.repeat(left - np.cumsum(counts) + counts, counts)
+    return starts + np.arange(counts.sum())
+
+
+def _searchsorted(a, v, side="left"):
+    """np.searchsorted, with the values searched in sorted order, which
+    is much faster for large arrays."""
+    order = np.argsort(v)
+    index = np.empty(len(v), dtype=np.int64)
+    index[order] = np.searchsorted(a, v[order], side=side)
+    return index
+
+
+def _latest_open(ssvid, off_time, is_open):
+    """Open gaps all have a NULL on_timestamp and are ranked together,
+    so only the latest open off events of each vessel are kept."""
+    is_open = is_open.copy()
+    open_index = np.flatnonzero(is_open)
+    times = pd.Series(off_time[open_index])
+    latest = times.groupby(ssvid[open_index], dropna=False).transform("max").values
+    is_open[open_index[times.values != latest]] = False
+    return is_open
+
+
+def pair_gap_events(off_events, on_events, day):
+    """Pair off and on events into gaps, as in the `events_join` and
+    `gaps` CTEs of the query run for `day`.
+
+    An on event with a previous position closes the off event at that
+    position. An on event without one closes the latest off event of the
+    vessel before it without a next position, or with its next position
+    the day after `day`. The latest off events of each vessel with no
+    later on event are open gaps.
+
+    Instead of joining every off event to every later on event of the
+    vessel, events are keyed by vessel and time and sorted once, so each
+    on event finds its off event with a binary search.
+
+    Parameters
+    ----------
+    off_events, on_events : DataFrame
+        All events up to and including `day`.
+    day : str or date
+
+    Returns
+    -------
+    off_index, on_index : array
+        Positions in `off_events` and `on_events` of each closed gap.
+    is_open : array of bool
+        Whether each off event is an open gap.
+    """
+    tomorrow = pd.Timestamp(day) + pd.Timedelta(days=1)
+    next_missing = off_events.next_timestamp.isna().values
+    next_day = off_events.next_timestamp.dt.floor("D").dt.tz_localize(None)
+    open_ended = next_missing | (next_day == tomorrow).values
+
+    n_off = len(off_events)
+    none = np.array([], dtype=np.int64)
+    if n_off == 0:
+        return none, none, open_ended
+    off_time = micros(off_events.off_timestamp)
+    if len(on_events) == 0:
+        return none, none, _latest_open(off_events.ssvid.values, off_time, open_ended)
+
+    codes, _ = pd.factorize(np.concatenate([off_events.ssvid.values, on_events.ssvid.values]))
+    off_codes, on_codes = codes[:n_off].astype(np.int64), codes[n_off:].astype(np.int64)
+
+    next_time = micros(off_events.next_timestamp)
+    prev_missing = on_events.prev_timestamp.isna().values
+    prev_time = micros(on_events.prev_timestamp)
+    on_exact = np.flatnonzero(~prev_missing)
+
+    # Keys are the vessel in the high bits and the rank of the time in the low bits
+    on_time = micros(on_events.on_timestamp)
+    times, ranks = np.unique(np.concatenate([off_time, on_time, prev_time[on_exact]]),
+                             return_inverse=True)
+    bits = max(len(times).bit_length(), 1)
+    off_keys = (off_codes << bits) | ranks[:n_off]
+    on_keys = (on_codes << bits) | ranks[n_off:n_off + len(on_time)]
+    prev_keys = (on_codes[on_exact] << bits) | ranks[n_off + len(on_time):]
+    off_order = np.argsort(off_keys, kind="stable")
+    sorted_keys = off_keys[off_order]
+
+    # On events with a previous position close the off event at that position
+    left = _searchsorted(sorted_keys, prev_keys, side="left")
+    right = _searchsorted(sorted_keys, prev_keys, side="right")
+    exact_on = np.repeat(on_exact, right - left)
+    exact_off = off_order[_expand(left, right)]
+    match = (~next_missing[exact_off]
+             & (next_time[exact_off] == on_time[exact_on])
+             & (off_time[exact_off] < on_time[exact_on]))
+    exact_off, exact_on = exact_off[match], exact_on[match]
+
+    # The others close the latest off event before them without a next position
+    eligible = off_order[open_ended[off_order]]
+    eligible_keys = off_keys[eligible]
+    on_latest = np.flatnonzero(prev_missing)
+    latest = _searchsorted(eligible_keys, on_keys[on_latest], side="left") - 1
+    found = latest >= 0
+    found[found] = (eligible_keys[latest[found]] >> bits) == on_codes[on_latest[found]]
+    on_latest, latest = on_latest[found], latest[found]
+    # Off events at the same time rank the same
+    left = _searchsorted(eligible_keys, eligible_keys[latest], side="left")
+    latest_on = np.repeat(on_latest, latest + 1 - left)
+    latest_off = eligible[_expand(left, latest + 1)]
+
+    # Off events with no later on event of the vessel stay open
+    sorted_on_keys = np.sort(on_keys)
+    after = np.minimum(_searchsorted(sorted_on_keys, off_keys, side="right"), len(on_keys) - 1)
+    has_later_on = ((sorted_on_keys[after] >> bits) == off_codes) & (sorted_on_keys[after] > off_keys)
+    is_open = _latest_open(off_events.ssvid.values, off_time, ~has_later_on & open_ended)
+
+    return (np.concatenate([exact_off, latest_off]),
+            np.concatenate([exact_on, latest_on]),
+            is_open)
+
+
+def _no_on_events(on_events, n):
+    """Missing on events for open gaps, as in the LEFT JOIN."""
+    return on_events.iloc[:0].reindex(np.arange(n))
+
+
+def _join_events(off_events, on_events):
+    """Off events side by side with the on events that close them."""
+    return pd.concat([off_events.reset_index(drop=True),
+                      on_events.drop(columns="ssvid").reset_index(drop=True)], axis=1)
+
+
+def make_gap_events(off_events, on_events, day):
+    """Gap events, closed and open, from all off and on events up to and
+    including `day`. Same rows as the query run for `day`."""
+    off_index, on_index, is_open = pair_gap_events(off_events, on_events, day)
+    gaps = _join_events(off_events.iloc[off_index], on_events.iloc[on_index])
+    open_gaps = _join_events(off_events[is_open], _no_on_events(on_events, is_open.sum()))
+    return _gap_rows(gaps, day), _gap_rows(open_gaps, day)
+
+
+def _load_state(gaps_folder):
+    state_file = os.path.join(gaps_folder, STATE_FILE)
+    if not os.path.exists(state_file):
+        return None, None
+    with open(state_file) as f:
+        last_day = pd.Timestamp(json.load(f)["last_day"])
+    open_off_events = pd.read_parquet(os.path.join(gaps_folder, OPEN_OFF_EVENTS_FILE))
+    return last_day, open_off_events
+
+
+def _save_state(gaps_folder, day, open_off_events):
+    data_cache._write_parquet(open_off_events, os.path.join(gaps_folder, OPEN_OFF_EVENTS_FILE))
+    tmp_file = os.path.join(gaps_folder, f"{STATE_FILE}.tmp")
+    with open(tmp_file, "w") as f:
+        json.dump({"last_day": f"{day:%Y-%m-%d}"}, f)
+    os.replace(tmp_file, os.path.join(gaps_folder, STATE_FILE))
+
+
+def _write_closed_gaps(closed, gaps_folder):
+    """Add closed gaps to the partitions of their `gap_start` day."""
+    changed = []
+    for gap_day, gaps in closed.groupby(closed.gap_start.dt.floor("D").dt.tz_localize(None)):
+        filename = _partition_file(gaps_folder, gap_day)
+        if os.path.exists(filename):
+            existing = pd.read_parquet(filename)
+            # Drop gaps written by an interrupted run of the same day
+            gaps = pd.concat([existing[~existing.gap_id.isin(gaps.gap_id)], gaps], ignore_index=True)
+        elif not os.path.exists(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        data_cache._write_parquet(gaps, filename)
+        changed.append(gap_day)
+    return changed
+
+
+def stitch_day(day, off_events, on_events, gaps_folder=None):
+    """Stitch one day of off and on events into the gap events.
+
+    Days must be stitched in order, starting from the first day of events.
+
+    Parameters
+    ----------
+    day : str or date
+        The day the events are for. Must be the day after the last
+        stitched day.
+    off_events, on_events : DataFrame
+        The day's events, as produced by `gap_events.iter_off_on_events`.
+    gaps_folder : str, default=None
+        Folder of the gap events and the open gaps state. Defaults to
+        `ais_gap_events` in the local cache.
+
+    Returns
+    -------
+    changed : list of Timestamp
+        Days of `gap_start` whose partition of closed gaps was rewritten.
+    """
+    day = pd.Timestamp(day)
+    if gaps_folder is None:
+        gaps_folder = get_gaps_folder()
+    if not os.path.exists(gaps_folder):
+        os.makedirs(gaps_folder)
+
+    last_day, open_off_events = _load_state(gaps_folder)
+    if last_day is not None and day != last_day + pd.Timedelta(days=1):
+        raise ValueError(f"Gaps are stitched up to {last_day.date()}, "
+                         f"the next day to stitch is {(last_day + pd.Timedelta(days=1)).date()}")
+
+    candidates = off_events if open_off_events is None else pd.concat(
+        [df for df in [open_off_events, off_events] if len(df)] or [off_events], ignore_index=True)
+    # Off events stay open until an on event of the vessel comes after them.
+    # Off events whose next position is tomorrow are closed by tomorrow's on event.
+    off_index, on_index, is_open = pair_gap_events(candidates, on_events, day)
+    open_off_events = candidates[is_open]
+
+    closed = _gap_rows(_join_events(candidates.iloc[off_index], on_events.iloc[on_index]), day)
+    changed = _write_closed_gaps(closed, gaps_folder)
+
+    open_gaps = _gap_rows(_join_events(open_off_events, _no_on_events(on_events, len(open_off_events))), day)
+    data_cache._write_parquet(open_gaps, os.path.join(gaps_folder, OPEN_GAPS_FILE))
+    _save_state(gaps_folder, day, open_off_events)
+    return changed
+
+
+def stitch_gaps(events, gaps_folder=None):
+    """Stitch days of events in order, e.g. from `gap_events.iter_off_on_events`.
+
+    Parameters
+    ----------
+    events : iterable of (day, off_events, on_events)
+    gaps_folder : str, default=None
+
+    Returns
+    -------
+    changed : list of Timestamp
+        Days of `gap_start` whose partition of closed gaps was rewritten.
+    """
+    changed = set()
+    for day, off_events, on_events in events:
+        changed.update(stitch_day(day, off_events, on_events, gaps_folder))
+        print(f"Stitched gaps for {day.date()}")
+    return sorted(changed)
+
+
+def backfill_gap_events(off_events, on_events, day, gaps_folder=None):
+    """Build the gap events from all off and on events up to and including
+    `day` at once, e.g. to backfill history offline, and save the open off
+    events so `stitch_day` can continue from the next day.
+
+    Any gap events already in `gaps_folder` are replaced.
+
+    Returns
+    -------
+    changed : list of Timestamp
+        Days of `gap_start` whose partition of closed gaps was written.
+    """
+    day = pd.Timestamp(day)
+    if gaps_folder is None:
+        gaps_folder = get_gaps_folder()
+    if os.path.exists(gaps_folder):
+        shutil.rmtree(gaps_folder)
+    os.makedirs(gaps_folder)
+
+    off_index, on_index, is_open = pair_gap_events(off_events, on_events, day)
+    open_off_events = off_events[is_open]
+
+    closed = _gap_rows(_join_events(off_events.iloc[off_index], on_events.iloc[on_index]), day)
+    changed = _write_closed_gaps(closed, gaps_folder)
+
+    open_gaps = _gap_rows(_join_events(open_off_events, _no_on_events(on_events, len(open_off_events))), day)
+    data_cache._write_parquet(open_gaps, os.path.join(gaps_folder, OPEN_GAPS_FILE))
+    _save_state(gaps_folder, day, open_off_events)
+    return changed
+
+
+def read_gap_events(gaps_folder=None):
+    """All gap events, closed and open, as of the last stitched day."""
+    if gaps_folder is None:
+        gaps_folder = get_gaps_folder()
+    closed = [pd.read_parquet(os.path.join(root, f))
+              for root, _, files in sorted(os.walk(gaps_folder))
+              for f in files if f == "gaps.parquet"]
+    open_gaps = pd.read_parquet(os.path.join(gaps_folder, OPEN_GAPS_FILE))
+    return pd.concat([df for df in closed + [open_gaps] if len(df)] or [open_gaps], ignore_index=True)
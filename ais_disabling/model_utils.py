@@ -1,9 +1,13 @@
 import os
+import time
 import pandas as pd
 import numpy as np
 from random import seed, randint
 from sklearn.model_selection import cross_validate
 
+from . import data_cache
+from .threshold_models import threshold_cells, threshold_cell_scores, fbeta_from_counts
+
 MODELS_BASE_FOLDER = "../model_selection/models"
 
 
@@ -16,6 +20,14 @@ def get_models_folder(lowest_rec):
         os.makedirs(models_folder)
     return models_folder
 
+def get_model_filename(models_folder, model_name):
+    """Return the saved model file for `model_name`, preferring the
+    compact .npz format and falling back to the older .json format."""
+    npz_filename = f"{models_folder}/model_{model_name}.npz"
+    if os.path.exists(npz_filename):
+        return npz_filename
+    return f"{models_folder}/model_{model_name}.json"
+
 def get_gaps(gaps_table):
     q = f"""
     SELECT
@@ -26,7 +38,7 @@ def get_gaps(gaps_table):
     (off_distance_from_shore_m > 50*1852) 
     """
 
-    return pd.read_gbq(q, project_id="world-fishing-827", dialect="standard")
+    return data_cache.read_gbq(q, project_id="world-fishing-827", dialect="standard")
 
 # Separate out training and test sets on 70-30 split, grouping by MMSI
 # Since the gaps are grouped on MMSI, meaning that all of the gaps for an MMSI must either be fully in the training set OR the test set to prevent data leakage, getting an exact 70-30 split is not possible. The `test_size` parameter has been set to 0.22 after some experimentation as this gave the desired 70-30 split with `random_state` set to 5.
@@ -64,6 +76,96 @@ def cross_validate_threshold_model(X, y, model_class, num_repeats, gss_list, ret
         )
     return cv_results
 
+def batch_cross_validate_threshold_models(models, y, num_repeats, gss_list, groups, lowest_rec):
+    """Cross validate several threshold models over the same folds in one process.
+
+    Equivalent to calling :func:`cross_validate_threshold_model` with an
+    F0.5 scorer for each model, but the folds are generated once and shared
+    by every model, and each model's samples are binned against its
+    threshold grid once. Each fold then only needs a histogram of its
+    training and test samples to score every threshold, pick the optimal
+    one on the training samples and score it on the test samples.
+
+    Parameters
+    ----------
+    models : dict
+        Maps a model name to a tuple of (model_class, X), where X is
+        the array of features for that model.
+    y : array-like, shape (n_samples,)
+        The target values. Samples equal to 1 are the positive class.
+    num_repeats : int
+        Number of repeats of the cross validation to run.
+    gss_list : list
+        The cross validation splitters from :func:`generate_kfolds`,
+        one per repeat.
+    groups : array-like, shape (n_samples,)
+        Group labels used to generate the folds.
+    lowest_rec : int
+        The lowest reception passed to each model.
+
+    Returns
+    ----------
+    cv_results : dict
+        Maps each model name to a list of `num_repeats` dicts with the same
+        `fit_time`, `score_time` and `test_score` keys as `cross_validate()`.
+    """
+    y_pos = np.asarray(y).ravel() == 1
+    n_samples = y_pos.shape[0]
+
+    # The folds only depend on the number of samples and the groups,
+    # so generate them once for all of the models.
+    folds = [list(gss_list[i].split(np.zeros(n_samples), y_pos, groups)) for i in range(0, num_repeats)]
+
+    cv_results = {}
+    for model_name, (model_class, X) in models.items():
+        model = model_class(model_name=model_name, lowest_rec=lowest_rec)
+        thresholds = model.threshold_grid()
+        if any(len(t) == 0 for t in thresholds):
+            # As in fit(), a model with no thresholds to test keeps its
+            # thresholds at -1, so it predicts every test sample positive
+            cv_results[model_name] = _no_threshold_results(y_pos, folds)
+            continue
+        cells, shape, ranks = threshold_cells(model.threshold_features(X), thresholds)
+
+        model_results = []
+        for repeat_folds in folds:
+            fit_times, score_times, test_scores = [], [], []
+            for train_idx, test_idx in repeat_folds:
+                start_time = time.time()
+                train_scores = threshold_cell_scores(cells[train_idx], y_pos[train_idx], shape, ranks)
+                best_idx = np.argmax(train_scores)
+                fit_times.append(time.time() - start_time)
+
+                start_time = time.time()
+                test_scores.append(
+                    threshold_cell_scores(cells[test_idx], y_pos[test_idx], shape, ranks).flat[best_idx]
+                )
+                score_times.append(time.time() - start_time)
+
+            model_results.append({
+                "fit_time": np.array(fit_times),
+                "score_time": np.array(score_times),
+                "test_score": np.array(test_scores),
+            })
+        cv_results[model_name] = model_results
+
+    return cv_results
+
+def _no_threshold_results(y_pos, folds):
+    """Cross validation results of a model with an empty threshold grid."""
+    model_results = []
+    for repeat_folds in folds:
+        test_scores = [
+            fbeta_from_counts(y_pos[test_idx].sum(), len(test_idx), y_pos[test_idx].sum()).item()
+            for _, test_idx in repeat_folds
+        ]
+        model_results.append({
+            "fit_time": np.zeros(len(repeat_folds)),
+            "score_time": np.zeros(len(repeat_folds)),
+            "test_score": np.array(test_scores),
+        })
+    return model_results
+
 def results_to_json(cv_results, decimals=8):
     """Converts the cross validation results to a valid JSON object,
         changing numpy array objects to python list objects.
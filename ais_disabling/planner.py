@@ -0,0 +1,171 @@
+# planner.py
+
+"""
+Incremental planning for the daily partitioned tables built by the
+`run_*.py` drivers. Given the dates to run, `plan_partitions` only returns
+the dates whose destination partition is missing, or older than one of
+the upstream partitions it is built from, so a rerun only rebuilds what
+changed.
+
+Partition metadata is read from BigQuery's INFORMATION_SCHEMA.PARTITIONS.
+When running offline, it is read from a local JSON manifest instead, which
+`record_partitions` updates as partitions are built.
+"""
+
+import os
+import json
+from datetime import datetime, timedelta, timezone
+import pandas as pd
+
+from . import data_cache
+
+PROJECT_ID = "world-fishing-827"
+
+# Partition key used for tables that are not partitioned by day
+UNPARTITIONED = "__UNPARTITIONED__"
+
+MANIFEST_FILE = os.path.join(data_cache.CACHE_BASE_FOLDER, "partitions_manifest.json")
+
+
+def _load_manifest():
+    if not os.path.exists(MANIFEST_FILE):
+        return {}
+    with open(MANIFEST_FILE) as f:
+        return json.load(f)
+
+
+def get_partitions(table, offline=False):
+    """Return the last modified time of each daily partition of a table.
+
+    Parameters
+    ----------
+    table : str
+        Table as `dataset.table`.
+    offline : bool
+        Read the partitions from the local manifest instead of BigQuery.
+
+    Returns
+    -------
+    partitions : dict
+        Maps each partition date, as YYYY-MM-DD, to its last modified time
+        as a timezone aware datetime. Tables that are not partitioned by day
+        have a single `UNPARTITIONED` key. Empty if the table does not exist.
+    """
+    if offline:
+        return {
+            date: datetime.fromisoformat(modified)
+            for date, modified in _load_manifest().get(table, {}).items()
+        }
+
+    dataset, table_name = table.split(".")[-2:]
+    q = f"""
+    SELECT
+      partition_id,
+      last_modified_time
+    FROM `{dataset}.INFORMATION_SCHEMA.PARTITIONS`
+    WHERE table_name = '{table_name}'
+    """
+    df = pd.read_gbq(q, project_id=PROJECT_ID, dialect="standard")
+
+    partitions = {}
+    for p, modified in zip(df.partition_id, df.last_modified_time):
+        if isinstance(p, str) and len(p) == 8 and p.isdigit():
+            key = f"{p[:4]}-{p[4:6]}-{p[6:]}"
+        else:
+            # Tables that are not partitioned by day have a single
+            # partition without a date
+            key = UNPARTITIONED
+        partitions[key] = pd.Timestamp(modified).tz_convert("UTC").to_pydatetime()
+    return partitions
+
+
+def record_partitions(table, dates, modified=None):
+    """Record partitions as built in the local manifest.
+
+    Parameters
+    ----------
+    table : str
+        Table as `dataset.table`.
+    dates : list of str
+        Partition dates, as YYYY-MM-DD, that were built.
+    modified : datetime, default=None
+        Time the partitions were built. Defaults to now.
+    """
+    if modified is None:
+        modified = datetime.now(timezone.utc)
+
+    manifest = _load_manifest()
+    partitions = manifest.setdefault(table, {})
+    for date in dates:
+        partitions[date] = modified.isoformat()
+
+    if not os.path.exists(os.path.dirname(MANIFEST_FILE)):
+        os.makedirs(os.path.dirname(MANIFEST_FILE))
+    tmp_file = f"{MANIFEST_FILE}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_file, MANIFEST_FILE)
+
+
+def plan_partitions(dates, destination_table, upstream_tables=(), offline=False):
+    """Return the dates whose destination partition needs to be (re)built.
+
+    A date is scheduled if its destination partition is missing, or if any
+    upstream partition it depends on was modified after it was built.
+
+    Parameters
+    ----------
+    dates : list of str
+        Candidate dates, as YYYY-MM-DD, e.g. `config.tp`.
+    destination_table : str
+        Table being built, as `dataset.table`.
+    upstream_tables : list of (str, tuple or None)
+        Each upstream table, as `dataset.table`, with the day offsets of the
+        upstream partitions read to build a date, e.g. `(0, 1)` for today
+        and tomorrow. Use None for an upstream table where any change should
+        rebuild every date, such as a table that is not partitioned by day.
+    offline : bool
+        Read partition metadata from the local manifest instead of BigQuery.
+
+    Returns
+    -------
+    dates_to_run : list of str
+        The dates to build, in the order given.
+    """
+    built = get_partitions(destination_table, offline)
+    upstream = [(get_partitions(table, offline), offsets) for table, offsets in upstream_tables]
+
+    dates_to_run = []
+    for date in dates:
+        if date not in built:
+            dates_to_run.append(date)
+            continue
+
+        day = datetime.strptime(date, "%Y-%m-%d").date()
+        for partitions, offsets in upstream:
+            if offsets is None:
+                modified = list(partitions.values())
+            else:
+                modified = [partitions.get(str(day + timedelta(days=o))) for o in offsets]
+            modified = [m for m in modified if m is not None]
+            if modified and max(modified) > built[date]:
+                dates_to_run.append(date)
+                break
+
+    print(f"{destination_table}: {len(dates_to_run)} of {len(dates)} partitions to build")
+    return dates_to_run
+
+
+def record_results(results):
+    """Record the partitions of successful `executor.JobResult`s, whose
+    names are destination tables such as `dataset.table$YYYYMMDD`, in
+    the local manifest."""
+    built = {}
+    for result in results:
+        if not result.ok or "$" not in result.name:
+            continue
+        table, partition = result.name.split("$")
+        built.setdefault(table, []).append(f"{partition[:4]}-{partition[4:6]}-{partition[6:8]}")
+
+    for table, dates in built.items():
+        record_partitions(table, dates)
@@ -0,0 +1,149 @@
+# position_index.py
+
+"""
+Index of message times per vessel for counting the positions before a
+gap over any lookback.
+
+Message times are sorted by vessel and time, with a cumulative count of
+satellite messages, so the number of positions or satellite positions of
+a vessel in a window is two binary searches and a subtraction. A new
+lookback, such as `positions_36_hours_before_sat`, can then be added as a
+model feature without scanning the messages again:
+
+    >>> from ais_disabling import gap_events
+    >>> index = gap_events.build_position_index('2018-12-31', '2020-01-01',
+    ...                                         good_seg_ids=good_seg_ids)
+    >>> index.save('positions_2019.npz')
+    >>> counts = index.positions_before(gaps.ssvid, gaps.gap_start, hours=[6, 36, 48])
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def micros(timestamps):
+    """Timestamps as integer microseconds since the epoch, the precision
+    of BigQuery timestamps. Naive timestamps are taken to be UTC."""
+    index = pd.DatetimeIndex(timestamps)
+    if index.tz is None:
+        index = index.tz_localize("UTC")
+    return index.tz_convert(None).values.astype("datetime64[us]").astype(np.int64)
+
+
+class PositionIndex:
+    """Message times of each vessel, sorted, with cumulative satellite counts.
+
+    Parameters
+    ----------
+    ssvids : array
+        Vessels in the index.
+    offsets : array
+        Messages of vessel `i` are `times[offsets[i]:offsets[i + 1]]`.
+    times : array
+        Message times in microseconds since the epoch, sorted within each vessel.
+    sat_counts : array
+        Number of satellite messages before each message, with the total
+        at the end, so there are `sat_counts[j] - sat_counts[i]` satellite
+        messages in `times[i:j]`.
+    """
+
+    def __init__(self, ssvids, offsets, times, sat_counts):
+        self.ssvids = np.asarray(ssvids)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.times = np.asarray(times, dtype=np.int64)
+        self.sat_counts = np.asarray(sat_counts, dtype=np.int64)
+        self._vessels = pd.Index(self.ssvids)
+
+    @classmethod
+    def from_messages(cls, messages):
+        """Index messages with `ssvid`, `timestamp` and `receiver_type`."""
+        codes, ssvids = pd.factorize(messages.ssvid.values, sort=True)
+        times = micros(messages.timestamp)
+        order = np.lexsort((times, codes))
+        is_sat = messages.receiver_type.values[order] == "satellite"
+        return cls(ssvids,
+                   np.searchsorted(codes[order], np.arange(len(ssvids) + 1)),
+                   times[order],
+                   np.r_[0, np.cumsum(is_sat)])
+
+    def save(self, filename):
+        np.savez(filename, ssvids=self.ssvids.astype(str), offsets=self.offsets,
+                 times=self.times, sat_counts=self.sat_counts)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as data:
+            return cls(data["ssvids"].astype(object), data["offsets"], data["times"], data["sat_counts"])
+
+    def __len__(self):
+        return len(self.times)
+
+    def _search(self, lo, hi, t, side):
+        """np.searchsorted of each `t` within `times[lo:hi]`, for all
+        queries at once."""
+        lo, hi = lo.copy(), hi.copy()
+        while True:
+            active = lo < hi
+            if not active.any():
+                return lo
+            mid = (lo + hi) // 2
+            mid_times = self.times[np.where(active, mid, 0)]
+            after = (mid_times < t) if side == "left" else (mid_times <= t)
+            lo = np.where(active & after, mid + 1, lo)
+            hi = np.where(active & ~after, mid, hi)
+
+    def _vessel_bounds(self, ssvid):
+        vessel = self._vessels.get_indexer(np.asarray(ssvid))
+        found = vessel >= 0
+        # Vessels that are not in the index have no messages
+        lo = np.zeros(len(vessel), dtype=np.int64)
+        hi = np.zeros(len(vessel), dtype=np.int64)
+        lo[found] = self.offsets[vessel[found]]
+        hi[found] = self.offsets[vessel[found] + 1]
+        return lo, hi
+
+    def count(self, ssvid, timestamps, hours, satellite=False, closed="both"):
+        """Number of messages of each vessel in the `hours` up to each timestamp.
+
+        Parameters
+        ----------
+        ssvid : array
+        timestamps : array of Timestamp
+        hours : float
+            Length of the lookback.
+        satellite : bool
+            Only count satellite messages.
+        closed : {'both', 'right'}
+            'both' counts messages in [t - hours, t], as BETWEEN in the
+            off events query, 'right' in (t - hours, t].
+
+        Returns
+        -------
+        counts : array
+        """
+        return self.positions_before(ssvid, timestamps, [hours], closed)[
+            f"positions_{hours}_hours_before" + ("_sat" if satellite else "")].values
+
+    def positions_before(self, ssvid, timestamps, hours=(6, 12, 18, 24), closed="both"):
+        """`positions_X_hours_before` and `positions_X_hours_before_sat`
+        for every lookback in `hours`. See `count` for `closed`.
+
+        Returns
+        -------
+        DataFrame with a column for every lookback, then a column for
+        every lookback with only satellite messages.
+        """
+        if closed not in ("both", "right"):
+            raise ValueError(f"closed must be 'both' or 'right', not {closed!r}")
+
+        lo, hi = self._vessel_bounds(ssvid)
+        end = micros(timestamps)
+        right = self._search(lo, hi, end, side="right")
+
+        counts, sat_counts = {}, {}
+        for h in hours:
+            start = end - int(round(h * 3600 * 10**6))
+            left = self._search(lo, right, start, side="left" if closed == "both" else "right")
+            counts[f"positions_{h}_hours_before"] = right - left
+            sat_counts[f"positions_{h}_hours_before_sat"] = self.sat_counts[right] - self.sat_counts[left]
+        return pd.DataFrame({**counts, **sat_counts})
@@ -0,0 +1,270 @@
+# query_cache.py
+
+"""
+Cache for rendered SQL queries, keyed by a hash of the query text plus the
+last modified time of every table it reads. A query that has already run
+against unchanged inputs is skipped: its results are read back from local
+disk for `read_gbq`, and `run_query` jobs that write to BigQuery are not
+re-executed as long as the tables or daily partitions they wrote are
+unchanged. Entries are evicted least recently used first once the cache
+grows past `max_bytes`.
+
+    >>> from ais_disabling.query_cache import QueryCache
+    >>> query_cache = QueryCache()
+    >>> df = query_cache.read_gbq(query)
+    >>> query_cache.run_query(rendered_template)
+    >>> query_cache.report()
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import subprocess
+import pandas as pd
+
+from google.cloud import bigquery
+from google.cloud.exceptions import NotFound
+
+from . import data_cache
+from . import planner
+
+PROJECT_ID = "world-fishing-827"
+
+# Matches tables read by a query, e.g. `FROM dataset.table` or
+# `JOIN `project.dataset.table``. Names without a dataset are
+# CTEs and are not inputs.
+INPUT_TABLE = re.compile(r"\b(?:FROM|JOIN)\s+`?((?:[\w-]+\.)?[\w-]+\.[\w-]+\*?)`?", re.IGNORECASE)
+
+# Matches tables written by a query, e.g. `CREATE OR REPLACE TABLE dataset.table`
+# or `INSERT INTO dataset.table`.
+OUTPUT_TABLE = re.compile(r"\b(?:CREATE\s+(?:OR\s+REPLACE\s+)?TABLE(?:\s+IF\s+NOT\s+EXISTS)?|INSERT(?:\s+INTO)?)"
+                          r"\s+`?((?:[\w-]+\.)?[\w-]+\.[\w-]+)`?", re.IGNORECASE)
+
+
+def input_tables(sql):
+    """Return the sorted set of tables read by a query."""
+    return sorted(set(INPUT_TABLE.findall(sql)))
+
+
+def output_tables(sql, bq_args=()):
+    """Return the sorted set of tables written by a query, from the query
+    itself and the `--destination_table` of `bq query`. Partition
+    decorators are kept, e.g. `dataset.table$20190101`."""
+    tables = set(OUTPUT_TABLE.findall(sql))
+    bq_args = list(bq_args)
+    for i, arg in enumerate(bq_args):
+        if arg.startswith("--destination_table="):
+            tables.add(arg.split("=", 1)[1])
+        elif arg == "--destination_table" and i + 1 < len(bq_args):
+            tables.add(bq_args[i + 1])
+    return sorted({table.replace("\\$", "$") for table in tables})
+
+
+class QueryCache:
+    """On-disk cache of query results and executed queries.
+
+    Parameters
+    ----------
+    cache_folder : str, default=None
+        Folder to keep cached results in. Defaults to `queries/`
+        under the data cache folder.
+    max_bytes : int, default=10 GiB
+        Size of the cache above which the least recently used
+        entries are evicted.
+    client : bigquery.Client, default=None
+        Client used to look up the modified time of input tables.
+    """
+
+    def __init__(self, cache_folder=None, max_bytes=10 * 2**30, client=None):
+        if cache_folder is None:
+            cache_folder = os.path.join(data_cache.CACHE_BASE_FOLDER, "queries")
+        if not os.path.exists(cache_folder):
+            os.makedirs(cache_folder)
+
+        self.cache_folder = cache_folder
+        self.max_bytes = max_bytes
+        self.client = client
+        self.hits = 0
+        self.misses = 0
+        self.uncacheable = 0
+
+    def _get_client(self):
+        if self.client is None:
+            self.client = bigquery.Client()
+        return self.client
+
+    def _table_versions(self, sql):
+        """Return the modified time and size of each input table, or None
+        if the version of one of the tables cannot be determined."""
+        versions = {}
+        for table_id in input_tables(sql):
+            if table_id.endswith("*"):
+                # Wildcard tables have no single version
+                return None
+            try:
+                table = self._get_client().get_table(table_id)
+            except NotFound:
+                # Most likely a column reference such as `EXTRACT(year FROM a.timestamp)`.
+                # A missing input table would make the query fail, and
+                # failed queries are never cached.
+                print(f"Query cache: {table_id} not found, not treated as an input table")
+                continue
+            except Exception as e:
+                print(f"Query cache: can't look up {table_id}, query is not cached ({e})")
+                return None
+            versions[table_id] = [table.modified.isoformat(), table.num_rows]
+        return versions
+
+    def _output_versions(self, tables):
+        """Return the modified time of each output table or daily partition,
+        or None if one of them doesn't exist or can't be looked up.
+
+        Daily partitions, such as `dataset.table$20190101`, are looked up in
+        INFORMATION_SCHEMA.PARTITIONS, as in `planner`, so writing one
+        partition of a table doesn't change the version of the others.
+        """
+        versions = {}
+        partitions = {}
+        for table_id in tables:
+            table, _, partition = table_id.partition("$")
+            try:
+                if len(partition) == 8 and partition.isdigit():
+                    if table not in partitions:
+                        partitions[table] = planner.get_partitions(table)
+                    modified = partitions[table].get(f"{partition[:4]}-{partition[4:6]}-{partition[6:]}")
+                    if modified is None:
+                        return None
+                    versions[table_id] = modified.isoformat()
+                else:
+                    versions[table_id] = self._get_client().get_table(table).modified.isoformat()
+            except Exception:
+                return None
+        return versions
+
+    def key(self, sql, *extra):
+        """Return the cache key for a query, or None if it can't be cached."""
+        versions = self._table_versions(sql)
+        if versions is None:
+            return None
+        content = json.dumps([sql, versions, list(extra)], sort_keys=True)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def _path(self, key, extension):
+        return os.path.join(self.cache_folder, f"{key}.{extension}")
+
+    def _hit(self, path):
+        # Touch the entry so eviction is least recently used.
+        os.utime(path)
+        self.hits += 1
+
+    def read_gbq(self, sql, **kwargs):
+        """Return the results of a query, reading them from the cache
+        when the query has already run against the same input tables.
+        Keyword arguments are passed to `pd.read_gbq`."""
+        kwargs.setdefault("project_id", PROJECT_ID)
+        key = self.key(sql, "results", sorted(kwargs.items()))
+        if key is None:
+            self.uncacheable += 1
+            return pd.read_gbq(sql, **kwargs)
+
+        path = self._path(key, "parquet")
+        if os.path.exists(path):
+            self._hit(path)
+            return pd.read_parquet(path)
+
+        self.misses += 1
+        df = pd.read_gbq(sql, **kwargs)
+        tmp_path = f"{path}.tmp"
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+        self.evict()
+        return df
+
+    def run_query(self, sql, bq_args=(), force=False):
+        """Run a query with `bq query` unless the same query has already
+        run successfully against the same input tables.
+
+        Parameters
+        ----------
+        sql : str
+            The rendered query.
+        bq_args : sequence of str
+            Extra arguments for `bq query`, e.g. `--destination_table`.
+        force : bool
+            Run the query even if it is cached.
+
+        Returns
+        -------
+        True if the query ran successfully or was skipped, False if it failed.
+        """
+        key = self.key(sql, "job", list(bq_args))
+        path = None if key is None else self._path(key, "done")
+        outputs = output_tables(sql, bq_args)
+        if key is None:
+            self.uncacheable += 1
+        elif os.path.exists(path) and not force and self._outputs_unchanged(path, outputs):
+            self._hit(path)
+            return True
+        else:
+            self.misses += 1
+
+        result = subprocess.run(["bq", "query", *bq_args], input=bytes(sql, "utf-8"))
+        if result.returncode != 0:
+            return False
+
+        if path is not None:
+            output_versions = self._output_versions(outputs)
+            if output_versions is None:
+                # Without the version of its output, a later run couldn't
+                # tell whether the output was dropped or overwritten.
+                if os.path.exists(path):
+                    os.remove(path)
+                return True
+            with open(path, "w") as f:
+                json.dump({"ran_at": time.time(),
+                           "input_tables": input_tables(sql),
+                           "output_tables": output_versions}, f)
+            self.evict()
+        return True
+
+    def _outputs_unchanged(self, path, outputs):
+        """Whether the tables or partitions written by a cached job still
+        exist and haven't been modified since it ran."""
+        with open(path) as f:
+            done = json.load(f)
+        recorded = done.get("output_tables")
+        if recorded is None or sorted(recorded) != outputs:
+            return False
+        return self._output_versions(outputs) == recorded
+
+    def size(self):
+        """Return the total size in bytes of the cached entries."""
+        return sum(entry.stat().st_size for entry in os.scandir(self.cache_folder) if entry.is_file())
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in max_bytes."""
+        entries = [entry for entry in os.scandir(self.cache_folder) if entry.is_file()]
+        total = sum(entry.stat().st_size for entry in entries)
+        for entry in sorted(entries, key=lambda e: e.stat().st_mtime):
+            if total <= self.max_bytes:
+                break
+            total -= entry.stat().st_size
+            os.remove(entry.path)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "uncacheable": self.uncacheable,
+            "size_bytes": self.size(),
+        }
+
+    def report(self):
+        """Print the hit/miss counts for this run."""
+        stats = self.stats()
+        print(
+            f"Query cache: {stats['hits']} hits, {stats['misses']} misses, "
+            f"{stats['uncacheable']} uncacheable, {stats['size_bytes'] / 2**20:.1f} MiB on disk"
+        )
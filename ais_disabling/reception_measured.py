@@ -0,0 +1,275 @@
+# reception_measured.py
+
+"""
+Local implementation of `data_production/reception/reception_measured.sql.j2`.
+
+Measured reception is computed from hourly interpolated positions
+(`ais_positions_byseg_hourly`) stored as local Parquet partitions, one
+folder per day, so a month of reception can be rebuilt offline:
+
+    >>> from ais_disabling import reception_measured
+    >>> reception_measured.cache_positions('2019-01-01', '2019-02-01')
+    >>> good_ssvid = reception_measured.get_good_ssvid()
+    >>> good_seg_ids = reception_measured.get_good_seg_ids()
+    >>> df = reception_measured.make_reception_measured(
+    ...     pd.Timestamp('2019-01-01'), good_ssvid=good_ssvid, good_seg_ids=good_seg_ids)
+
+The result has the same columns as the BigQuery table and can be passed
+straight to `utils.make_grids`.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from dateutil.relativedelta import relativedelta
+
+from . import config
+from . import data_cache
+
+PROJECT_ID = "world-fishing-827"
+
+# Columns of `ais_positions_byseg_hourly` used by the query
+POSITION_COLUMNS = [
+    "ssvid",
+    "seg_id",
+    "sat_positions",
+    "lat",
+    "lon",
+    "hour",
+    "hour_midpoint",
+    "interpolated_speed_knots",
+    "A_messages",
+    "B_messages",
+]
+
+RECEPTION_COLUMNS = ["cls", "lat_bin", "lon_bin", "hours", "sat_pos_per_day"]
+
+
+def get_positions_folder(output_version=config.output_version):
+    return os.path.join(data_cache.get_cache_folder(output_version), "ais_positions_hourly")
+
+
+def _partition_folder(positions_folder, day):
+    return os.path.join(positions_folder, f"date={day:%Y-%m-%d}")
+
+
+def cache_positions(start_date, end_date,
+                    output_version=config.output_version,
+                    refresh=False):
+    """Download daily partitions of `ais_positions_byseg_hourly` into the
+    local cache, one `date=YYYY-MM-DD` folder per day.
+
+    Parameters
+    ----------
+    start_date, end_date : str or date
+        Days to download, end date not inclusive.
+    output_version : str
+    refresh : bool
+        Download days that are already cached again.
+    """
+    positions_folder = get_positions_folder(output_version)
+    table = f"{config.destination_dataset}.ais_positions_byseg_hourly_{output_version}"
+    columns = ", ".join(POSITION_COLUMNS + ["interpolated_at_segment_startorend"])
+
+    for day in pd.date_range(start_date, end_date, inclusive="left"):
+        folder = _partition_folder(positions_folder, day)
+        filename = os.path.join(folder, "positions.parquet")
+        if os.path.exists(filename) and not refresh:
+            continue
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        print(f"Caching {table} for {day.date()}")
+        df = pd.read_gbq(f"""SELECT {columns}
+                             FROM `{table}`
+                             WHERE DATE(_partitiontime) = "{day.date()}"
+                          """, project_id=PROJECT_ID, dialect="standard")
+        data_cache._write_parquet(df, filename)
+
+
+def get_good_ssvid(vi_version=config.vi_version):
+    """Vessels used for reception quality, as in the `good_ssvid` subquery."""
+    q = f"""
+    select ssvid
+    from `gfw_research.vi_ssvid_{vi_version}`
+    where best.best_vessel_class not in  ("gear", "squid_jigger", "pole_and_line")
+      and not activity.offsetting
+      and activity.active_positions > 1000
+      and best.best_vessel_class is not null
+    """
+    return pd.read_gbq(q, project_id=PROJECT_ID, dialect="standard").ssvid.values
+
+
+def get_good_seg_ids(segs_table=f"gfw_research.{config.segs_table}"):
+    """Segments used for reception quality."""
+    q = f"""
+    SELECT
+    seg_id
+    FROM `{segs_table}`
+    WHERE good_seg
+    AND NOT overlapping_and_short
+    """
+    return pd.read_gbq(q, project_id=PROJECT_ID, dialect="standard").seg_id.values
+
+
+def get_disabling_events(start_date, end_date=None):
+    """Disabling events starting in the month, as in the `disabling` subquery.
+    Reads the gap events features table through the local data cache."""
+    if end_date is None:
+        end_date = start_date + relativedelta(months=1)
+    q = f"""
+    SELECT
+    ssvid,
+    gap_id,
+    gap_start as gap_start_timestamp,
+    gap_end as gap_end_timestamp
+    FROM `{config.destination_dataset}.{config.gap_events_features_table}`
+    WHERE gap_hours >= 12
+    AND (off_distance_from_shore_m > 1852*50 AND on_distance_from_shore_m > 1852*50)
+    AND (DATE(gap_start) >= "{start_date:%Y-%m-%d}" AND DATE(gap_start) <= "{end_date:%Y-%m-%d}")
+    AND positions_X_hours_before_sat >= 19
+    """
+    return data_cache.read_gbq(q, dialect="standard")
+
+
+def _remove_disabling(df, disabling):
+    """Drop positions during disabling events.
+
+    This matches the outer join in the query, which keeps a position if the
+    vessel has no disabling events or if the position falls outside at
+    least one of them, and its SELECT DISTINCT, which keeps one of the
+    positions that are the same in every column but `seg_id`.
+    """
+    df = df.reset_index(drop=True)
+    pairs = df[["ssvid", "hour_midpoint"]].reset_index().merge(
+        disabling[["ssvid", "gap_start_timestamp", "gap_end_timestamp"]], on="ssvid")
+    outside = ~pairs.hour_midpoint.between(pairs.gap_start_timestamp, pairs.gap_end_timestamp)
+
+    with_events = np.zeros(len(df), dtype=bool)
+    with_events[pairs["index"].values] = True
+    kept_by_event = np.zeros(len(df), dtype=bool)
+    kept_by_event[pairs["index"].values[outside.values]] = True
+
+    return df[~with_events | kept_by_event].drop_duplicates(
+        subset=[c for c in POSITION_COLUMNS if c != "seg_id"])
+
+
+def _read_day(positions_folder, day, good_ssvid, good_seg_ids):
+    folder = _partition_folder(positions_folder, day)
+    if not os.path.exists(folder):
+        return None
+
+    # Don't extrapolate out at the end of segments
+    df = pq.read_table(folder, columns=POSITION_COLUMNS,
+                       filters=[("interpolated_at_segment_startorend", "=", False)]).to_pandas()
+    return df[df.ssvid.isin(good_ssvid) & df.seg_id.isin(good_seg_ids)]
+
+
+def _day_reception(df, all_speeds=False, inverse_delta_degrees=1):
+    """Per cell and class sums of `sat_pos_per_hour` and hours for one day.
+
+    All the half days of the query are within a single day, so each day
+    can be reduced on its own and the sums added up over the month.
+    """
+    # Positions without a vessel or hour never join to their half day
+    df = df.dropna(subset=["ssvid", "hour"])
+    df = df.assign(day_half=np.floor(df.hour / 12))
+
+    by_half_day = df.groupby(["ssvid", "day_half"], sort=False)
+    half_day = by_half_day.agg(
+        min_interpolated_speed_knots=("interpolated_speed_knots", "min"),
+        max_interpolated_speed_knots=("interpolated_speed_knots", "max"),
+        sat_positions=("sat_positions", "sum"),
+        positions=("sat_positions", "size"),
+        A_messages=("A_messages", "sum"),
+        B_messages=("B_messages", "sum"),
+    )
+    half_day["sat_pos_per_hour"] = half_day.sat_positions / half_day.positions
+
+    # Join each position to its half day
+    h = half_day.iloc[by_half_day.ngroup().values]
+    is_A = h.A_messages.values > 0
+    is_B = h.B_messages.values > 0
+    min_speed = h.min_interpolated_speed_knots.values
+    max_speed = h.max_interpolated_speed_knots.values
+
+    keep = ~(is_A & is_B) & (max_speed < 30)
+    if not all_speeds:
+        # If Class A, moving at the speed to ping once every 10 seconds
+        keep &= ((is_A & (min_speed > 0.5) & (max_speed < 14))
+                 | (is_B & (min_speed > 2)))
+
+    cells = pd.DataFrame({
+        "lat_bin": np.floor(df.lat.values[keep] * inverse_delta_degrees) / inverse_delta_degrees,
+        "lon_bin": np.floor(df.lon.values[keep] * inverse_delta_degrees) / inverse_delta_degrees,
+        "cls": np.where(is_A[keep], "A", "B"),
+        "sat_pos_per_hour": h.sat_pos_per_hour.values[keep],
+    })
+    return cells.groupby(["lat_bin", "lon_bin", "cls"]).agg(
+        hours=("sat_pos_per_hour", "size"),
+        sat_pos_per_hour=("sat_pos_per_hour", "sum"),
+    )
+
+
+def make_reception_measured(start_date,
+                            positions_folder=None,
+                            good_ssvid=None,
+                            good_seg_ids=None,
+                            all_speeds=False,
+                            no_disabling=False,
+                            disabling=None,
+                            inverse_delta_degrees=config.inverse_delta_degrees):
+    """Measured reception for the month starting at `start_date`.
+
+    Parameters
+    ----------
+    start_date : Timestamp
+        First day of the month.
+    positions_folder : str, default=None
+        Folder of hourly positions, with one `date=YYYY-MM-DD` folder per
+        day. Defaults to the folder filled by `cache_positions`.
+    good_ssvid : array, default=None
+        Vessels to use. Defaults to `get_good_ssvid()`, as in the query.
+    good_seg_ids : array, default=None
+        Segments to use. Defaults to `get_good_seg_ids()`, as in the query.
+    all_speeds : bool
+        Don't apply the speed filters for each AIS class.
+    no_disabling : bool
+        Remove positions during disabling events.
+    disabling : DataFrame, default=None
+        Disabling events to remove with `no_disabling`. Read with
+        `get_disabling_events` if None.
+    inverse_delta_degrees : int
+        Resolution of the grid, in cells per degree.
+
+    Returns
+    -------
+    DataFrame with `cls`, `lat_bin`, `lon_bin`, `hours` and `sat_pos_per_day`
+    """
+    start_date = pd.Timestamp(start_date)
+    end_date = start_date + relativedelta(months=1)
+    if positions_folder is None:
+        positions_folder = get_positions_folder()
+    if good_ssvid is None:
+        good_ssvid = get_good_ssvid()
+    if good_seg_ids is None:
+        good_seg_ids = get_good_seg_ids()
+    if no_disabling and disabling is None:
+        disabling = get_disabling_events(start_date, end_date)
+
+    day_sums = []
+    for day in pd.date_range(start_date, end_date, inclusive="left"):
+        df = _read_day(positions_folder, day, good_ssvid, good_seg_ids)
+        if df is None or len(df) == 0:
+            continue
+        if no_disabling:
+            df = _remove_disabling(df, disabling)
+        day_sums.append(_day_reception(df, all_speeds, inverse_delta_degrees))
+
+    if not day_sums:
+        return pd.DataFrame(columns=RECEPTION_COLUMNS)
+
+    reception = pd.concat(day_sums).groupby(level=[0, 1, 2]).sum().reset_index()
+    reception["sat_pos_per_day"] = reception.sat_pos_per_hour / reception.hours * 24
+    return reception[RECEPTION_COLUMNS]
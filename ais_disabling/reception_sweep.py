@@ -0,0 +1,203 @@
+# reception_sweep.py
+
+"""
+Parameter sweep for `utils.interpolate_reception`.
+
+Every combination of the parameters in a grid is scored with k-fold cell
+masking: the observed cells of a month are split into k folds, each fold
+is held out in turn by zeroing its hours, and the smoothed map is
+compared with the measured reception in the held-out cells. All
+configurations, classes and folds run in parallel worker processes and
+the results are returned as one tidy table with a row per configuration,
+class and fold.
+
+    >>> from ais_disabling import reception_sweep
+    >>> results = reception_sweep.run_reception_sweep(
+    ...     reception, {'smooth': [0.5, 1, 2], 'elevation_scale': [5, 10, 20]})
+    >>> reception_sweep.summarize(results)
+
+or from the command line, with measured reception from
+`reception_measured.make_reception_measured` saved as Parquet:
+
+    python -m ais_disabling.reception_sweep --input reception_2019_01.parquet \\
+        --smooth 0.5 1 2 --elevation_scale 5 10 20 --spherical True False --output sweep.csv
+"""
+
+import argparse
+import itertools
+import time
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from . import utils
+
+# Parameters of `interpolate_reception` that can be swept
+SWEEP_PARAMETERS = ["smooth", "epsilon", "elevation_scale", "hours_cap",
+                    "hours_threshold", "method", "spherical"]
+
+_sweep_grids = None
+
+
+def _init_sweep_worker(grids):
+    global _sweep_grids
+    _sweep_grids = grids
+
+
+def expand_grid(param_grid):
+    """Return a list of dicts, one per combination of the parameter values."""
+    unknown = set(param_grid) - set(SWEEP_PARAMETERS)
+    if unknown:
+        raise ValueError(f"Can't sweep {sorted(unknown)}, only {SWEEP_PARAMETERS}")
+    names = list(param_grid)
+    return [dict(zip(names, values)) for values in itertools.product(*param_grid.values())]
+
+
+def make_folds(hours, n_folds=5, seed=0):
+    """Randomly assign each observed cell (hours > 0) to one of `n_folds`
+    folds. Unobserved cells are -1."""
+    rng = np.random.default_rng(seed)
+    folds = np.full(hours.shape, -1)
+    observed = np.flatnonzero(hours > 0)
+    folds.flat[observed] = rng.permutation(len(observed)) % n_folds
+    return folds
+
+
+def residual_stats(y, predicted, hours):
+    """Residual statistics over held-out cells. `weighted_rmse`
+    weights each cell by its hours. Statistics are NaN if there are
+    no held-out cells, e.g. with fewer observed cells than folds."""
+    residuals = y - predicted
+    if len(residuals) == 0:
+        return {"n_cells": 0, "bias": np.nan, "mae": np.nan, "rmse": np.nan, "weighted_rmse": np.nan}
+    return {
+        "n_cells": len(residuals),
+        "bias": residuals.mean(),
+        "mae": np.abs(residuals).mean(),
+        "rmse": np.sqrt((residuals**2).mean()),
+        "weighted_rmse": np.sqrt(np.average(residuals**2, weights=hours)),
+    }
+
+
+def _run_sweep_task(cls, fold, params):
+    y, hours, folds = _sweep_grids[cls]
+    held_out = (folds == fold)
+
+    # Held out cells have no hours, so they are not in the mask
+    train_hours = np.where(held_out, 0, hours)
+
+    start_time = time.time()
+    predicted = utils.interpolate_reception(y, train_hours, **params)
+    fit_time = time.time() - start_time
+
+    return {
+        **params,
+        "cls": cls,
+        "fold": fold,
+        **residual_stats(y[held_out], predicted[held_out], hours[held_out]),
+        "fit_time": fit_time,
+    }
+
+
+def run_reception_sweep(reception, param_grid, n_folds=5, seed=0, max_workers=None,
+                        inverse_delta_degrees=utils.inverse_delta_degrees):
+    """Score every combination of `interpolate_reception` parameters.
+
+    Parameters
+    ----------
+    reception : DataFrame
+        Measured reception for a month, with `cls`, `lat_bin`, `lon_bin`,
+        `hours` and `sat_pos_per_day`.
+    param_grid : dict
+        Maps parameter names from `SWEEP_PARAMETERS` to the list of values
+        to try. Parameters that are not listed keep their defaults.
+    n_folds : int
+        Number of folds the observed cells are split into.
+    seed : int
+        Seed of the fold assignment. Folds are the same for every
+        configuration so scores can be compared directly.
+    max_workers : int, default=None
+        Number of worker processes. Defaults to the number of CPUs.
+    inverse_delta_degrees : int or float
+        Grid cells per degree, which must match the resolution of the
+        `lat_bin` and `lon_bin` of `reception`.
+
+    Returns
+    -------
+    results : DataFrame
+        One row per configuration, class and fold with the parameters,
+        `n_cells`, `bias`, `mae`, `rmse`, `weighted_rmse` and `fit_time`.
+    """
+    configs = expand_grid(param_grid)
+
+    A_grids, B_grids = utils.make_grids(reception, ['sat_pos_per_day', 'hours'],
+                                        inverse_delta_degrees=inverse_delta_degrees)
+    grids = {}
+    for cls, (y, hours) in zip(["A", "B"], [A_grids, B_grids]):
+        grids[cls] = (y, hours, make_folds(hours, n_folds, seed))
+
+    tasks = [(cls, fold, params)
+             for params in configs
+             for cls in grids
+             for fold in range(n_folds)]
+
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             initializer=_init_sweep_worker,
+                             initargs=(grids,)) as executor:
+        futures = [executor.submit(_run_sweep_task, *task) for task in tasks]
+        results = [future.result() for future in futures]
+
+    return pd.DataFrame(results)
+
+
+def summarize(results):
+    """Average the fold scores of each configuration and class, best first."""
+    params = [c for c in results.columns if c in SWEEP_PARAMETERS]
+    summary = (results
+               .groupby(params + ["cls"], dropna=False)
+               [["bias", "mae", "rmse", "weighted_rmse", "fit_time"]]
+               .mean()
+               .reset_index())
+    return summary.sort_values(["cls", "weighted_rmse"]).reset_index(drop=True)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    # Parquet file of measured reception for a month
+    parser.add_argument('--input', type=str, required=True)
+
+    # CSV file to write the results for every fold to
+    parser.add_argument('--output', type=str, required=True)
+
+    # Values to try for each parameter
+    parser.add_argument('--smooth', type=float, nargs='+', required=False)
+    parser.add_argument('--epsilon', type=float, nargs='+', required=False)
+    parser.add_argument('--elevation_scale', type=float, nargs='+', required=False)
+    parser.add_argument('--hours_cap', type=float, nargs='+', required=False)
+    parser.add_argument('--hours_threshold', type=float, nargs='+', required=False)
+    parser.add_argument('--method', type=str, nargs='+', required=False)
+    parser.add_argument('--spherical', type=str, nargs='+', choices=['True', 'False'], required=False)
+
+    parser.add_argument('--n_folds', type=int, default=5)
+    parser.add_argument('--max_workers', type=int, required=False)
+    parser.add_argument('--inverse_delta_degrees', type=float, default=utils.inverse_delta_degrees)
+
+    args = parser.parse_args()
+    if args.spherical:
+        args.spherical = [value == 'True' for value in args.spherical]
+
+    param_grid = {
+        name: getattr(args, name)
+        for name in SWEEP_PARAMETERS
+        if getattr(args, name)
+    }
+    # The dense RBF is too slow to sweep at full resolution
+    param_grid.setdefault("method", ["neighbors"])
+
+    reception = pd.read_parquet(args.input)
+    results = run_reception_sweep(reception, param_grid, args.n_folds, max_workers=args.max_workers,
+                                  inverse_delta_degrees=args.inverse_delta_degrees)
+    results.to_csv(args.output, index=False)
+    print(summarize(results).to_string())
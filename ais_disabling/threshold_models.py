@@ -2,11 +2,310 @@ import json
 import numpy as np
 from sklearn.base import ClassifierMixin, BaseEstimator
 from sklearn.utils.validation import check_X_y, check_array, check_is_fitted
-from sklearn.metrics import fbeta_score
-from joblib import Parallel, delayed
 
 
-class SingleThresholdClassifier(ClassifierMixin, BaseEstimator):
+def fbeta_from_counts(tp, pred_pos, true_pos, beta=0.5):
+    """Compute F-beta scores from confusion matrix counts.
+
+    Uses the same formulation as sklearn's `fbeta_score` with
+    `average="binary"`, i.e. (1 + beta^2) * TP / (beta^2 * (TP + FN) + (TP + FP)),
+    and returns 0 wherever the denominator is 0.
+
+    Parameters
+    ----------
+    tp : array-like
+        True positive counts.
+    pred_pos : array-like
+        Predicted positive counts (TP + FP).
+    true_pos : array-like
+        Actual positive counts (TP + FN).
+    beta : float, default=0.5
+        Weight of recall in the combined score.
+
+    Returns
+    -------
+    scores : ndarray
+        F-beta score for each set of counts.
+    """
+    beta2 = beta ** 2
+    numerator = (1 + beta2) * np.asarray(tp, dtype=np.float64)
+    denom = beta2 * np.asarray(true_pos, dtype=np.float64) + np.asarray(pred_pos, dtype=np.float64)
+    scores = np.zeros(np.broadcast(numerator, denom).shape)
+    np.divide(numerator, denom, out=scores, where=denom > 0)
+    return scores
+
+
+def single_threshold_scores(X, y, thresholds, beta=0.5):
+    """Score every candidate threshold of a single threshold model in one pass.
+
+    A sample is predicted True at threshold t if all of its features are >= t,
+    which is equivalent to the row minimum being >= t. The row minimums are
+    sorted once and the positive labels are accumulated with a cumulative
+    sum, so TP/FP/FN for every threshold come from a binary search rather
+    than rebuilding the predictions for each threshold.
+
+    Parameters
+    ----------
+    X : array-like, shape (n_samples, n_features)
+        The input samples.
+    y : array-like, shape (n_samples,)
+        The target values. Samples equal to 1 are the positive class.
+    thresholds : array-like, shape (n_thresholds,)
+        The thresholds to score. Need not be sorted or integer.
+    beta : float, default=0.5
+        Weight of recall in the F-beta score.
+
+    Returns
+    -------
+    scores : ndarray, shape (n_thresholds,)
+        The F-beta score at each threshold.
+    """
+    X = np.asarray(X)
+    x_min = X.min(axis=1) if X.ndim > 1 else X
+    y_pos = np.asarray(y).ravel() == 1
+
+    order = np.argsort(x_min, kind="mergesort")
+    x_sorted = x_min[order]
+    # cum_pos[i] is the number of positives among the i smallest values.
+    cum_pos = np.concatenate([[0], np.cumsum(y_pos[order])])
+
+    n_below = np.searchsorted(x_sorted, np.asarray(thresholds), side="left")
+    true_pos = cum_pos[-1]
+    pred_pos = x_sorted.shape[0] - n_below
+    tp = true_pos - cum_pos[n_below]
+
+    return fbeta_from_counts(tp, pred_pos, true_pos, beta=beta)
+
+
+def threshold_cells(features, thresholds):
+    """Bin samples by how many thresholds they pass along each dimension.
+
+    Passing a threshold implies passing every lower one, so a sample is
+    fully described by the number of (sorted) thresholds it passes in each
+    dimension. The cells only need to be computed once per feature set and
+    can then be histogrammed for any subset of samples, e.g. the folds of a
+    cross validation.
+
+    Parameters
+    ----------
+    features : list of array-like, each shape (n_samples,)
+        The value compared against the thresholds in each dimension.
+    thresholds : list of array-like
+        The thresholds to score in each dimension. Need not be sorted.
+
+    Returns
+    -------
+    cells : ndarray, shape (n_samples,)
+        The flat histogram cell of each sample.
+    shape : tuple of int
+        The histogram shape, (n_thresholds + 1) for each dimension.
+    ranks : list of ndarray
+        The sorted position of each threshold in the order given.
+    """
+    cells = 0
+    shape = []
+    ranks = []
+    for values, thresh in zip(features, thresholds):
+        thresh = np.asarray(thresh)
+        order = np.argsort(thresh, kind="mergesort")
+        rank = np.empty_like(order)
+        rank[order] = np.arange(order.shape[0])
+        n_passed = np.searchsorted(thresh[order], np.asarray(values).ravel(), side="right")
+
+        cells = cells * (thresh.shape[0] + 1) + n_passed
+        shape.append(thresh.shape[0] + 1)
+        ranks.append(rank)
+    return cells, tuple(shape), ranks
+
+
+def threshold_cell_scores(cells, y_pos, shape, ranks, beta=0.5):
+    """Score every threshold combination from the cells of :func:`threshold_cells`.
+
+    Parameters
+    ----------
+    cells : ndarray, shape (n_samples,)
+        The flat histogram cell of each sample.
+    y_pos : ndarray of bool, shape (n_samples,)
+        Whether each sample is in the positive class.
+    shape : tuple of int
+        The histogram shape returned by :func:`threshold_cells`.
+    ranks : list of ndarray
+        The threshold ranks returned by :func:`threshold_cells`.
+    beta : float, default=0.5
+        Weight of recall in the F-beta score.
+
+    Returns
+    -------
+    scores : ndarray, shape (n_thresholds_1, ..., n_thresholds_d)
+        The F-beta score at each combination of thresholds, in the
+        order the thresholds were given.
+    """
+    size = int(np.prod(shape))
+    total_hist = np.bincount(cells, minlength=size).reshape(shape)
+    pos_hist = np.bincount(cells[y_pos], minlength=size).reshape(shape)
+
+    # Suffix sums: cell [a, b, ...] counts the samples passing at least a
+    # thresholds in the first dimension, b in the second and so on.
+    # Predictions at sorted threshold (i, j, ...) require passing
+    # i + 1, j + 1, ... of them.
+    def suffix_sum(hist):
+        for axis in range(hist.ndim):
+            hist = np.flip(np.flip(hist, axis).cumsum(axis=axis), axis)
+        return hist[(slice(1, None),) * hist.ndim]
+
+    pred_pos = suffix_sum(total_hist)
+    tp = suffix_sum(pos_hist)
+    scores = fbeta_from_counts(tp, pred_pos, np.count_nonzero(y_pos), beta=beta)
+
+    # Put the scores back in the order the thresholds were given.
+    return scores[np.ix_(*ranks)]
+
+
+def double_threshold_scores(X_rec, X_pings, y, rec_thresholds, ping_thresholds, beta=0.5):
+    """Score every (reception, ping) threshold pair of a double threshold model.
+
+    Each sample is binned by how many reception thresholds and how many ping
+    thresholds it passes, giving 2-D histograms of positive and total counts.
+    Because passing a threshold implies passing every lower one, the number
+    of samples predicted True at a threshold pair is a 2-D suffix sum of
+    the histogram, so the whole grid is scored in one pass.
+
+    Parameters
+    ----------
+    X_rec : array-like, shape (n_samples,)
+        The reception value of each sample.
+    X_pings : array-like, shape (n_samples, n_ping_features)
+        The ping rate values of each sample. All of them must be >= the
+        ping threshold for the sample to be predicted True.
+    y : array-like, shape (n_samples,)
+        The target values. Samples equal to 1 are the positive class.
+    rec_thresholds : array-like, shape (n_rec,)
+        The reception thresholds to score.
+    ping_thresholds : array-like, shape (n_pings,)
+        The ping rate thresholds to score.
+    beta : float, default=0.5
+        Weight of recall in the F-beta score.
+
+    Returns
+    -------
+    scores : ndarray, shape (n_rec, n_pings)
+        The F-beta score at each pair of thresholds.
+    """
+    X_pings = np.asarray(X_pings)
+    pings_min = X_pings.min(axis=1) if X_pings.ndim > 1 else X_pings
+    y_pos = np.asarray(y).ravel() == 1
+
+    cells, shape, ranks = threshold_cells(
+        [X_rec, pings_min], [rec_thresholds, ping_thresholds]
+    )
+    return threshold_cell_scores(cells, y_pos, shape, ranks, beta=beta)
+
+
+class _ThresholdModelMixin:
+    """Save, load and streaming predict support shared by the threshold classifiers.
+
+    Models can be saved as JSON, the original format, or as a compressed
+    .npz file. In the .npz format the fitted arrays are stored in binary and
+    the thresholds and scalar attributes in a small JSON header. Loading a
+    .npz model only reads the header. Each array is read from the file as an
+    ndarray the first time it is accessed, so a loaded model can predict
+    without reading its training set, and no file handle is kept open.
+    """
+
+    # Attributes saved in the JSON header and as arrays respectively.
+    _header_attributes = []
+    _array_attributes = []
+
+    def save(self, filename):
+
+        if filename.endswith(".json"):
+            save_json = {name: getattr(self, name) for name in self._header_attributes}
+            # Arrays of a loaded .npz model are ndarrays
+            save_json.update({name: np.asarray(getattr(self, name)).tolist()
+                              for name in self._array_attributes})
+            with open(filename, "w") as outfile:
+                json.dump(save_json, outfile)
+
+        elif filename.endswith(".npz"):
+            header = {name: getattr(self, name) for name in self._header_attributes}
+            arrays = {name: np.asarray(getattr(self, name)) for name in self._array_attributes}
+            np.savez_compressed(filename, header=np.array(json.dumps(header)), **arrays)
+
+        else:
+            raise ValueError("filename must be of type .json or .npz")
+
+    def load(self, filename):
+
+        if filename.endswith(".json"):
+            with open(filename, "r") as outfile:
+                params = json.load(outfile)
+            for name in self._header_attributes + self._array_attributes:
+                setattr(self, name, params[name])
+            self._npz_filename = None
+
+        elif filename.endswith(".npz"):
+            with np.load(filename) as npz:
+                header = json.loads(npz["header"].item())
+            for name in self._header_attributes:
+                setattr(self, name, header[name])
+            # Drop any arrays from a previous fit or load so
+            # they are read from this file when accessed.
+            for name in self._array_attributes:
+                self.__dict__.pop(name, None)
+            self._npz_filename = filename
+
+        else:
+            raise ValueError("filename must be of type .json or .npz")
+
+    def predict_stream(self, batches, columns=None):
+        """Predict the class for each batch of an iterator of record batches.
+
+        Only one batch is held in memory at a time, so a fitted model
+        can label tables that are too large to load at once.
+
+        Parameters
+        ----------
+        batches : iterable
+            Batches of input samples. Each batch can be an array, a pandas
+            DataFrame or any object with a `to_pandas()` method, such as a
+            pyarrow RecordBatch from `ParquetFile.iter_batches()`.
+        columns : list of str, default=None
+            Columns to select from each batch, in the order :meth:`predict`
+            expects them. Required when batches contain extra columns.
+
+        Yields
+        ------
+        y : ndarray, shape (n_samples_in_batch,)
+            The predicted classes for each batch.
+        """
+        for batch in batches:
+            if hasattr(batch, "to_pandas"):
+                batch = batch.to_pandas()
+            if columns is not None:
+                batch = batch[columns]
+            yield self.predict(batch)
+
+    def __getattr__(self, name):
+        # Only called when normal attribute lookup fails, i.e. for
+        # arrays of a loaded .npz model that have not been read yet.
+        filename = self.__dict__.get("_npz_filename")
+        if filename is not None and name in self._array_attributes:
+            with np.load(filename) as npz:
+                value = npz[name]
+            setattr(self, name, value)
+            return value
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+    def __getstate__(self):
+        # Read any arrays still on disk so the model can be pickled.
+        for name in self._array_attributes:
+            getattr(self, name, None)
+        state = super().__getstate__()
+        state.pop("_npz_filename", None)
+        return state
+
+
+class SingleThresholdClassifier(_ThresholdModelMixin, ClassifierMixin, BaseEstimator):
     """An example classifier which implements a single threshold model where
     it checks X against a single hyperparameter, k, to predict a binary class.
     If X >= k, then it predicts 1 (True). If X < k, then it predicts 0 (False).
@@ -20,6 +319,9 @@ class SingleThresholdClassifier(ClassifierMixin, BaseEstimator):
         The lowest reception allowed for gaps that are passed in to
         train the model. The application of this filter is done
         before passing in X_ and is kept with the model for reference.
+    test_thresholds : array-like, default=None
+        The thresholds to test during :meth:`fit`. Defaults to the
+        integers 1 to 60 when None.
 
     Attributes
     ----------
@@ -38,44 +340,31 @@ class SingleThresholdClassifier(ClassifierMixin, BaseEstimator):
 
     """
 
-    def __init__(self, model_name="no name", lowest_rec=-1):
+    _header_attributes = [
+        "model_name",
+        "lowest_rec",
+        "k_",
+        "optimal_score_",
+        "test_thresholds_",
+    ]
+    _array_attributes = ["X_", "y_", "threshold_scores_"]
+
+    def __init__(self, model_name="no name", lowest_rec=-1, test_thresholds=None):
         self.model_name = model_name
         self.lowest_rec = lowest_rec
+        self.test_thresholds = test_thresholds
 
-    def save(self, filename):
-
-        if not filename.endswith(".json"):
-            raise ValueError("filename must be of type .json")
-
-        save_json = {
-            "model_name": self.model_name,
-            "lowest_rec": self.lowest_rec,
-            "X_": self.X_,
-            "y_": self.y_,
-            "k_": self.k_,
-            "optimal_score_": self.optimal_score_,
-            "test_thresholds_": self.test_thresholds_,
-            "threshold_scores_": self.threshold_scores_,
-        }
+    def threshold_grid(self):
+        """Return the thresholds tested during :meth:`fit`, as a list
+        with one array per threshold dimension."""
+        if self.test_thresholds is None:
+            return [np.arange(1, 61)]
+        return [np.asarray(self.test_thresholds)]
 
-        with open(filename, "w") as outfile:
-            json.dump(save_json, outfile)
-
-    def load(self, filename):
-
-        if not filename.endswith(".json"):
-            raise ValueError("filename must be of type .json")
-
-        with open(filename, "r") as outfile:
-            params = json.load(outfile)
-            self.model_name = params["model_name"]
-            self.lowest_rec = params["lowest_rec"]
-            self.X_ = params["X_"]
-            self.y_ = params["y_"]
-            self.k_ = params["k_"]
-            self.optimal_score_ = params["optimal_score_"]
-            self.test_thresholds_ = params["test_thresholds_"]
-            self.threshold_scores_ = params["threshold_scores_"]
+    def threshold_features(self, X):
+        """Return the values compared against each dimension of
+        :meth:`threshold_grid` for the samples in X."""
+        return [np.asarray(X).min(axis=1)]
 
     def fit(self, X, y):
         """A reference implementation of a fitting function for a classifier.
@@ -97,22 +386,17 @@ class SingleThresholdClassifier(ClassifierMixin, BaseEstimator):
         self.X_ = X.tolist()
         self.y_ = y.tolist()
 
-        # Select the optimal threshold_ value from 1 to 60 using F0.5 score.
-        test_thresholds = np.arange(1, 61)
-        threshold_scores = []
-        for thresh in test_thresholds:
-            classes_for_thresh = np.where(
-                np.where(X >= thresh, 1, 0).all(axis=1, keepdims=True), 1, 0
-            )
-            threshold_scores.append(
-                fbeta_score(y, classes_for_thresh, beta=0.5, average="binary")
-            )
+        # Select the optimal threshold_ value using F0.5 score.
+        (test_thresholds,) = self.threshold_grid()
+        threshold_scores = single_threshold_scores(X, y, test_thresholds)
 
         self.test_thresholds_ = test_thresholds.tolist()
-        self.threshold_scores_ = threshold_scores
-        
-        self.optimal_score_ = max(threshold_scores)
-        self.k_ = int(test_thresholds[threshold_scores.index(self.optimal_score_)])
+        self.threshold_scores_ = threshold_scores.tolist()
+
+        # argmax returns the first (lowest index) optimum, matching list.index().
+        best_idx = int(np.argmax(threshold_scores))
+        self.optimal_score_ = float(threshold_scores[best_idx])
+        self.k_ = test_thresholds[best_idx].item()
 
         return self
 
@@ -130,15 +414,13 @@ class SingleThresholdClassifier(ClassifierMixin, BaseEstimator):
             The label for each sample is the label of the closest sample
             seen during fit.
         """
-        check_is_fitted(self, ["X_", "y_"])
+        check_is_fitted(self, ["k_"])
         X = check_array(X)
 
-        return np.where(
-            np.where(X >= self.k_, 1, 0).all(axis=1, keepdims=True), 1, 0
-        ).flatten()
+        return np.where((X >= self.k_).all(axis=1), 1, 0)
 
 
-class DoubleThresholdClassifier(ClassifierMixin, BaseEstimator):
+class DoubleThresholdClassifier(_ThresholdModelMixin, ClassifierMixin, BaseEstimator):
     """An example classifier which implements a double threshold model where
     it checks X against two hyperparameters, k and j, to predict a binary class.
     For each x in X, if the ping rate variable is >= k AND the reception variable
@@ -153,6 +435,12 @@ class DoubleThresholdClassifier(ClassifierMixin, BaseEstimator):
         The lowest reception allowed for gaps that are passed in to
         train the model. The application of this filter is done
         before passing in X_ and is kept with the model for reference.
+    test_thresholds_rec : array-like, default=None
+        The reception thresholds to test during :meth:`fit`. Defaults
+        to the integers from lowest_rec + 1 to 60 when None.
+    test_thresholds_pings : array-like, default=None
+        The ping rate thresholds to test during :meth:`fit`. Defaults
+        to the integers 1 to 60 when None.
 
     Attributes
     ----------
@@ -171,53 +459,47 @@ class DoubleThresholdClassifier(ClassifierMixin, BaseEstimator):
         The thresholds tested during :meth:`fit`.
     test_thresholds_rec_: array-like
         The thresholds tested during :meth:`fit`.
-    threshold_scores_: array-like, shape (len(test_threshold_pings_), len(test_thresholds_rec_))
+    threshold_scores_: array-like, shape (len(test_thresholds_rec_), len(test_threshold_pings_))
         The model score at each of the thresholds in test_thresholds_.
 
     """
 
-    def __init__(self, model_name="no name", lowest_rec=-1):
+    _header_attributes = [
+        "model_name",
+        "lowest_rec",
+        "k_",
+        "j_",
+        "optimal_score_",
+        "test_thresholds_pings_",
+        "test_thresholds_rec_",
+    ]
+    _array_attributes = ["X_", "y_", "threshold_scores_"]
+
+    def __init__(self, model_name="no name", lowest_rec=-1,
+                 test_thresholds_rec=None, test_thresholds_pings=None):
         self.model_name = model_name
         self.lowest_rec = lowest_rec
-
-    def save(self, filename):
-
-        if not filename.endswith(".json"):
-            raise ValueError("filename must be of type .json")
-
-        save_json = {
-            "model_name": self.model_name,
-            "lowest_rec": self.lowest_rec,
-            "X_": self.X_,
-            "y_": self.y_,
-            "k_": self.k_,
-            "j_": self.j_,
-            "optimal_score_": self.optimal_score_,
-            "test_thresholds_pings_": self.test_thresholds_pings_,
-            "test_thresholds_rec_": self.test_thresholds_rec_,
-            "threshold_scores_": self.threshold_scores_,
-        }
-
-        with open(filename, "w") as outfile:
-            json.dump(save_json, outfile)
-
-    def load(self, filename):
-
-        if not filename.endswith(".json"):
-            raise ValueError("filename must be of type .json")
-
-        with open(filename, "r") as outfile:
-            params = json.load(outfile)
-            self.model_name = params["model_name"]
-            self.lowest_rec = params["lowest_rec"]
-            self.X_ = params["X_"]
-            self.y_ = params["y_"]
-            self.k_ = params["k_"]
-            self.j_ = params["j_"]
-            self.optimal_score_ = params["optimal_score_"]
-            self.test_thresholds_pings_ = params["test_thresholds_pings_"]
-            self.test_thresholds_rec_ = params["test_thresholds_rec_"]
-            self.threshold_scores_ = params["threshold_scores_"]
+        self.test_thresholds_rec = test_thresholds_rec
+        self.test_thresholds_pings = test_thresholds_pings
+
+    def threshold_grid(self):
+        """Return the reception and ping rate thresholds tested
+        during :meth:`fit`, in that order."""
+        if self.test_thresholds_rec is None:
+            test_thresholds_rec = np.arange(self.lowest_rec + 1, 61)
+        else:
+            test_thresholds_rec = np.asarray(self.test_thresholds_rec)
+        if self.test_thresholds_pings is None:
+            test_thresholds_pings = np.arange(1, 61)
+        else:
+            test_thresholds_pings = np.asarray(self.test_thresholds_pings)
+        return [test_thresholds_rec, test_thresholds_pings]
+
+    def threshold_features(self, X):
+        """Return the values compared against the reception and ping
+        rate thresholds of :meth:`threshold_grid` for the samples in X."""
+        X = np.asarray(X)
+        return [X[:, 0], X[:, 1:].min(axis=1)]
 
     def fit(self, X, y):
         """A reference implementation of a fitting function for a classifier.
@@ -239,61 +521,37 @@ class DoubleThresholdClassifier(ClassifierMixin, BaseEstimator):
         self.X_ = X.tolist()
         self.y_ = y.tolist()
 
-        X_rec = np.apply_along_axis(lambda x: x[:1], 1, X)
-        X_pings = np.apply_along_axis(lambda x: x[1:], 1, X)
-
-        test_thresholds_rec = np.arange(self.lowest_rec + 1, 61)
-        test_thresholds_pings = np.arange(1, 61)
+        X_rec = X[:, 0]
+        X_pings = X[:, 1:]
 
-        # Test all threshold combinations and get optimal parameters.
-        threshold_scores_results = Parallel(n_jobs=4)(delayed(self._calculate_fscore)(X_rec, X_pings, y, rec_thresh, ping_thresh) for rec_thresh in test_thresholds_rec for ping_thresh in test_thresholds_pings)
+        test_thresholds_rec, test_thresholds_pings = self.threshold_grid()
 
-        # Reformat threshold_scores to be a list of lists where
-        # each nested list is the scores for all ping thresholds
+        # Score all threshold combinations at once. threshold_scores is
+        # a matrix where each row is the scores for all ping thresholds
         # at a particular reception threshold.
-        threshold_scores = []
-        num_ping_results = len(test_thresholds_pings)
-        for idx_rec in range(len(test_thresholds_rec)):
-            start_idx = idx_rec*num_ping_results
-            end_idx = start_idx + num_ping_results
-            threshold_scores.append(threshold_scores_results[start_idx:end_idx])
+        threshold_scores = double_threshold_scores(
+            X_rec, X_pings, y, test_thresholds_rec, test_thresholds_pings
+        )
 
         self.test_thresholds_pings_ = test_thresholds_pings.tolist()
         self.test_thresholds_rec_ = test_thresholds_rec.tolist()
-        self.threshold_scores_ = threshold_scores
-        
+        self.threshold_scores_ = threshold_scores.tolist()
+
         self.optimal_score_ = -1
         self.j_ = -1
         self.k_ = -1
-        for idx_rec in range(len(test_thresholds_rec)):
-            for idx_ping in range(len(test_thresholds_pings)):
-                score = self.threshold_scores_[idx_rec][idx_ping]
-                if score > self.optimal_score_:
-                    self.optimal_score_ = score
-                    self.j_ = self.test_thresholds_rec_[idx_rec]
-                    self.k_ = self.test_thresholds_pings_[idx_ping]
+        if threshold_scores.size > 0:
+            # argmax over the flattened matrix returns the first optimum in
+            # reception-major order, the same tie-break as scanning the grid.
+            idx_rec, idx_ping = np.unravel_index(
+                np.argmax(threshold_scores), threshold_scores.shape
+            )
+            self.optimal_score_ = float(threshold_scores[idx_rec, idx_ping])
+            self.j_ = self.test_thresholds_rec_[idx_rec]
+            self.k_ = self.test_thresholds_pings_[idx_ping]
 
         return self
 
-    def _calculate_fscore(self, X_rec, X_pings, y, rec_thresh, ping_thresh):
-        rec_thresh_test = np.where(X_rec >= rec_thresh, 1, 0).flatten()
-        pings_thresh_test = np.where(
-            np.where(X_pings >= ping_thresh, 1, 0).all(axis=1, keepdims=False),
-            1,
-            0,
-        )
-
-        # Set class based on if each data point passes both tests or not
-        classes_for_thresh = np.where(
-            np.asarray(list(zip(rec_thresh_test, pings_thresh_test))).all(axis=1, keepdims=True),
-            1,
-            0,
-        )
-
-        return fbeta_score(y, classes_for_thresh, beta=0.5, average="binary")
-
-
-
     def predict(self, X):
         """Predict the class based on how each x in X relates to k_ and j_.
         For each x in X, if the ping rate variable is >= k AND the reception variable
@@ -311,26 +569,14 @@ class DoubleThresholdClassifier(ClassifierMixin, BaseEstimator):
             The label for each sample is the label of the closest sample
             seen during fit.
         """
-        check_is_fitted(self, ["X_", "y_"])
+        check_is_fitted(self, ["k_", "j_"])
         X = check_array(X)
 
         # Test reception for each data point against threshold
-        X_rec = np.apply_along_axis(lambda x: x[:1], 1, X)
-        rec_thresh_test = np.where(X_rec >= self.j_, 1, 0).flatten()
+        rec_thresh_test = X[:, 0] >= self.j_
 
         # Test ping rates for each data point against threshold
-        X_pings = np.apply_along_axis(lambda x: x[1:], 1, X)
-        pings_thresh_test = np.where(
-            np.where(X_pings >= self.k_, 1, 0).all(axis=1, keepdims=False), 1, 0
-        )
+        pings_thresh_test = (X[:, 1:] >= self.k_).all(axis=1)
 
         # Set class based on if each data point passes both tests or not
-        predicted_classes = np.where(
-            np.asarray(list(zip(rec_thresh_test, pings_thresh_test))).all(
-                axis=1, keepdims=True
-            ),
-            1,
-            0,
-        )
-
-        return predicted_classes.flatten()
+        return np.where(rec_thresh_test & pings_thresh_test, 1, 0)
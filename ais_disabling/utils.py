@@ -3,11 +3,17 @@
 import pandas as pd
 import numpy as np
 import os
+import hashlib
+import warnings
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta, date
 from dateutil.relativedelta import relativedelta
 
 import scipy
 import scipy.interpolate
+import scipy.linalg
+import scipy.spatial.distance
 import matplotlib.pyplot as plt
 from matplotlib import colors,colorbar, cm
 
@@ -21,6 +27,7 @@ import cmocean
 from google.cloud import bigquery
 
 from . import config
+from . import executor
 
 # Establish BigQuery connection
 client = bigquery.Client()
@@ -39,18 +46,17 @@ n_lon = config.n_lon
 lons = config.lons
 lats = config.lats
 
-def execute_commands_in_parallel(commands):
-    '''This takes a list of commands and runs them in parallel
-    Note that this assumes you can run 16 commands in parallel,
-    your mileage may vary if your computer is old and slow.
-    Requires having gnu parallel installed on your machine.
+def execute_commands_in_parallel(commands,
+                                 max_workers=config.max_parallel_jobs,
+                                 max_retries=config.max_job_retries):
+    '''This takes a list of `jinja2 ... | bq query ...` commands and runs
+    them in parallel, with at most `max_workers` running at once.
+    Templates are rendered in process and transient BigQuery errors
+    are retried with backoff. Returns a list of `executor.JobResult`
+    with the exit status, attempts and latency of each command.
     '''
-    with open('commands.txt', 'w') as f:
-        print(commands)
-        f.write("\n".join(commands))
-
-    os.system("parallel -j 16 < commands.txt")
-    os.system("rm -f commands.txt")
+    jobs = [executor.job_from_command(cmd) for cmd in commands]
+    return executor.run_jobs(jobs, max_workers=max_workers, max_retries=max_retries)
 
 # Create set of dates
 def daterange(date1, date2):
@@ -70,7 +76,7 @@ def already_processed(dataset = "gfw_research",
     FROM {dataset}.__TABLES__
     WHERE table_id = '{table}'
     '''.format(table=table, dataset=dataset)
-    df = pandas_gbq.read_gbq(q, project_id="world-fishing-827")
+    df = pd.read_gbq(q, project_id="world-fishing-827")
     if len(df)==0:
         return []
 
@@ -82,11 +88,11 @@ def already_processed(dataset = "gfw_research",
     SELECT DISTINCT
     {partition} as date
     FROM {dataset}.{table}
-    WHERE {partition} >= {min_date}
+    WHERE {partition} >= '{min_date}'
     GROUP BY date
     ORDER BY date
-    '''.format(table=table, dataset=dataset,partition=partition)
-    df = pandas_gbq.read_gbq(q, project_id="world-fishing-827")
+    '''.format(table=table, dataset=dataset, partition=partition, min_date=min_date)
+    df = pd.read_gbq(q, project_id="world-fishing-827")
     dt = list(df.date)
     ap = map(lambda x: x.strftime("%Y-%m-%d"), dt)
     return list(ap)
@@ -162,7 +168,9 @@ def make_ais_gap_events_features_table(pipeline_version,
                                        start_date,
                                        end_date,
                                        destination_dataset,
-                                       destination_table):
+                                       destination_table,
+                                       reception_smoothed_table=config.sat_reception_smoothed,
+                                       inverse_delta_degrees=inverse_delta_degrees):
 
     # Format jinja2 command
     cmd = """jinja2 gaps/ais_gap_events_features.sql.j2 \
@@ -172,6 +180,8 @@ def make_ais_gap_events_features_table(pipeline_version,
     -D start_date="{start_date}" \
     -D end_date="{end_date}" \
     -D destination_dataset="{destination_dataset}" \
+    -D reception_smoothed_table="{reception_smoothed_table}" \
+    -D inverse_delta_degrees="{inverse_delta_degrees}" \
     | \
     bq query --replace \
     --destination_table={destination_dataset}.{destination_table}\
@@ -182,7 +192,9 @@ def make_ais_gap_events_features_table(pipeline_version,
                start_date=start_date,
                end_date=end_date,
                destination_dataset=destination_dataset,
-               destination_table=destination_table)
+               destination_table=destination_table,
+               reception_smoothed_table=reception_smoothed_table,
+               inverse_delta_degrees=inverse_delta_degrees)
     return cmd
 
 ####################################
@@ -380,7 +392,7 @@ def make_hourly_loitering_interpolation_table(
 #
 # ###################################
 
-def make_grids(df, names):
+def make_grids(df, names, inverse_delta_degrees=inverse_delta_degrees):
     """
     Parameters
     ----------
@@ -392,23 +404,34 @@ def make_grids(df, names):
         the `cls` variable.
     names: list of str
         Name to extract from the data frame and place in a grid
+    inverse_delta_degrees : int or float
+        Number of grid cells per degree.
 
     Returns
     -------
-    A_grids, B_grids : dict of arrays
-        The dictionary keys are the draw from the passed in names.
+    A_grids, B_grids : arrays of shape (len(names), n_lat, n_lon)
+        One grid per name, in the order of the passed in names.
+        Cells without data are zero.
     """
-    A_grids = {k : np.zeros([n_lat, n_lon]) for k in names}
-    B_grids = {k : np.zeros([n_lat, n_lon]) for k in names}
-    for row in df.itertuples():
-        if np.isnan(row.lat_bin) or np.isnan(row.lon_bin):
-            continue
-        lat_ndx = int((row.lat_bin - min_lat) * inverse_delta_degrees)
-        lon_ndx = int((row.lon_bin - min_lon) * inverse_delta_degrees)
-        grids = A_grids if (row.cls == 'A') else B_grids
-        for k in names:
-            grids[k][lat_ndx][lon_ndx] = getattr(row, k)
-    return A_grids, B_grids
+    n_lat = int(round((max_lat - min_lat) * inverse_delta_degrees))
+    n_lon = int(round((max_lon - min_lon) * inverse_delta_degrees))
+    grids = np.zeros([2, len(names), n_lat, n_lon])
+
+    lat_bin = df['lat_bin'].to_numpy(dtype=float)
+    lon_bin = df['lon_bin'].to_numpy(dtype=float)
+    valid = ~(np.isnan(lat_bin) | np.isnan(lon_bin))
+
+    # Bins are on the grid, so round to avoid floating point
+    # error at resolutions that aren't a power of two
+    lat_ndx = np.round((lat_bin[valid] - min_lat) * inverse_delta_degrees).astype(int)
+    lon_ndx = np.round((lon_bin[valid] - min_lon) * inverse_delta_degrees).astype(int)
+    # 0 for class A, 1 for class B
+    cls_ndx = (df['cls'].to_numpy()[valid] != 'A').astype(int)
+
+    for i, k in enumerate(names):
+        grids[cls_ndx, i, lat_ndx, lon_ndx] = df[k].to_numpy(dtype=float)[valid]
+
+    return grids[0], grids[1]
 
 # Reception measured function
 def make_reception_measured_table(destination_table,
@@ -418,7 +441,8 @@ def make_reception_measured_table(destination_table,
                                   segs_table,
                                   output_version,
                                   include_all_speeds="False",
-                                  exclude_disabling="False"):
+                                  exclude_disabling="False",
+                                  inverse_delta_degrees=inverse_delta_degrees):
 
     # Set end date to end of month of start date
     reception_start = str(start_date.date())
@@ -440,6 +464,7 @@ def make_reception_measured_table(destination_table,
        -D no_disabling="{no_disabling}" \
        -D destination_dataset="{destination_dataset}" \
        -D output_version="{output_version}" \
+       -D inverse_delta_degrees="{inverse_delta_degrees}" \
        | \
         bq query --replace \
         --destination_table={destination_dataset}.{destination_table} \
@@ -451,24 +476,97 @@ def make_reception_measured_table(destination_table,
                                                                 segs_table = segs_table,
                                                                 all_speeds = include_all_speeds,
                                                                 no_disabling = exclude_disabling,
-                                                                output_version = output_version)
+                                                                output_version = output_version,
+                                                                inverse_delta_degrees = inverse_delta_degrees)
     return cmd
 
 # Reception interpolation function
-def interpolate_reception(y, hours, hours_cap=15, elevation_scale=10,
-                          smooth=1, epsilon=None, hours_threshold=0,
-                          rough_draft=True):
+def _rbf_epsilon(points):
+    """Default `epsilon` of `scipy.interpolate.Rbf`: the average
+    distance between nodes, based on a bounding hypercube."""
+    edges = np.ptp(points, axis=0)
+    edges = edges[np.nonzero(edges)]
+    return np.power(np.prod(edges) / len(points), 1.0 / edges.size)
+
+# Cache of factorized RBF systems, so that refitting the same nodes with
+# new values only needs a back substitution. `interpolate_reception` keys
+# it on the mask, `spherical`, `smooth`, `epsilon` and `elevation_scale`,
+# plus the elevations only when they vary over the mask. The elevations
+# are set by the hours, so months only share an entry when the fitted
+# cells have the same elevations, e.g. with `elevation_scale=0` or
+# `hours_threshold >= hours_cap`. Each entry holds a dense n x n matrix,
+# which can be several GB at full resolution, so the cache is off unless
+# RBF_CACHE_BYTES is set. It is per process: workers of a process pool each keep their own, and
+# only inherit RBF_CACHE_BYTES from the parent when they are forked.
+# The least recently used entries are dropped to stay within the budget,
+# and clear_rbf_cache() frees them all, e.g. at the end of a batch.
+RBF_CACHE_BYTES = 0
+_rbf_factorizations = OrderedDict()
+
+def clear_rbf_cache():
+    """Free every cached RBF factorization."""
+    _rbf_factorizations.clear()
+
+def _factorization_nbytes(factorization):
+    _, (lu, piv) = factorization
+    return lu.nbytes + piv.nbytes
+
+def _multiquadric(r, epsilon):
+    # Same kernel as the default `function` of `scipy.interpolate.Rbf`
+    return np.sqrt((r / epsilon)**2 + 1)
+
+def _rbf_factorization(points, smooth, epsilon, cache_key=None):
     """
-    The strategy is to use RBF to interpolate the existing points onto a smooth grid.
-    There does not seem to be any provision for weighting but we exploit a third dimension
-    to apply psudo weighting to the data. Ideally we would use a Haversine metric, but there
-    is no built in haversine metric and using a custom metric is very slow.
-    As a result, opting for the default Euclidean metric.
+    Return epsilon and the LU factorization of the `scipy.interpolate.Rbf`
+    system for the given nodes, reusing a cached factorization when the
+    nodes, `smooth` and `epsilon` are unchanged. `cache_key` identifies
+    the nodes, and defaults to a hash of `points`.
+    """
+    points = np.ascontiguousarray(points, dtype=np.float64)
+    if cache_key is None:
+        cache_key = (hashlib.sha1(points.tobytes()).hexdigest(), points.shape)
+    key = (cache_key, smooth, epsilon)
+    if key in _rbf_factorizations:
+        _rbf_factorizations.move_to_end(key)
+        return _rbf_factorizations[key]
+
+    if epsilon is None:
+        epsilon = _rbf_epsilon(points)
+    A = _multiquadric(scipy.spatial.distance.squareform(scipy.spatial.distance.pdist(points)), epsilon)
+    A -= np.eye(len(points)) * smooth
+    factorization = (epsilon, scipy.linalg.lu_factor(A, overwrite_a=True))
+
+    if _factorization_nbytes(factorization) <= RBF_CACHE_BYTES:
+        _rbf_factorizations[key] = factorization
+        while sum(map(_factorization_nbytes, _rbf_factorizations.values())) > RBF_CACHE_BYTES:
+            _rbf_factorizations.popitem(last=False)
+    return factorization
+
+def _unit_sphere(lon, lat):
+    """Map lon/lat in degrees to points on a sphere whose radius is
+    chosen so that chord distances between nearby points are in degrees."""
+    radius = 180 / np.pi
+    lon, lat = np.radians(lon), np.radians(lat)
+    return radius * np.column_stack([np.cos(lat) * np.cos(lon),
+                                     np.cos(lat) * np.sin(lon),
+                                     np.sin(lat)])
+
+def _grid_coordinates(shape):
     """
-    # Create the interpolation grid.
-    lonvec, latvec = np.meshgrid(np.linspace(min_lon, max_lon, n_lon, endpoint=False),
-                                 np.linspace(min_lat, max_lat, n_lat, endpoint=False))
+    Return the lon and lat of the lower left corner of every cell of a
+    global grid with the given (n_lat, n_lon) shape, and its resolution
+    in cells per degree.
+    """
+    grid_n_lat, grid_n_lon = shape
+    lonvec, latvec = np.meshgrid(np.linspace(min_lon, max_lon, grid_n_lon, endpoint=False),
+                                 np.linspace(min_lat, max_lat, grid_n_lat, endpoint=False))
+    return lonvec, latvec, grid_n_lat / (max_lat - min_lat)
 
+def _prepare_reception(y, hours, hours_cap, elevation_scale, hours_threshold, rough_draft):
+    """
+    Return the values, the mask of cells to fit and their elevations,
+    with good reception assumed at the poles.
+    """
     y = y.copy()
     mask = (hours > hours_threshold)
     if rough_draft:
@@ -490,21 +588,14 @@ def interpolate_reception(y, hours, hours_cap=15, elevation_scale=10,
     y[0, :] = y[-1, :] = good
     elevation[0, :] = elevation[-1, :] = 0
 
-    # Since we are using a Euclidean metric, we paste three copied
-    # of the data together to avoid a problem at the dateline. We only
-    # add 20 degrees worth of data to either side to keep the problem size in
-    # check
-    west_mask = mask & (lonvec > 120)
-    east_mask = mask & (lonvec < -120)
-
-    latf = np.concatenate([latvec[west_mask].ravel(), latvec[mask].ravel(), latvec[east_mask].ravel()])
-    elevf = np.concatenate([elevation[west_mask].ravel(), elevation[mask].ravel(),
-                            elevation[east_mask].ravel()])
-    yf = np.concatenate([y[west_mask].ravel(), y[mask].ravel(), y[east_mask].ravel()])
-    # One copy of the longitude data is shifted west and one east.
-    lonf = np.concatenate([(lonvec[west_mask] - 360).ravel(), lonvec[mask].ravel(),
-                           (lonvec[east_mask] + 360).ravel()])
+    return y, mask, elevation
 
+def _rbf_fit_predict(points, yf, grid_points, method, smooth, epsilon, neighbors,
+                     cache_key=None):
+    """
+    Fit the RBF to the nodes `points` with values `yf` and evaluate it at `grid_points`.
+    `cache_key` identifies the nodes for the factorization cache of the `'rbf'` method.
+    """
     # There are two primary knobs to twiddle here, `smooth` and `epsilon`. With `smooth`
     # set to zero, it does an exact fit and larger values result in a smoother less
     # exact fit. `epsilon` is a scale parameter and also affects smoothness, but I haven't
@@ -512,26 +603,312 @@ def interpolate_reception(y, hours, hours_cap=15, elevation_scale=10,
     # had any luck with anything other than default `multiquadric`. In addition, adjusting
     # `elevation_scale` will change the amount of downweighting applied to cells with
     # few hours
-    interpolater = scipy.interpolate.Rbf(lonf, latf, elevf, yf, smooth=smooth, epsilon=epsilon)
+    if method == 'rbf':
+        # Solve the same system as `scipy.interpolate.Rbf`, but through a cached
+        # factorization so months with the same nodes (cells and elevations)
+        # and hyperparameters only differ by a back substitution.
+        epsilon, factorization = _rbf_factorization(points, smooth, epsilon, cache_key)
+        nodes = scipy.linalg.lu_solve(factorization, yf)
+
+        # Evaluate in chunks to bound the size of the distance matrix
+        smoothed = np.empty(len(grid_points))
+        chunk = 4096
+        for i in range(0, len(grid_points), chunk):
+            r = scipy.spatial.distance.cdist(grid_points[i:i + chunk], points)
+            smoothed[i:i + chunk] = _multiquadric(r, epsilon) @ nodes
+
+        return smoothed
+
+    # RBFInterpolator's multiquadric is -sqrt(1 + (epsilon * r)**2) and its smoothing
+    # is added to the diagonal, while Rbf uses sqrt(1 + (r / epsilon)**2) and subtracts
+    # `smooth`. With epsilon inverted and no polynomial term (`degree=-1`; Rbf has none)
+    # that is the same system with negated weights, so the fits agree when every
+    # node is a neighbor.
+    if epsilon is None:
+        epsilon = _rbf_epsilon(points)
+    with warnings.catch_warnings():
+        # RBFInterpolator warns that the multiquadric wants a degree 0 polynomial
+        warnings.simplefilter('ignore', UserWarning)
+        interpolater = scipy.interpolate.RBFInterpolator(points, yf, neighbors=neighbors,
+                                                         smoothing=smooth,
+                                                         kernel='multiquadric',
+                                                         epsilon=1 / epsilon,
+                                                         degree=-1)
+
+    return interpolater(grid_points)
+
+def interpolate_reception(y, hours, hours_cap=15, elevation_scale=10,
+                          smooth=1, epsilon=None, hours_threshold=0,
+                          rough_draft=None, method='rbf', neighbors=64,
+                          spherical=False):
+    """
+    The strategy is to use RBF to interpolate the existing points onto a smooth grid.
+    There does not seem to be any provision for weighting but we exploit a third dimension
+    to apply psudo weighting to the data. Ideally we would use a Haversine metric, but there
+    is no built in haversine metric and using a custom metric is very slow.
+    As a result, opting for the default Euclidean metric.
 
-    return interpolater(lonvec.flatten(), latvec.flatten(),
-                                    np.zeros_like(lonvec.flatten())).reshape(180, 360)
+    With `spherical=True`, cell centers are instead embedded as 3-D points on a
+    sphere, with the elevation as a fourth dimension. Euclidean distances on the
+    sphere are chord lengths, which are monotonic in the haversine distance, so
+    there is no dateline to patch and no stretching of longitudes at high
+    latitudes. The sphere's radius makes chord lengths roughly degrees so
+    `epsilon` and `elevation_scale` keep their meaning.
+
+    `method` selects the solver. `'rbf'` is the original `scipy.interpolate.Rbf`,
+    a dense global solve that is O(n^3) in the number of cells, which is why
+    `rough_draft` thins the grid. With `RBF_CACHE_BYTES` set, its factorization
+    is cached, so calls with the same mask, elevations, `smooth` and `epsilon`
+    reuse it and only redo the O(n^2) solve for the new `y`. `'neighbors'` uses
+    `scipy.interpolate.RBFInterpolator` with the same multiquadric kernel,
+    `smooth` and `epsilon` and no polynomial term, but only fits the `neighbors`
+    nearest cells around each grid point, so full resolution grids
+    (`rough_draft=False`) run in seconds. With `neighbors` at least the number
+    of cells it reproduces `'rbf'`. `rough_draft` defaults to True for `'rbf'`
+    and False for `'neighbors'`.
+
+    The resolution of the grid is taken from the shape of `y`, e.g. (360, 720)
+    for half a degree. Distances are in degrees at every resolution.
+    """
+    if method not in ('rbf', 'neighbors'):
+        raise ValueError(f"method must be 'rbf' or 'neighbors', not {method!r}")
+    if rough_draft is None:
+        rough_draft = (method == 'rbf')
+
+    # Create the interpolation grid at the resolution of `y`.
+    lonvec, latvec, grid_inverse_delta_degrees = _grid_coordinates(y.shape)
+
+    y, mask, elevation = _prepare_reception(y, hours, hours_cap, elevation_scale,
+                                            hours_threshold, rough_draft)
+
+    if spherical:
+        # Use cell centers so the pole rows don't collapse onto a single point
+        half_cell = 0.5 / grid_inverse_delta_degrees
+        lon_centers, lat_centers = lonvec + half_cell, latvec + half_cell
+        points = np.column_stack([_unit_sphere(lon_centers[mask], lat_centers[mask]),
+                                  elevation[mask]])
+        yf = y[mask]
+        grid_points = np.column_stack([_unit_sphere(lon_centers.ravel(), lat_centers.ravel()),
+                                       np.zeros(lonvec.size)])
+    else:
+        # Since we are using a Euclidean metric, we paste three copied
+        # of the data together to avoid a problem at the dateline. We only
+        # add 20 degrees worth of data to either side to keep the problem size in
+        # check
+        west_mask = mask & (lonvec > 120)
+        east_mask = mask & (lonvec < -120)
+
+        latf = np.concatenate([latvec[west_mask].ravel(), latvec[mask].ravel(), latvec[east_mask].ravel()])
+        elevf = np.concatenate([elevation[west_mask].ravel(), elevation[mask].ravel(),
+                                elevation[east_mask].ravel()])
+        yf = np.concatenate([y[west_mask].ravel(), y[mask].ravel(), y[east_mask].ravel()])
+        # One copy of the longitude data is shifted west and one east.
+        lonf = np.concatenate([(lonvec[west_mask] - 360).ravel(), lonvec[mask].ravel(),
+                               (lonvec[east_mask] + 360).ravel()])
+
+        points = np.column_stack([lonf, latf, elevf])
+        grid_points = np.column_stack([lonvec.ravel(), latvec.ravel(), np.zeros(lonvec.size)])
+
+    # The nodes are set by the mask and the elevations, which only need
+    # to be in the key when they vary over the mask
+    mask_elevation = elevation[mask]
+    if np.ptp(mask_elevation) == 0:
+        mask_elevation = mask_elevation[:1]
+    cache_key = (hashlib.sha1(np.packbits(mask).tobytes() + mask_elevation.tobytes()).hexdigest(),
+                 mask.shape, spherical, elevation_scale)
+
+    smoothed = _rbf_fit_predict(points, yf, grid_points, method, smooth, epsilon, neighbors,
+                                cache_key)
+    return smoothed.reshape(lonvec.shape)
+
+# Tiles with fewer cells to fit than this are skipped
+MIN_TILE_CELLS = 10
+
+def _taper(length, core_start, core_end, overlap):
+    """
+    Blending weights along one side of a tile: 1 inside the core of the
+    tile, falling linearly to 1 / (overlap + 1) at the edge of the overlap.
+    """
+    k = np.arange(length)
+    outside = np.maximum(np.maximum(core_start - k, k - (core_end - 1)), 0)
+    return 1 - outside / (overlap + 1)
+
+def _rbf_fit_predict_task(task):
+    # Unpack the arguments of `_rbf_fit_predict` for a process pool
+    return _rbf_fit_predict(*task)
+
+def interpolate_reception_tiled(y, hours, tile_degrees=None, overlap_degrees=None,
+                                hours_cap=15, elevation_scale=10,
+                                smooth=1, epsilon=None, hours_threshold=0,
+                                method='rbf', neighbors=64, spherical=False,
+                                max_workers=None):
+    """
+    Smooth reception like `interpolate_reception`, but one lat/lon tile at a time.
+
+    The grid is split into `tile_degrees` tiles, and each tile is fit to the cells in
+    the tile plus `overlap_degrees` on every side (wrapping around the dateline), so
+    the largest system to solve is set by the tile size rather than the number of
+    observed cells in the world. Tiles run in parallel worker processes and the
+    overlaps are blended with a linear taper. All cells are used, without the
+    `rough_draft` thinning.
+
+    Unless it is given, `epsilon` is computed once from all the observed cells, as
+    the global fit would, so that neighboring tiles use the same scale.
+
+    The resolution is taken from the shape of `y`. By default tiles are 30 by 30
+    cells with a 10 cell overlap, i.e. 30 and 10 degrees at one degree, so the size
+    of each system stays the same at finer resolutions.
+    """
+    if method not in ('rbf', 'neighbors'):
+        raise ValueError(f"method must be 'rbf' or 'neighbors', not {method!r}")
+
+    lonvec, latvec, grid_inverse_delta_degrees = _grid_coordinates(y.shape)
+    grid_n_lat, grid_n_lon = y.shape
+
+    if tile_degrees is None:
+        tile_degrees = 30 / grid_inverse_delta_degrees
+    if overlap_degrees is None:
+        overlap_degrees = 10 / grid_inverse_delta_degrees
+    tile = int(round(tile_degrees * grid_inverse_delta_degrees))
+    overlap = int(round(overlap_degrees * grid_inverse_delta_degrees))
+
+    y, mask, elevation = _prepare_reception(y, hours, hours_cap, elevation_scale,
+                                            hours_threshold, rough_draft=False)
+    if epsilon is None:
+        # From the same embedding of the cells as the tiles and `interpolate_reception`
+        if spherical:
+            half_cell = 0.5 / grid_inverse_delta_degrees
+            locations = _unit_sphere(lonvec[mask] + half_cell, latvec[mask] + half_cell)
+        else:
+            locations = np.column_stack([lonvec[mask], latvec[mask]])
+        epsilon = _rbf_epsilon(np.column_stack([locations, elevation[mask]]))
+
+    tasks = []
+    blocks = []
+    for i0 in range(0, grid_n_lat, tile):
+        i1 = min(i0 + tile, grid_n_lat)
+        rows = np.arange(max(0, i0 - overlap), min(grid_n_lat, i1 + overlap))
+        for j0 in range(0, grid_n_lon, tile):
+            j1 = min(j0 + tile, grid_n_lon)
+            # Keep longitudes continuous across the dateline
+            cols = np.arange(j0 - overlap, j1 + overlap)
+            block = np.ix_(rows, cols % grid_n_lon)
+
+            block_mask = mask[block]
+            if block_mask.sum() < MIN_TILE_CELLS:
+                continue
+
+            lon_grid, lat_grid = np.meshgrid(min_lon + cols / grid_inverse_delta_degrees,
+                                             min_lat + rows / grid_inverse_delta_degrees)
+            if spherical:
+                half_cell = 0.5 / grid_inverse_delta_degrees
+                locations = _unit_sphere(lon_grid.ravel() + half_cell, lat_grid.ravel() + half_cell)
+            else:
+                locations = np.column_stack([lon_grid.ravel(), lat_grid.ravel()])
+
+            points = np.column_stack([locations[block_mask.ravel()], elevation[block][block_mask]])
+            grid_points = np.column_stack([locations, np.zeros(len(locations))])
+            tasks.append((points, y[block][block_mask], grid_points,
+                          method, smooth, epsilon, neighbors))
+
+            weights = np.outer(_taper(len(rows), i0 - rows[0], i1 - rows[0], overlap),
+                               _taper(len(cols), overlap, overlap + j1 - j0, overlap))
+            blocks.append((block, weights))
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        predictions = pool.map(_rbf_fit_predict_task, tasks)
+
+        smoothed = np.zeros(lonvec.shape)
+        total_weights = np.zeros(lonvec.shape)
+        for (block, weights), prediction in zip(blocks, predictions):
+            np.add.at(smoothed, block, weights * prediction.reshape(weights.shape))
+            np.add.at(total_weights, block, weights)
+
+    # Cells only covered by skipped tiles get the average reception
+    uncovered = (total_weights == 0)
+    smoothed[uncovered] = y[mask].mean()
+    total_weights[uncovered] = 1
+
+    return smoothed / total_weights
 
 #
 # Create smooth reception table
 #
+def smoothed_reception_schema(inverse_delta_degrees=inverse_delta_degrees):
+    """
+    Schema of the smoothed reception table. Bins are integers at one
+    degree, as in the original tables, and floats at finer resolutions.
+    """
+    bin_type = 'INTEGER' if inverse_delta_degrees == 1 else 'FLOAT'
+    return [
+        bigquery.SchemaField('year', 'INTEGER'),
+        bigquery.SchemaField('month', 'INTEGER'),
+        bigquery.SchemaField('lat_bin', bin_type),
+        bigquery.SchemaField('lon_bin', bin_type),
+        bigquery.SchemaField('class', 'STRING'),
+        bigquery.SchemaField('positions_per_day', 'FLOAT'),
+    ]
+
+def _smoothed_reception_df(start_date, smoothed_A_reception, smoothed_B_reception):
+    """
+    Convert smoothed Class A and B grids for a month to a data frame,
+    with one row per grid cell and class, ordered by class, lat and lon.
+    The resolution is taken from the shape of the grids.
+    """
+    lon_grid, lat_grid, grid_inverse_delta_degrees = _grid_coordinates(np.shape(smoothed_A_reception))
+    n_cells = lat_grid.size
+    bin_dtype = np.int64 if grid_inverse_delta_degrees == 1 else np.float64
+
+    return pd.DataFrame({
+        'year': np.full(2 * n_cells, start_date.year, dtype=np.int64),
+        'month': np.full(2 * n_cells, start_date.month, dtype=np.int64),
+        'lat_bin': np.tile(lat_grid.ravel(), 2).astype(bin_dtype),
+        'lon_bin': np.tile(lon_grid.ravel(), 2).astype(bin_dtype),
+        'class': np.repeat(['A', 'B'], n_cells),
+        'positions_per_day': np.concatenate([np.ravel(smoothed_A_reception),
+                                             np.ravel(smoothed_B_reception)]).astype(np.float64),
+    })
+
+def _load_smooth_reception_partition(df, start_date, destination_dataset, destination_table,
+                                     inverse_delta_degrees=inverse_delta_degrees):
+    """
+    Upload a month of smoothed reception to its partition in BigQuery,
+    replacing any data already in the partition
+    """
+    # Format date string without dashes for partition
+    # Use start of month as partition date
+    dest_table_partition = str(start_date.date())
+    dest_table_partition = destination_table + "$"+ dest_table_partition.replace("-","")
+
+    # Data is sent as Parquet with an explicit schema
+    # rather than relying on schema autodetection
+    job_config = bigquery.LoadJobConfig(schema=smoothed_reception_schema(inverse_delta_degrees),
+                                        source_format=bigquery.SourceFormat.PARQUET,
+                                        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE)
+    job = client.load_table_from_dataframe(df,
+                                           "{d}.{t}".format(d = destination_dataset, t = dest_table_partition),
+                                           job_config=job_config)
+    job.result()
+
+    print("Loaded data for {} into {}.{}".format(start_date,
+                                                 destination_dataset,
+                                                 dest_table_partition))
+
 def make_smooth_reception_table(start_date,
                                 reception_measured_table,
                                 destination_dataset,
-                                destination_table):
+                                destination_table,
+                                method='rbf',
+                                spherical=False,
+                                inverse_delta_degrees=inverse_delta_degrees):
 
     """
-    Generate smooth reception map for month
+    Generate smooth reception map for month. `method` and `spherical`
+    are passed to `interpolate_reception`. `inverse_delta_degrees` is the
+    resolution of `reception_measured_table`.
     """
     # Dates for reception map
     reception_start = start_date
-    # End date (not inclusive)
-    reception_end = start_date + relativedelta(months=1)
 
     ### Measured reception ###
     # Query to calculate measured reception
@@ -547,73 +924,117 @@ def make_smooth_reception_table(start_date,
     month_reception = pd.read_gbq(month_reception_query, project_id='world-fishing-827', dialect='standard')
 
     # Generate Class A and B grids from ping_density query results
-    A_grids, B_grids = make_grids(month_reception, ['sat_pos_per_day', 'hours'])
+    A_grids, B_grids = make_grids(month_reception, ['sat_pos_per_day', 'hours'], inverse_delta_degrees)
+    A_sat_pos_per_day, A_hours = A_grids
+    B_sat_pos_per_day, B_hours = B_grids
 
     ### Interpolated reception ###
     print("Interpolating reception for {}".format(reception_start))
     # Interpolate reception for Class A
-    smoothed_A_reception = interpolate_reception(A_grids['sat_pos_per_day'], A_grids['hours'])
+    smoothed_A_reception = interpolate_reception(A_sat_pos_per_day, A_hours,
+                                                 method=method, spherical=spherical)
     # Interpolate reception for Class A
-    smoothed_B_reception = interpolate_reception(B_grids['sat_pos_per_day'], B_grids['hours'])
+    smoothed_B_reception = interpolate_reception(B_sat_pos_per_day, B_hours,
+                                                 method=method, spherical=spherical)
 
     """
     Convert data to pandas data frame and upload to BigQuery
     """
-    # Empty list to store coordinates and values
-    data_A = []
-    data_B = []
-
-    # Loop over lat/lon and fill with positions per hour
-    for lat in range(n_lat):
-        for lon in range(n_lon):
-            # Add data to each list
-            data_A.append([lats[lat], lons[lon], smoothed_A_reception[lat][lon]])
-            data_B.append([lats[lat], lons[lon], smoothed_B_reception[lat][lon]])
-
-    # Convert lists to pandas dataframes
-    df_A = pd.DataFrame(data_A, columns=['lat_bin','lon_bin','positions_per_day'])
-    df_A['class'] = 'A'
-
-    df_B = pd.DataFrame(data_B, columns=['lat_bin','lon_bin','positions_per_day'])
-    df_B['class'] = 'B'
-
-    # Stack dataframes into single table
-    df = pd.concat([df_A, df_B], axis = 0).reset_index(drop=True)
-
-    # Add column for year and month
-    df['year'] = reception_start.year
-    df['month'] = reception_start.month
-
-    # Rearrange columns
-    df = df[['year','month','lat_bin','lon_bin','class','positions_per_day']]
+    df = _smoothed_reception_df(reception_start, smoothed_A_reception, smoothed_B_reception)
+    _load_smooth_reception_partition(df, reception_start, destination_dataset, destination_table,
+                                     inverse_delta_degrees)
+
+def _interpolate_reception_task(task):
+    # Unpack a (y, hours, kwargs) task for a process pool
+    y, hours, kwargs = task
+    return interpolate_reception(y, hours, **kwargs)
+
+def make_smooth_reception_tables(reception_dates,
+                                 reception_measured_table,
+                                 destination_dataset,
+                                 destination_table,
+                                 method='rbf',
+                                 spherical=False,
+                                 max_workers=None,
+                                 output_file=None,
+                                 inverse_delta_degrees=inverse_delta_degrees):
+    """
+    Generate smooth reception maps for many months at once.
 
-    # Set index to remove index colum
-    df = df.set_index('year')
+    Measured reception for all months is fetched in a single query, and each
+    (month, class) pair is interpolated in its own worker process. Each month
+    is then uploaded to its partition of `destination_table`.
 
-    # Save data to tmp csv file
-    df.to_csv('tmp.csv')
+    Parameters
+    ----------
+    reception_dates : list of Timestamp
+        Start of each month to smooth, e.g. `config.reception_dates`.
+    reception_measured_table : str
+        Table of measured reception, partitioned by month.
+    destination_dataset : str
+    destination_table : str
+    method : str
+        Passed to `interpolate_reception`. The default `'rbf'` reproduces
+        the published smoothed reception tables. `'neighbors'` is a much
+        faster local approximation that also fits every cell instead of
+        the `rough_draft` grid, so its output differs from the tables;
+        only use it to write to a table of its own.
+    spherical : bool
+        Passed to `interpolate_reception`.
+    max_workers : int, default=None
+        Number of worker processes. Defaults to the number of CPUs.
+    output_file : str, default=None
+        If given, the smoothed reception for all months is also written
+        to this Parquet file.
+    inverse_delta_degrees : int
+        Resolution of `reception_measured_table`, in cells per degree.
 
+    Returns
+    -------
+    Pandas DataFrame
+        Smoothed reception for all months, in the same layout as
+        `destination_table`.
     """
-    Upload to BigQuery
-    """
+    reception_dates = [pd.Timestamp(r) for r in reception_dates]
+    months = ", ".join('"{}"'.format(r.date()) for r in reception_dates)
 
-    # Format date string without dashes for partition
-    # Use start of month as partition date
-    dest_table_partition = str(start_date.date())
-    dest_table_partition = destination_table + "\$"+ dest_table_partition.replace("-","")
-
-    with open("tmp.csv", "rb") as source_file:
-        bq_load_cmd = """bq load \
-        --source_format=CSV \
-        --autodetect \
-        --skip_leading_rows=1 \
-        "{d}.{t}" tmp.csv""".format(d = destination_dataset,t = dest_table_partition)
-
-        os.system(bq_load_cmd)
+    ### Measured reception ###
+    print("Querying reception for {} months".format(len(reception_dates)))
+    reception_query = '''SELECT *,
+                          DATE(_partitiontime) AS reception_month
+                          FROM `{d}.{t}`
+                          WHERE DATE(_partitiontime) IN ({m})
+                          AND lat_bin < 90'''.format(d = destination_dataset,
+                                                      t = reception_measured_table,
+                                                      m = months)
+    reception = pd.read_gbq(reception_query, project_id='world-fishing-827', dialect='standard')
+    reception['reception_month'] = pd.to_datetime(reception['reception_month'])
+
+    # One task per month and class
+    tasks = []
+    kwargs = dict(method=method, spherical=spherical)
+    for r in reception_dates:
+        month_reception = reception[reception['reception_month'] == r]
+        A_grids, B_grids = make_grids(month_reception, ['sat_pos_per_day', 'hours'], inverse_delta_degrees)
+        tasks.append((A_grids[0], A_grids[1], kwargs))
+        tasks.append((B_grids[0], B_grids[1], kwargs))
 
-    print("Loaded data for {} into {}.{}".format(reception_start,
-                                                 destination_dataset,
-                                                 dest_table_partition))
+    ### Interpolated reception ###
+    print("Interpolating reception for {} months".format(len(reception_dates)))
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        smoothed = list(pool.map(_interpolate_reception_task, tasks))
+
+    dfs = []
+    for i, r in enumerate(reception_dates):
+        df = _smoothed_reception_df(r, smoothed[2 * i], smoothed[2 * i + 1])
+        _load_smooth_reception_partition(df, r, destination_dataset, destination_table,
+                                         inverse_delta_degrees)
+        dfs.append(df)
+
+    df = pd.concat(dfs, axis = 0).reset_index(drop=True)
+    if output_file is not None:
+        df.to_parquet(output_file, index=False)
+    return df
 
 # Plot reception quality
 def plot_reception_quality(reception_df,
@@ -630,13 +1051,13 @@ def plot_reception_quality(reception_df,
     # Class A
     class_a_reception = pyseas.maps.rasters.df2raster(df[df['class'] == 'A'],
                                                       'lon_bin', 'lat_bin','positions_per_day',
-                                                      xyscale=1,
+                                                      xyscale=inverse_delta_degrees,
                                                       per_km2=False)
 
     # Class B
     class_b_reception = pyseas.maps.rasters.df2raster(df[df['class'] == 'B'],
                                                       'lon_bin', 'lat_bin','positions_per_day',
-                                                      xyscale=1,
+                                                      xyscale=inverse_delta_degrees,
                                                       per_km2=False)
     """
     Plot
@@ -733,12 +1154,12 @@ def plot_reception_residuals(df):
     # Pull out class A and B capped residuals
     class_a_cap_residuals = pyseas.maps.rasters.df2raster(sat_residuals[sat_residuals['class'] == 'A'],
                                                       'lon_bin', 'lat_bin','residual_cap',
-                                                      xyscale=1,
+                                                      xyscale=inverse_delta_degrees,
                                                       per_km2=False)
 
     class_b_cap_residuals = pyseas.maps.rasters.df2raster(sat_residuals[sat_residuals['class'] == 'B'],
                                                       'lon_bin', 'lat_bin','residual_cap',
-                                                      xyscale=1,
+                                                      xyscale=inverse_delta_degrees,
                                                       per_km2=False)
 
     # Plot
@@ -808,12 +1229,12 @@ def plot_reception_residuals(df):
 def plot_residual_histogram(sat_residuals):
     class_a_residuals = pyseas.maps.rasters.df2raster(sat_residuals[sat_residuals['class'] == 'A'],
                                                       'lon_bin', 'lat_bin','residual',
-                                                      xyscale=1,
+                                                      xyscale=inverse_delta_degrees,
                                                       per_km2=False)
 
     class_b_residuals = pyseas.maps.rasters.df2raster(sat_residuals[sat_residuals['class'] == 'B'],
                                                       'lon_bin', 'lat_bin','residual',
-                                                      xyscale=1,
+                                                      xyscale=inverse_delta_degrees,
                                                       per_km2=False)
 
     # set axes range
@@ -4,6 +4,7 @@ import pandas as pd
 import matplotlib.pyplot as plt
 from ais_disabling import utils
 from ais_disabling import config
+from ais_disabling import data_cache
 
 ###########################################################
 # Query stats about gap duration and distance
@@ -29,7 +30,7 @@ AND (
     )
 '''
 
-gap_length = pd.read_gbq(gap_stats_query, project_id = 'world-fishing-827')
+gap_length = data_cache.read_gbq(gap_stats_query, project_id = 'world-fishing-827')
 
 ###########################################################
 # Plot histograms of gaps statistics
@@ -4,7 +4,7 @@ import pandas as pd
 
 from ais_disabling.threshold_models import SingleThresholdClassifier, DoubleThresholdClassifier
 
-from ais_disabling.model_utils import get_models_folder
+from ais_disabling.model_utils import get_models_folder, get_model_filename
 from ais_disabling.figure_utils import (
     get_figures_folder,
     model_response_curves,
@@ -31,28 +31,28 @@ def model_selection_figures(models_folder, images_folder, lowest_rec, run_double
 
     # Load in the fitted models
     model_12hb = SingleThresholdClassifier()
-    model_12hb.load(f"{models_folder}/model_12hb.json")
+    model_12hb.load(get_model_filename(models_folder, "12hb"))
 
     model_18hb = SingleThresholdClassifier()
-    model_18hb.load(f"{models_folder}/model_18hb.json")
+    model_18hb.load(get_model_filename(models_folder, "18hb"))
 
     model_24hb = SingleThresholdClassifier()
-    model_24hb.load(f"{models_folder}/model_24hb.json")
+    model_24hb.load(get_model_filename(models_folder, "24hb"))
 
     model_rec_only = SingleThresholdClassifier(model_name="rec_only")
-    model_rec_only.load(f"{models_folder}/model_rec_only.json")
+    model_rec_only.load(get_model_filename(models_folder, "rec_only"))
 
     models = [model_12hb, model_18hb, model_24hb, model_rec_only]
 
     if run_double:
         model_rec_12hb = DoubleThresholdClassifier()
-        model_rec_12hb.load(f"{models_folder}/model_rec_12hb.json")
+        model_rec_12hb.load(get_model_filename(models_folder, "rec_12hb"))
 
         model_rec_18hb = DoubleThresholdClassifier()
-        model_rec_18hb.load(f"{models_folder}/model_rec_18hb.json")
+        model_rec_18hb.load(get_model_filename(models_folder, "rec_18hb"))
 
         model_rec_24hb = DoubleThresholdClassifier()
-        model_rec_24hb.load(f"{models_folder}/model_rec_24hb.json")
+        model_rec_24hb.load(get_model_filename(models_folder, "rec_24hb"))
 
         models.extend([model_rec_12hb, model_rec_18hb, model_rec_24hb])
 
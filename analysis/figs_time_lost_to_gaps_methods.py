@@ -12,12 +12,16 @@ import pyseas.maps as psm
 psm.use(psm.styles.chart_style)
 
 from ais_disabling.figure_utils import get_figures_folder
+from ais_disabling.query_cache import QueryCache
 
 import warnings
 warnings.filterwarnings("ignore")
 
+# Re-rendered queries are read from disk when their input tables are unchanged
+query_cache = QueryCache()
+
 def gbq(q):
-    return pd.read_gbq(q, project_id="world-fishing-827")
+    return query_cache.read_gbq(q, project_id="world-fishing-827")
 
 queries_folder = 'queries'
 
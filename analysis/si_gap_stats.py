@@ -9,6 +9,7 @@ import pandas as pd
 import numpy as np
 
 from ais_disabling import config
+from ais_disabling import data_cache
 
 ######################################################################
 # AIS disabling event summary statistics
@@ -20,7 +21,7 @@ FROM `{config.destination_dataset}.{config.gap_events_features_table}`
 {config.gap_filters}
 """
 
-gap_df = pd.read_gbq(query, project_id="world-fishing-827")
+gap_df = data_cache.read_gbq(query, project_id="world-fishing-827")
 gap_df.columns
 
 # Calculate summary stats about the number of vessels, flag states, geartypes with disabling events.
@@ -60,7 +61,7 @@ FROM `{config.destination_dataset}.{config.gap_events_features_table}`
 WHERE gap_hours >= 12
 """
 
-gap_frac_df = pd.read_gbq(gap_frac_query, project = 'world-fishing-827')
+gap_frac_df = data_cache.read_gbq(gap_frac_query, project = 'world-fishing-827')
 
 ######################################################################
 # Fraction of disabling events less than two weeks long
@@ -75,4 +76,4 @@ FROM `{config.destination_dataset}.{config.gap_events_features_table}`
 {config.gap_filters}
 """
 
-gap_frac_2w_df = pd.read_gbq(gap_frac_2w_query, project = 'world-fishing-827')
+gap_frac_2w_df = data_cache.read_gbq(gap_frac_2w_query, project = 'world-fishing-827')
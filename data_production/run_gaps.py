@@ -47,6 +47,7 @@ import pyseas.cm
 # project specific functions
 from ais_disabling import utils
 from ais_disabling import config
+from ais_disabling import planner
 
 # %load_ext autoreload
 # %load_ext google.cloud.bigquery
@@ -131,9 +132,17 @@ except NotFound:
 #
 # Generate off events
 
+# Only (re)build days that are missing or whose pipeline
+# partitions (today and tomorrow) have changed since
+off_dates = planner.plan_partitions(
+    tp,
+    f"{destination_dataset}.{off_events_table}",
+    [(f"{pipeline_dataset}.{pipeline_table}", (0, 1))]
+)
+
 # Store commands
 cmds = []
-for t in tp:
+for t in off_dates:
     cmd = utils.make_ais_events_table(
         pipeline_table="{}.{}".format(pipeline_dataset, pipeline_table),
         segs_table="{}.{}".format(pipeline_dataset, segs_table),
@@ -146,20 +155,29 @@ for t in tp:
     cmds.append(cmd)
 
 # test query
-test_cmd = cmds[0].split('|')[0]
-os.system(test_cmd)
+if cmds:
+    test_cmd = cmds[0].split('|')[0]
+    os.system(test_cmd)
 # os.system(cmds[0])
 
 # Run queries
-utils.execute_commands_in_parallel(commands=cmds)
+results = utils.execute_commands_in_parallel(commands=cmds)
+planner.record_results(results)
 
 # ### On events
 #
 # Generate on events.
 
+# On events read yesterday and today
+on_dates = planner.plan_partitions(
+    tp,
+    f"{destination_dataset}.{on_events_table}",
+    [(f"{pipeline_dataset}.{pipeline_table}", (-1, 0))]
+)
+
 # Store commands
 on_cmds = []
-for t in tp:
+for t in on_dates:
     cmd = utils.make_ais_events_table(
         pipeline_table="{}.{}".format(pipeline_dataset, pipeline_table),
         segs_table="{}.{}".format(pipeline_dataset, segs_table),
@@ -172,11 +190,13 @@ for t in tp:
     on_cmds.append(cmd)
 
 # test query
-test_cmd = on_cmds[0].split('|')[0]
-os.system(test_cmd)
+if on_cmds:
+    test_cmd = on_cmds[0].split('|')[0]
+    os.system(test_cmd)
 
 # Run queries
-utils.execute_commands_in_parallel(commands=on_cmds)
+results = utils.execute_commands_in_parallel(commands=on_cmds)
+planner.record_results(results)
 
 # ### Gap events
 #
@@ -313,8 +333,9 @@ if create_tables:
 #
 # ### Create tables
 
-sat_reception_measured = 'sat_reception_measured_one_degree_{}'.format(output_version)
-sat_reception_smoothed = 'sat_reception_smoothed_one_degree_{}'.format(output_version)
+# Table names include the grid resolution set by config.inverse_delta_degrees
+sat_reception_measured = config.sat_reception_measured
+sat_reception_smoothed = config.sat_reception_smoothed
 
 if create_tables:
     # measured reception quality
@@ -351,14 +372,12 @@ utils.execute_commands_in_parallel(mr_cmds)
 
 # ### Smoothed reception quality
 #
-# Next, interpolate the measured reception quality using a radial basis function.
+# Next, interpolate the measured reception quality using a radial basis function. All months are fetched in one query and each month and AIS class is smoothed in its own process.
 
-for r in reception_dates:
-    print(str(r.date()))
-    utils.make_smooth_reception_table(start_date = r,
-                                      reception_measured_table = sat_reception_measured,
-                                      destination_dataset = destination_dataset,
-                                      destination_table = sat_reception_smoothed)
+smoothed_reception = utils.make_smooth_reception_tables(reception_dates = reception_dates,
+                                                        reception_measured_table = sat_reception_measured,
+                                                        destination_dataset = destination_dataset,
+                                                        destination_table = sat_reception_smoothed)
 
 # ### Plot reception quality
 #
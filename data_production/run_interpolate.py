@@ -4,6 +4,7 @@ import os
 import subprocess
 from ais_disabling import utils
 from ais_disabling import config
+from ais_disabling import planner
 from google.cloud.exceptions import NotFound
 from google.cloud import bigquery
 from jinja2 import Template
@@ -22,17 +23,28 @@ steps_to_run = ['loitering']
 
 if 'gaps' in steps_to_run:
 
+    destination_dataset = config.destination_dataset
+    gap_positions_hourly_table = config.gap_positions_hourly_table
+
+    # Only (re)build days that are missing or older than the gap
+    # features table, which is not partitioned by day
+    gap_dates = planner.plan_partitions(
+        config.tp,
+        f"{destination_dataset}.{gap_positions_hourly_table}",
+        [(f"{destination_dataset}.{config.gap_events_features_table}", None)]
+    )
+
     # Store commands
     gap_int_cmds = []
-    for t in tp:
+    for t in gap_dates:
         cmd = utils.make_hourly_gap_interpolation_table(date = t,
-                                                        output_version = output_version,
+                                                        output_version = config.output_version,
                                                         destination_dataset = destination_dataset,
                                                         destination_table = gap_positions_hourly_table)
         gap_int_cmds.append(cmd)
 
     # test query
-    if config.test_run:
+    if config.test_run and gap_int_cmds:
         test_cmd = gap_int_cmds[0].split('|')[0]
         print(test_cmd)
         os.system(test_cmd)
@@ -49,7 +61,8 @@ if 'gaps' in steps_to_run:
             utils.make_bq_partitioned_table(destination_dataset, gap_positions_hourly_table)
 
         # Run commands
-        utils.execute_commands_in_parallel(gap_int_cmds)
+        results = utils.execute_commands_in_parallel(gap_int_cmds)
+        planner.record_results(results)
 
 #########################################################################
 # 2. Interpolate AIS positions
@@ -58,8 +71,14 @@ if 'gaps' in steps_to_run:
 if 'ais' in steps_to_run:
     print("Running AIS interpolation")
     # Store commands
+    # Positions are interpolated from yesterday through tomorrow
+    ais_dates = planner.plan_partitions(
+        config.tp,
+        f"{config.destination_dataset}.{config.ais_positions_hourly}",
+        [(f"{config.pipeline_dataset}.{config.pipeline_table}", (-1, 0, 1))]
+    )
     ais_int_cmds = []
-    for t in config.tp:
+    for t in ais_dates:
         cmd = utils.make_hourly_interpolation_table(
             date = t,
             pipeline_dataset = config.pipeline_dataset,
@@ -71,7 +90,7 @@ if 'ais' in steps_to_run:
         ais_int_cmds.append(cmd)
 
     # test query
-    if config.test_run:
+    if config.test_run and ais_int_cmds:
         test_cmd = ais_int_cmds[0].split('|')[0]
         print(test_cmd)
         os.system(test_cmd)
@@ -88,7 +107,8 @@ if 'ais' in steps_to_run:
             utils.make_bq_partitioned_table(config.destination_dataset, config.ais_positions_hourly)
 
         # Run commands
-        utils.execute_commands_in_parallel(ais_int_cmds)
+        results = utils.execute_commands_in_parallel(ais_int_cmds)
+        planner.record_results(results)
 
 #########################################################################
 # 2. Interpolate loitering positions
@@ -97,8 +117,13 @@ if 'ais' in steps_to_run:
 if 'loitering' in steps_to_run:
     print("Running AIS interpolation")
     # Store commands
+    loit_dates = planner.plan_partitions(
+        config.tp,
+        f"{config.destination_dataset}.{config.loitering_positions_hourly_table}",
+        [(f"{config.destination_dataset}.{config.loitering_events_table}", None)]
+    )
     loit_int_cmds = []
-    for t in config.tp:
+    for t in loit_dates:
         cmd = utils.make_hourly_loitering_interpolation_table(
             date = t,
             destination_dataset = config.destination_dataset,
@@ -109,7 +134,7 @@ if 'loitering' in steps_to_run:
         loit_int_cmds.append(cmd)
 
     # test query
-    if config.test_run:
+    if config.test_run and loit_int_cmds:
         test_cmd = loit_int_cmds[0].split('|')[0]
         print(test_cmd)
         os.system(test_cmd)
@@ -126,4 +151,5 @@ if 'loitering' in steps_to_run:
             utils.make_bq_partitioned_table(config.destination_dataset, config.loitering_positions_hourly_table)
 
         # Run commands
-        utils.execute_commands_in_parallel(loit_int_cmds)
+        results = utils.execute_commands_in_parallel(loit_int_cmds)
+        planner.record_results(results)
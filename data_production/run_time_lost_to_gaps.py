@@ -1,9 +1,9 @@
 # run_time_lost_to_gaps.py
 
 import os
-import subprocess
 from ais_disabling import utils
 from ais_disabling import config
+from ais_disabling.query_cache import QueryCache
 from google.cloud.exceptions import NotFound
 from google.cloud import bigquery
 from jinja2 import Template
@@ -22,6 +22,9 @@ tp = config.tp
 gap_positions_hourly_table = config.gap_positions_hourly_table
 raster_gaps_table = config.raster_gaps_table
 
+# Skip queries that already ran against unchanged input tables
+query_cache = QueryCache()
+
 # Which steps to run
 steps_to_run = ['allocate_gaps_interpolate']
 
@@ -49,7 +52,7 @@ if 'raster_gaps' in steps_to_run:
         print(query)
 
     if config.test_run is False:
-        subprocess.run("bq query".split(), input=bytes(query, "utf-8"))
+        query_cache.run_query(query)
 
 #########################################################################
 # 2. Normalize rasterized gaps
@@ -71,7 +74,7 @@ if 'normalize_gaps' in steps_to_run:
 
     if config.test_run is False:
         # print(query)
-        subprocess.run("bq query".split(), input=bytes(query, "utf-8"))
+        query_cache.run_query(query)
 
 #########################################################################
 # 3. Spatially allocate gaps
@@ -101,7 +104,7 @@ if 'allocate_gaps_raster' in steps_to_run:
 
     if config.test_run is False:
         # print(query)
-        subprocess.run("bq query".split(), input=bytes(query, "utf-8"))
+        query_cache.run_query(query)
 
 #
 # Allocate gaps via interpolation method
@@ -127,7 +130,7 @@ if 'allocate_gaps_interpolate' in steps_to_run:
 
     if config.test_run is False:
         # print(query)
-        subprocess.run("bq query".split(), input=bytes(query, "utf-8"))
+        query_cache.run_query(query)
 
 #########################################################################
 # 4. Spatially allocate fishing activity
@@ -156,4 +159,6 @@ if 'grid_fishing' in steps_to_run:
 
     if config.test_run is False:
         # print(query)
-        subprocess.run("bq query".split(), input=bytes(query, "utf-8"))
+        query_cache.run_query(query)
+
+query_cache.report()
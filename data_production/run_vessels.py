@@ -1,15 +1,18 @@
 # run_vessels.py
 
-import subprocess
 from jinja2 import Template
 
 from ais_disabling import config
+from ais_disabling.query_cache import QueryCache
 
 #########################################################################
 # VESSEL LIST
 # Produce the list of fishing vessels used for the analysis
 #########################################################################
 
+# Skip the query if it already ran against unchanged input tables
+query_cache = QueryCache()
+
 with open('data_production/vessels/fishing_vessels.sql.j2') as f:
     template = Template(f.read())
 
@@ -25,4 +28,5 @@ if config.test_run:
     print(query)
 
 if config.test_run is False:
-    subprocess.run("bq query".split(), input=bytes(query, "utf-8"))
+    query_cache.run_query(query)
+    query_cache.report()
@@ -3,7 +3,7 @@ import os
 import json
 import time
 import pandas as pd
-import sklearn.metrics as skm
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from sklearn.model_selection import GroupShuffleSplit
 from ais_disabling.threshold_models import SingleThresholdClassifier, DoubleThresholdClassifier
@@ -12,7 +12,7 @@ from ais_disabling.model_utils import (
     get_gaps,
     create_training_set,
     generate_kfolds,
-    cross_validate_threshold_model,
+    batch_cross_validate_threshold_models,
     results_to_json,
     fit_threshold_model
 )
@@ -26,7 +26,7 @@ SAVED_GAPS = f"{DATA_FOLDER}/labeled_gaps.csv"
 LOAD_SAVED_GAPS = True
 
 
-def run_model_selection(models_folder, lowest_rec, run_double=False):
+def load_labeled_gaps():
 
     # Grab labeled gaps
     if LOAD_SAVED_GAPS and os.path.exists(SAVED_GAPS):
@@ -34,6 +34,14 @@ def run_model_selection(models_folder, lowest_rec, run_double=False):
     else:
         df_gaps = get_gaps(GAPS_LABELED)
         df_gaps.to_csv(SAVED_GAPS)
+    return df_gaps
+
+
+def run_model_selection(models_folder, lowest_rec, run_double=False, df_gaps=None):
+
+    # Grab labeled gaps if they were not passed in
+    if df_gaps is None:
+        df_gaps = load_labeled_gaps()
 
     # Filter gaps based on off reception and distance from shore
     df_gaps = df_gaps[df_gaps.positions_per_day_off > lowest_rec].copy().reset_index(drop=True)
@@ -69,66 +77,41 @@ def run_model_selection(models_folder, lowest_rec, run_double=False):
     ## Specify the groups that will be used for generating the folds.
     groups = df_gaps_train.ssvid.to_numpy()
 
-    ## Create a custom scorer based on F0.5 Score
-    fhalf_scorer = skm.make_scorer(skm.fbeta_score, beta=0.5, average="binary")
-
-    ## Set whether the cross validation should return the estimator instances.
-    ## Set True for debugging and investigation purposes.
-    ## Otherwise set False to speed up execution.
-    return_estimator = False
-
     y = df_gaps_train.actual_gap_class.to_numpy()
 
-    ## 12hb model
-    X = df_gaps_train[["positions_12_hours_before_sat"]].to_numpy()
-    cv_results_12hb = cross_validate_threshold_model(X, y, SingleThresholdClassifier, NUM_REPEATS, gss_list, return_estimator, fhalf_scorer, groups, lowest_rec)
-
-    ## 18hb model
-    X = df_gaps_train[["positions_18_hours_before_sat"]].to_numpy()
-    cv_results_18hb = cross_validate_threshold_model(X, y, SingleThresholdClassifier, NUM_REPEATS, gss_list, return_estimator, fhalf_scorer, groups, lowest_rec)
-
-    ## 24hb model
-    X = df_gaps_train[["positions_24_hours_before_sat"]].to_numpy()
-    cv_results_24hb = cross_validate_threshold_model(X, y, SingleThresholdClassifier, NUM_REPEATS, gss_list, return_estimator, fhalf_scorer, groups, lowest_rec)
-
-    ## rec_only model
-    X = df_gaps_train[["positions_per_day_off"]].to_numpy()
-    cv_results_rec_only = cross_validate_threshold_model(X, y, SingleThresholdClassifier, NUM_REPEATS, gss_list, return_estimator, fhalf_scorer, groups, lowest_rec)
-    
-    results_json = {
-        "cv_results_12hb": results_to_json(cv_results_12hb),
-        "cv_results_18hb": results_to_json(cv_results_18hb),
-        "cv_results_24hb": results_to_json(cv_results_24hb),
-        "cv_results_rec_only": results_to_json(cv_results_rec_only),
+    ## Single threshold models
+    models = {
+        "12hb": (SingleThresholdClassifier, df_gaps_train[["positions_12_hours_before_sat"]].to_numpy()),
+        "18hb": (SingleThresholdClassifier, df_gaps_train[["positions_18_hours_before_sat"]].to_numpy()),
+        "24hb": (SingleThresholdClassifier, df_gaps_train[["positions_24_hours_before_sat"]].to_numpy()),
+        "rec_only": (SingleThresholdClassifier, df_gaps_train[["positions_per_day_off"]].to_numpy()),
     }
 
+    ## Double threshold models
     if run_double:
-        start_time = time.time()
-
-        # rec_12hb model
-        X = df_gaps_train[
-            ["positions_per_day_off", "positions_12_hours_before_sat"]
-        ].to_numpy()
-        cv_results_rec_12hb = cross_validate_threshold_model(X, y, DoubleThresholdClassifier, NUM_REPEATS, gss_list, return_estimator, fhalf_scorer, groups, lowest_rec)
-        results_json['cv_results_rec_12hb'] = results_to_json(cv_results_rec_12hb)
-
-        # rec_18hb model
-        X = df_gaps_train[
-            ["positions_per_day_off", "positions_18_hours_before_sat"]
-        ].to_numpy()
-        cv_results_rec_18hb = cross_validate_threshold_model(X, y, DoubleThresholdClassifier, NUM_REPEATS, gss_list, return_estimator, fhalf_scorer, groups, lowest_rec)
-        results_json['cv_results_rec_18hb'] = results_to_json(cv_results_rec_18hb)
+        models["rec_12hb"] = (
+            DoubleThresholdClassifier,
+            df_gaps_train[["positions_per_day_off", "positions_12_hours_before_sat"]].to_numpy(),
+        )
+        models["rec_18hb"] = (
+            DoubleThresholdClassifier,
+            df_gaps_train[["positions_per_day_off", "positions_18_hours_before_sat"]].to_numpy(),
+        )
+        models["rec_24hb"] = (
+            DoubleThresholdClassifier,
+            df_gaps_train[["positions_per_day_off", "positions_24_hours_before_sat"]].to_numpy(),
+        )
+
+    ## Cross validate every model against the same folds, scoring with F0.5
+    start_time = time.time()
+    cv_results = batch_cross_validate_threshold_models(models, y, NUM_REPEATS, gss_list, groups, lowest_rec)
+    end_time = time.time()
+    print("TIME LAPSED (seconds):", end_time - start_time)
 
-        # rec_24hb model
-        X = df_gaps_train[
-            ["positions_per_day_off", "positions_24_hours_before_sat"]
-        ].to_numpy()
-        cv_results_rec_24hb = cross_validate_threshold_model(X, y, DoubleThresholdClassifier, NUM_REPEATS, gss_list, return_estimator, fhalf_scorer, groups, lowest_rec)
-        results_json['cv_results_rec_24hb'] = results_to_json(cv_results_rec_24hb)
-        
-        end_time = time.time()
-        print(start_time, end_time)
-        print("TIME LAPSED:", (end_time - start_time)/(60*60))
+    results_json = {
+        f"cv_results_{model_name}": results_to_json(model_results)
+        for model_name, model_results in cv_results.items()
+    }
 
     # WRITE OUT MODEL RESULTS
     try:
@@ -147,22 +130,22 @@ def run_model_selection(models_folder, lowest_rec, run_double=False):
     # 12hb
     X = df_gaps_train[["positions_12_hours_before_sat"]].to_numpy()
     model_12hb = fit_threshold_model(X, y, SingleThresholdClassifier, model_name='12hb', lowest_rec=lowest_rec)
-    model_12hb.save(f"{models_folder}/model_12hb.json")
+    model_12hb.save(f"{models_folder}/model_12hb.npz")
 
     # 18hb
     X = df_gaps_train[["positions_18_hours_before_sat"]].to_numpy()
     model_18hb = fit_threshold_model(X, y, SingleThresholdClassifier, model_name='18hb', lowest_rec=lowest_rec)
-    model_18hb.save(f"{models_folder}/model_18hb.json")
+    model_18hb.save(f"{models_folder}/model_18hb.npz")
 
     # 24hb
     X = df_gaps_train[["positions_24_hours_before_sat"]].to_numpy()
     model_24hb = fit_threshold_model(X, y, SingleThresholdClassifier, model_name='24hb', lowest_rec=lowest_rec)
-    model_24hb.save(f"{models_folder}/model_24hb.json")
+    model_24hb.save(f"{models_folder}/model_24hb.npz")
 
     # rec_only
     X = df_gaps_train[["positions_per_day_off"]].to_numpy()
     model_rec_only = fit_threshold_model(X, y, SingleThresholdClassifier, model_name='rec_only', lowest_rec=lowest_rec)
-    model_rec_only.save(f"{models_folder}/model_rec_only.json")
+    model_rec_only.save(f"{models_folder}/model_rec_only.npz")
 
     if run_double:
         # rec_12hb
@@ -170,21 +153,59 @@ def run_model_selection(models_folder, lowest_rec, run_double=False):
             ["positions_per_day_off", "positions_12_hours_before_sat"]
         ].to_numpy()        
         model_rec_12hb = fit_threshold_model(X, y, DoubleThresholdClassifier, model_name='rec_12hb', lowest_rec=lowest_rec)
-        model_rec_12hb.save(f"{models_folder}/model_rec_12hb.json")
+        model_rec_12hb.save(f"{models_folder}/model_rec_12hb.npz")
 
         # rec_18hb
         X = df_gaps_train[
             ["positions_per_day_off", "positions_18_hours_before_sat"]
         ].to_numpy()        
         model_rec_18hb = fit_threshold_model(X, y, DoubleThresholdClassifier, model_name='rec_12hb', lowest_rec=lowest_rec)
-        model_rec_18hb.save(f"{models_folder}/model_rec_18hb.json")
+        model_rec_18hb.save(f"{models_folder}/model_rec_18hb.npz")
 
         # rec_24hb
         X = df_gaps_train[
             ["positions_per_day_off", "positions_24_hours_before_sat"]
         ].to_numpy()        
         model_rec_24hb = fit_threshold_model(X, y, DoubleThresholdClassifier, model_name='rec_12hb', lowest_rec=lowest_rec)
-        model_rec_24hb.save(f"{models_folder}/model_rec_24hb.json")
+        model_rec_24hb.save(f"{models_folder}/model_rec_24hb.npz")
+
+
+# Labeled gaps shared by the sweep worker processes. They are sent
+# once to each worker when the pool starts rather than with every task.
+_sweep_gaps = None
+
+
+def _init_sweep_worker(df_gaps):
+    global _sweep_gaps
+    _sweep_gaps = df_gaps
+
+
+def _run_sweep_config(models_folder, lowest_rec, run_double):
+    run_model_selection(models_folder, lowest_rec, run_double, df_gaps=_sweep_gaps)
+    return lowest_rec
+
+
+def run_sensitivity_sweep(lowest_recs, run_double=False, max_workers=None):
+    """Run model selection for several values of lowest_rec.
+
+    The labeled gaps are loaded once and each lowest_rec is run in
+    its own worker process. Results are written to the same
+    `models_{lowest_rec}ppd` folders as a single run.
+    """
+    df_gaps = load_labeled_gaps()
+
+    # Create the folders up front so the workers don't race to create them.
+    models_folders = {lowest_rec: get_models_folder(lowest_rec) for lowest_rec in lowest_recs}
+
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             initializer=_init_sweep_worker,
+                             initargs=(df_gaps,)) as executor:
+        futures = [
+            executor.submit(_run_sweep_config, models_folders[lowest_rec], lowest_rec, run_double)
+            for lowest_rec in lowest_recs
+        ]
+        for future in as_completed(futures):
+            print(f"Finished model selection for lowest_rec = {future.result()}")
 
 
 if __name__ == "__main__":
@@ -195,7 +216,16 @@ if __name__ == "__main__":
     # The minimum reception at which gaps will be considered.
     # All gaps under this reception are discarded for model
     # selection and the final dataset.
-    parser.add_argument('--lowest_rec', type=int, required=True)
+    parser.add_argument('--lowest_rec', type=int, required=False)
+
+    # Run the sensitivity analysis instead of a single model selection.
+    # Model selection is run once for each lowest_rec listed here
+    # in parallel worker processes.
+    parser.add_argument('--lowest_rec_sweep', type=int, nargs='+', required=False)
+
+    # Number of worker processes for the sensitivity analysis.
+    # Defaults to the number of processors on the machine.
+    parser.add_argument('--max_workers', type=int, required=False)
 
     # Determines whether the higher computation models should be run.
     # Set to False when debugging or testing out new
@@ -204,7 +234,7 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
     lowest_rec = args.lowest_rec
-    if not lowest_rec:
+    if lowest_rec is None:
         lowest_rec = 10
         
     run_double = args.run_double
@@ -214,7 +244,11 @@ if __name__ == "__main__":
     if not os.path.exists(DATA_FOLDER):
         os.makedirs(DATA_FOLDER)
 
-    models_folder = get_models_folder(lowest_rec)
+    if args.lowest_rec_sweep:
+        print(f"Running sensitivity analysis:\n\tlowest_rec = {args.lowest_rec_sweep}")
+        run_sensitivity_sweep(args.lowest_rec_sweep, run_double, args.max_workers)
+    else:
+        models_folder = get_models_folder(lowest_rec)
 
-    print(f"Running model selection:\n\tlowest_rec = {lowest_rec}\n\tmodels_folder = {models_folder}")
-    run_model_selection(models_folder, lowest_rec, run_double)
+        print(f"Running model selection:\n\tlowest_rec = {lowest_rec}\n\tmodels_folder = {models_folder}")
+        run_model_selection(models_folder, lowest_rec, run_double)
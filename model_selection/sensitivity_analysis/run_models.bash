@@ -1,13 +1 @@
-python -m model_selection --lowest_rec 0
-python -m model_selection --lowest_rec 5
-python -m model_selection --lowest_rec 10
-python -m model_selection --lowest_rec 15
-python -m model_selection --lowest_rec 20
-python -m model_selection --lowest_rec 25
-python -m model_selection --lowest_rec 30
-python -m model_selection --lowest_rec 35
-python -m model_selection --lowest_rec 40
-python -m model_selection --lowest_rec 45
-python -m model_selection --lowest_rec 50
-python -m model_selection --lowest_rec 55
-python -m model_selection --lowest_rec 60
+python -m model_selection --lowest_rec_sweep 0 5 10 15 20 25 30 35 40 45 50 55 60
@@ -16,6 +16,8 @@
 
 # %%
 from ais_disabling.threshold_models import SingleThresholdClassifier
+from ais_disabling.model_utils import get_model_filename
+from ais_disabling import data_cache
 
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -50,7 +52,7 @@ AND (DATE(gap_start) >= '2017-01-01' AND DATE(gap_end) <= '2019-12-31')
 AND (off_distance_from_shore_m > 50*1852)
 """
 
-df_all_gaps = pd.read_gbq(q, project_id="world-fishing-827", dialect="standard")
+df_all_gaps = data_cache.read_gbq(q, project_id="world-fishing-827", dialect="standard")
 
 # %%
 MODELS_FOLDER_0PPD = f"{models_folder}/models_0ppd"
@@ -74,16 +76,16 @@ def load_models(models_folder):
        
     # Load in the fitted models
     model_12hb = SingleThresholdClassifier()
-    model_12hb.load(f"{models_folder}/model_12hb.json")
+    model_12hb.load(get_model_filename(models_folder, "12hb"))
 
     model_18hb = SingleThresholdClassifier()
-    model_18hb.load(f"{models_folder}/model_18hb.json")
+    model_18hb.load(get_model_filename(models_folder, "18hb"))
 
     model_24hb = SingleThresholdClassifier()
-    model_24hb.load(f"{models_folder}/model_24hb.json")
+    model_24hb.load(get_model_filename(models_folder, "24hb"))
 
     model_rec_only = SingleThresholdClassifier(model_name="rec_only")
-    model_rec_only.load(f"{models_folder}/model_rec_only.json")
+    model_rec_only.load(get_model_filename(models_folder, "rec_only"))
 
     return model_12hb, model_18hb, model_24hb, model_rec_only
 
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+from ais_disabling import gap_stitcher
+
+
+def _off_events(ssvid, off_timestamp, next_timestamp):
+    return pd.DataFrame({
+        "ssvid": ssvid,
+        "off_timestamp": pd.to_datetime(off_timestamp, utc=True),
+        "next_timestamp": pd.to_datetime(next_timestamp, utc=True),
+    })
+
+
+def _on_events(ssvid, on_timestamp, prev_timestamp):
+    return pd.DataFrame({
+        "ssvid": ssvid,
+        "on_timestamp": pd.to_datetime(on_timestamp, utc=True),
+        "prev_timestamp": pd.to_datetime(prev_timestamp, utc=True),
+    })
+
+
+def test_pair_gap_events_keeps_latest_open_gap_without_on_events():
+    # Open gaps share a NULL on_timestamp, so only the latest of each vessel is kept
+    off = _off_events(["1", "1", "1", "2", "2", "3"],
+                      ["2019-01-01 01:00", "2019-01-01 05:00", "2019-01-01 09:00",
+                       "2019-01-01 02:00", "2019-01-01 03:00", "2019-01-01 04:00"],
+                      [None, None, None, None, "2019-01-02 01:00", "2019-01-01 20:00"])
+    on = _on_events([], [], [])
+
+    off_index, on_index, is_open = gap_stitcher.pair_gap_events(off, on, "2019-01-01")
+
+    assert len(off_index) == 0 and len(on_index) == 0
+    np.testing.assert_array_equal(is_open, [False, False, True, False, True, False])
+
+
+def test_pair_gap_events_keeps_latest_open_gap_with_on_events():
+    off = _off_events(["1", "1", "1", "2"],
+                      ["2019-01-01 01:00", "2019-01-01 05:00", "2019-01-01 09:00",
+                       "2019-01-01 02:00"],
+                      [None, "2019-01-01 08:00", None, None])
+    on = _on_events(["1", "2"], ["2019-01-01 08:00", "2019-01-01 23:00"],
+                    ["2019-01-01 05:00", None])
+
+    off_index, on_index, is_open = gap_stitcher.pair_gap_events(off, on, "2019-01-01")
+
+    assert sorted(zip(off_index, on_index)) == [(1, 0), (3, 1)]
+    np.testing.assert_array_equal(is_open, [False, False, True, False])
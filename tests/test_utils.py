@@ -0,0 +1,42 @@
+from ais_disabling import config, utils
+
+
+def test_make_ais_gap_events_table_renders():
+    cmd = utils.make_ais_gap_events_table(off_events_table="ais_off_events",
+                                          on_events_table="ais_on_events",
+                                          date="2019-12-31",
+                                          precursors_dataset="precursors",
+                                          destination_dataset="destination",
+                                          destination_table="ais_gap_events")
+
+    assert 'off_events_table="precursors.ais_off_events"' in cmd
+    assert 'on_events_table="precursors.ais_on_events"' in cmd
+    assert 'date="2019-12-31"' in cmd
+    assert "--destination_table=destination.ais_gap_events" in cmd
+
+
+def test_make_ais_gap_events_features_table_renders():
+    cmd = utils.make_ais_gap_events_features_table(pipeline_version="v20201001",
+                                                   vi_version="v20220701",
+                                                   output_version="v20220801",
+                                                   start_date="2017-01-01",
+                                                   end_date="2019-12-31",
+                                                   destination_dataset="destination",
+                                                   destination_table="ais_gap_events_features")
+
+    assert f'reception_smoothed_table="{config.sat_reception_smoothed}"' in cmd
+    assert f'inverse_delta_degrees="{config.inverse_delta_degrees}"' in cmd
+    assert "--destination_table=destination.ais_gap_events_features" in cmd
+
+    cmd = utils.make_ais_gap_events_features_table(pipeline_version="v20201001",
+                                                   vi_version="v20220701",
+                                                   output_version="v20220801",
+                                                   start_date="2017-01-01",
+                                                   end_date="2019-12-31",
+                                                   destination_dataset="destination",
+                                                   destination_table="ais_gap_events_features",
+                                                   reception_smoothed_table="reception_half_degree",
+                                                   inverse_delta_degrees=2)
+
+    assert 'reception_smoothed_table="reception_half_degree"' in cmd
+    assert 'inverse_delta_degrees="2"' in cmd